@@ -0,0 +1,104 @@
+import json
+import logging
+from functools import partial
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve, reverse
+from eLearning_app.parallel import run_in_parallel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_MAX_REQUESTS = 20
+DEFAULT_BATCH_MAX_WORKERS = 4
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Response headers returned with each sub-response
+FORWARDED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Location', 'Allow')
+
+# Headers of the batch request itself that must not leak into its sub-requests
+DROPPED_META = {
+    'HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+    'HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE', 'CONTENT_TYPE', 'CONTENT_LENGTH',
+}
+
+
+def batch_max_requests():
+    return getattr(settings, 'API_BATCH_MAX_REQUESTS', DEFAULT_BATCH_MAX_REQUESTS)
+
+
+def batch_max_workers():
+    return getattr(settings, 'API_BATCH_MAX_WORKERS', DEFAULT_BATCH_MAX_WORKERS)
+
+
+def build_sub_request(request, method, path, body=None, headers=None):
+    """
+    Build the HttpRequest for one sub-request from the batch request's environment.
+    The batch request's user and token are reused through DRF's forced authentication,
+    so sub-requests skip the JWT check.
+    """
+    url = urlsplit(path)
+    payload = b'' if body is None else json.dumps(body).encode()
+    environ = {key: value for key, value in request.META.items() if key not in DROPPED_META}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': BytesIO(payload),
+        'wsgi.url_scheme': request.scheme,
+    })
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+    sub_request = WSGIRequest(environ)
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def _sub_response(status, body=None, headers=None):
+    return {'status': status, 'headers': headers or {}, 'body': body}
+
+
+def dispatch_sub_request(request, item):
+    """ Run one {'method', 'path', 'body', 'headers'} item through the API view it resolves to """
+    path = urlsplit(item['path']).path
+    try:
+        match = resolve(path)
+    except Resolver404:
+        match = None
+    # Only API endpoints can be batched, and a batch cannot contain another one
+    if match is None or not path.startswith(reverse('api-root')) or match.url_name == 'batch':
+        return _sub_response(404, {'detail': 'Not found.'})
+
+    sub_request = build_sub_request(
+        request, item['method'], item['path'], item.get('body'), item.get('headers'))
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("Batched %s %s failed", item['method'], item['path'])
+        return _sub_response(500, {'detail': 'Server error.'})
+
+    headers = {name: response[name] for name in FORWARDED_HEADERS if response.has_header(name)}
+    return _sub_response(response.status_code, getattr(response, 'data', None), headers)
+
+
+def run_batch(request, items, parallel=False):
+    """
+    Run the batch's sub-requests and return their responses in request order.
+
+    Sub-requests run one after the other on the request's own database connection.
+    With `parallel`, a batch of reads runs on up to API_BATCH_MAX_WORKERS threads
+    instead, each with its own connection; batches holding a write always run in
+    order, and so does any batch started inside a transaction (see run_in_parallel).
+    """
+    if not parallel or not all(item['method'] in SAFE_METHODS for item in items):
+        return [dispatch_sub_request(request, item) for item in items]
+    return run_in_parallel(
+        [partial(dispatch_sub_request, request, item) for item in items],
+        batch_max_workers(), thread_name_prefix='api-batch')
@@ -0,0 +1,64 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from eLearning_app.versions import get_versions
+
+# Cached bodies also carry the version stamps in their key, so the timeout only bounds memory use
+DEFAULT_RESPONSE_CACHE_TIMEOUT = 300
+
+
+def response_cache_timeout():
+    return getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', DEFAULT_RESPONSE_CACHE_TIMEOUT)
+
+
+def response_cache_key(name, action, scope, request, version_scopes):
+    """
+    Build the cache key of one API response. Any save, delete or relation change
+    on the models behind `version_scopes` bumps their stamps and so changes the key.
+    """
+    versions = get_versions(*version_scopes)
+    parts = [
+        name, action, scope, request.get_host(), request.path,
+        *(f'{param}={value}' for param, values in sorted(request.query_params.lists())
+          for value in values),
+        *(f'{scope}={versions[scope]}' for scope in sorted(versions)),
+    ]
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return f'api-response:{name}:{digest}'
+
+
+def _stats_key(name, event):
+    return f'api-response-stats:{name}:{event}'
+
+
+def record_cache_event(name, event):
+    """ Count a 'hits' or 'misses' event for the cached viewset `name` """
+    key = _stats_key(name, event)
+    # add() creates the counter, incr() is atomic on both local memory and Redis
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter was evicted between add() and incr()
+            cache.set(key, 1, None)
+
+
+def response_cache_stats(names):
+    """ Return {name: {'hits', 'misses', 'hit_rate'}} for each cached viewset name """
+    keys = {_stats_key(name, event): (name, event)
+            for name in names for event in ('hits', 'misses')}
+    stored = cache.get_many(keys)
+    stats = {name: {'hits': 0, 'misses': 0} for name in names}
+    for key, count in stored.items():
+        name, event = keys[key]
+        stats[name][event] = count
+    for counts in stats.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / total, 3) if total else None
+    return stats
+
+
+def reset_response_cache_stats(names):
+    cache.delete_many([_stats_key(name, event)
+                       for name in names for event in ('hits', 'misses')])
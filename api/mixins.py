@@ -0,0 +1,264 @@
+from django.core.cache import cache
+from rest_framework import permissions, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.response import Response
+from eLearning_app.versions import compute_validators, not_modified_response, set_validators
+from .caching import record_cache_event, response_cache_key, response_cache_timeout
+
+
+def _requested_names(request, param):
+    value = request.query_params.get(param) if request is not None else None
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def requested_fields(request):
+    """Return the field names asked for with ?fields=, or None when all fields are wanted."""
+    return _requested_names(request, 'fields')
+
+
+def requested_expansions(request):
+    """Return the relation names asked for with ?expand=."""
+    return _requested_names(request, 'expand') or set()
+
+
+class EagerLoadingMixin:
+    """
+    Applies the eager-loading plan a viewset declares for its serializer fields.
+
+    `select_related_fields` and `prefetch_related_fields` map a serializer field
+    name to the related lookups it reads, so serializing a page costs the same
+    number of queries however many rows it holds. Lookups for fields left out
+    with ?fields=, or expandable relations not named in ?expand=, are skipped.
+    """
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def is_field_loaded(self, name):
+        """Whether the serializer will render `name` for this request (see DynamicFieldsMixin)."""
+        if self.request.method not in permissions.SAFE_METHODS:
+            return True
+        fields = requested_fields(self.request)
+        if fields is not None and name not in fields:
+            return False
+        expandable = getattr(self.get_serializer_class(), 'expandable_fields', {})
+        return name not in expandable or name in requested_expansions(self.request)
+
+    def get_eager_loading(self):
+        """Return the (select_related, prefetch_related) lookups for this request."""
+        select = [lookup for name, lookups in self.select_related_fields.items()
+                  if self.is_field_loaded(name) for lookup in lookups]
+        prefetch = [lookup for name, lookups in self.prefetch_related_fields.items()
+                    if self.is_field_loaded(name) for lookup in lookups]
+        # Several fields may share a lookup, only ask for it once
+        return list(dict.fromkeys(select)), list(dict.fromkeys(prefetch))
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select, prefetch = self.get_eager_loading()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag/Last-Modified validators to list and retrieve responses and answers
+    304 Not Modified before querying when the client's copy is still current.
+
+    Validators come from the version stamps bumped by model signals (see
+    eLearning_app/versions.py), never from the response body. `version_scopes`
+    names the other collections whose changes show up in this viewset's output.
+    """
+    version_scopes = ()
+
+    def get_model_label(self):
+        return self.queryset.model._meta.model_name
+
+    def get_list_scopes(self):
+        return [self.get_model_label(), *self.version_scopes]
+
+    def get_object_scopes(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return [f'{self.get_model_label()}:{self.kwargs[lookup_url_kwarg]}', *self.version_scopes]
+
+    def conditional_response(self, request, scopes, handler, *args, **kwargs):
+        # The user and query string decide visibility, paging and field selection
+        etag, last_modified = compute_validators(
+            scopes, request.user.pk, request.get_full_path(), request.accepted_media_type)
+        response = not_modified_response(request._request, etag, last_modified)
+        if response is not None:
+            set_validators(response, etag, last_modified)
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_list_scopes(), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_object_scopes(), super().retrieve, *args, **kwargs)
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    Serves list and retrieve bodies from the cache, on top of ConditionalGetMixin.
+
+    Entries are keyed by the viewset, the audience the output is built for (see
+    get_cache_scope), the query parameters and the current version stamps, so a
+    write to any model in the response's scopes makes the old entry unreachable
+    instead of having to find and delete it.
+    """
+    # Set to False when every authenticated user is shown the same rows
+    cache_per_user = True
+
+    def get_cache_name(self):
+        return self.get_model_label()
+
+    def get_cache_scope(self):
+        return f'user:{self.request.user.pk}' if self.cache_per_user else 'shared'
+
+    def conditional_response(self, request, scopes, handler, *args, **kwargs):
+        def cached_handler(request, *args, **kwargs):
+            return self.cached_response(request, scopes, handler, *args, **kwargs)
+        return super().conditional_response(request, scopes, cached_handler, *args, **kwargs)
+
+    def cached_response(self, request, scopes, handler, *args, **kwargs):
+        name = self.get_cache_name()
+        key = response_cache_key(
+            name, self.action, self.get_cache_scope(), request, scopes)
+        data = cache.get(key)
+        if data is not None:
+            record_cache_event(name, 'hits')
+            return Response(data)
+
+        record_cache_event(name, 'misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, response_cache_timeout())
+        return response
+
+
+def _row_id(row):
+    try:
+        return int(row['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class BulkWriteMixin:
+    """
+    Adds /bulk/ to a viewset: POST a list of rows to create them, or PATCH a list
+    of rows that carry an `id` to update them.
+
+    Rows are validated one by one with `bulk_serializer_class` and invalid rows are
+    reported by their index without holding back the others. Related objects are
+    fetched once for the whole request (see preload_related), and the valid rows
+    are written together by perform_bulk_create/perform_bulk_update.
+    """
+    bulk_serializer_class = None
+    # Fields a bulk PATCH may change
+    bulk_update_fields = ()
+    bulk_max_rows = 5000
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        rows = self.get_bulk_rows(request)
+        if not isinstance(rows, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of rows.']})
+        if len(rows) > self.bulk_max_rows:
+            raise ValidationError({'non_field_errors': [
+                f'At most {self.bulk_max_rows} rows can be sent at once.']})
+
+        context = self.get_bulk_context(rows)
+        if request.method == 'POST':
+            return self.bulk_create(rows, context)
+        return self.bulk_update(rows, context)
+
+    def get_bulk_rows(self, request):
+        return request.data
+
+    def get_bulk_context(self, rows):
+        from .serializers import preload_related
+        context = self.get_serializer_context()
+        context['preloaded'] = preload_related(
+            self.bulk_serializer_class, [row for row in rows if isinstance(row, dict)])
+        return context
+
+    def build_bulk_instance(self, validated_data, context):
+        """Return the unsaved instance for one valid row, or raise ValidationError to reject it."""
+        return self.queryset.model(**validated_data)
+
+    def perform_bulk_create(self, instances):
+        raise NotImplementedError
+
+    def perform_bulk_update(self, instances, fields):
+        raise NotImplementedError
+
+    def check_bulk_update_permission(self, instance):
+        self.check_object_permissions(self.request, instance)
+
+    def bulk_create(self, rows, context):
+        instances, indexes, errors = [], [], []
+        for index, row in enumerate(rows):
+            serializer = self.bulk_serializer_class(data=row, context=context)
+            try:
+                serializer.is_valid(raise_exception=True)
+                instance = self.build_bulk_instance(serializer.validated_data, context)
+            except ValidationError as error:
+                errors.append({'index': index, 'errors': error.detail})
+                continue
+            instances.append(instance)
+            indexes.append(index)
+
+        created = self.perform_bulk_create(instances) if instances else []
+        return Response({
+            'created': [{'index': index, 'id': instance.pk}
+                        for index, instance in zip(indexes, created)],
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+    def bulk_update(self, rows, context):
+        ids = {_row_id(row) for row in rows if isinstance(row, dict)} - {None}
+        existing = self.get_queryset().in_bulk(ids)
+
+        instances, indexes, errors, fields = [], [], [], set()
+        for index, row in enumerate(rows):
+            instance = existing.get(_row_id(row)) if isinstance(row, dict) else None
+            try:
+                if instance is None:
+                    raise ValidationError({'id': ['No object with this id.']})
+                self.check_bulk_update_permission(instance)
+                serializer = self.bulk_serializer_class(
+                    instance, data=row, partial=True, context=context)
+                serializer.is_valid(raise_exception=True)
+                locked = set(serializer.validated_data) - set(self.bulk_update_fields)
+                if locked:
+                    raise ValidationError({name: ['This field cannot be changed in bulk.']
+                                           for name in sorted(locked)})
+            except ValidationError as error:
+                errors.append({'index': index, 'errors': error.detail})
+                continue
+            except PermissionDenied as error:
+                errors.append({'index': index, 'errors': {'detail': error.detail}})
+                continue
+
+            for name, value in serializer.validated_data.items():
+                setattr(instance, name, value)
+            fields.update(serializer.validated_data)
+            instances.append(instance)
+            indexes.append(index)
+
+        if instances and fields:
+            self.perform_bulk_update(instances, sorted(fields))
+        return Response({
+            'updated': [{'index': index, 'id': instance.pk}
+                        for index, instance in zip(indexes, instances)],
+            'errors': errors,
+        }, status=status.HTTP_200_OK if instances else status.HTTP_400_BAD_REQUEST)
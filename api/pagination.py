@@ -0,0 +1,31 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class BoundedPageNumberPagination(PageNumberPagination):
+    """Page number pagination whose page size clients may lower or raise up to a fixed cap."""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class IdCursorPagination(CursorPagination):
+    """Opaque cursor pagination over the primary key, newest first, without COUNT or OFFSET scans."""
+    ordering = ('-id',)
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class TimestampCursorPagination(IdCursorPagination):
+    """Cursor pagination over an indexed (timestamp, id) ordering, newest first."""
+    ordering = ('-timestamp', '-id')
+
+
+class UploadDateCursorPagination(IdCursorPagination):
+    """Cursor pagination over an indexed (upload_date, id) ordering, newest first."""
+    ordering = ('-upload_date', '-id')
+
+
+class CreatedCursorPagination(IdCursorPagination):
+    """Cursor pagination over an indexed (created, id) ordering, newest first."""
+    ordering = ('-created', '-id')
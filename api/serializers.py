@@ -1,16 +1,101 @@
-from rest_framework import serializers
-from eLearning_app.models import User, elearnUser, Course, Material, Feedback, StatusUpdate, ChatRoom, Enrollment, EnrollmentNotification, MaterialNotification, BlockNotification
-
-
-class UserSerializer(serializers.ModelSerializer):
+from rest_framework import permissions, serializers
+from eLearning_app.models import User, elearnUser, Course, Material, Feedback, StatusUpdate, ChatRoom, Message, Enrollment, EnrollmentNotification, MaterialNotification, BlockNotification, InboxItem
+from .mixins import requested_expansions, requested_fields
+
+
+class DynamicFieldsMixin:
+    """
+    Lets clients shape read responses: ?fields=a,b keeps only the named fields,
+    and ?expand=x renders an `expandable_fields` relation as a nested object
+    instead of its primary key. Fields are pruned before any row is serialized,
+    so attributes that were not asked for are never read.
+    """
+    # Maps a relation field name to the serializer class used when it is expanded
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only the top-level serializer of a view is given the request
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+
+        fields = requested_fields(request)
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+        for name in requested_expansions(request):
+            if name in self.expandable_fields and name in self.fields:
+                self.fields[name] = self.expandable_fields[name](read_only=True)
+
+
+class ProfilePictureField(serializers.Field):
+    """Read-only field returning the URL of one resized profile picture variant."""
+
+    def __init__(self, size='medium', fmt='webp', **kwargs):
+        self.size = size
+        self.fmt = fmt
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, user):
+        url = user.profile_picture_url(self.size, self.fmt)
+        request = self.context.get('request')
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field that looks ids up in the objects preloaded for a bulk request."""
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+def preload_related(serializer_class, rows):
+    """Fetch the objects every row references through a BulkPrimaryKeyRelatedField, one query per field."""
+    preloaded = {}
+    for name, field in serializer_class().fields.items():
+        if not isinstance(field, BulkPrimaryKeyRelatedField) or field.read_only:
+            continue
+        ids = set()
+        for row in rows:
+            try:
+                ids.add(int(row[name]))
+            except (KeyError, TypeError, ValueError):
+                # Left for the field to report on that row
+                pass
+        preloaded[name] = field.get_queryset().in_bulk(ids)
+    return preloaded
+
+
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for the User model, including basic user information."""
+    profile_picture = ProfilePictureField(size='medium')
+    profile_picture_small = ProfilePictureField(size='small')
+    profile_picture_large = ProfilePictureField(size='large')
+
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name',
-                  'last_name', 'email', 'profile_picture']
+                  'last_name', 'email', 'profile_picture',
+                  'profile_picture_small', 'profile_picture_large']
 
 
-class ElearnUserSerializer(serializers.ModelSerializer):
+class ElearnUserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for the elearnUser model, including nested UserSerializer for user details."""
     user = UserSerializer()
 
@@ -19,7 +104,7 @@ class ElearnUserSerializer(serializers.ModelSerializer):
         fields = ['user', 'user_type']
 
 
-class CourseListSerializer(serializers.ModelSerializer):
+class CourseListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for listing courses, including teacher name and description."""
     teacher_name = serializers.CharField(
         source='teacher.user.get_full_name', read_only=True)
@@ -32,7 +117,7 @@ class CourseListSerializer(serializers.ModelSerializer):
                   'description', 'start_date', 'end_date']
 
 
-class CourseDetailSerializer(serializers.ModelSerializer):
+class CourseDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for detailed course view, including teacher and student details."""
     teacher = ElearnUserSerializer(read_only=True)
     students = ElearnUserSerializer(many=True, read_only=True)
@@ -43,7 +128,7 @@ class CourseDetailSerializer(serializers.ModelSerializer):
                   'students', 'start_date', 'end_date', 'enrollment_status']
 
 
-class StatusUpdateSerializer(serializers.ModelSerializer):
+class StatusUpdateSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for status updates, including user details."""
     user = UserSerializer()
 
@@ -52,7 +137,7 @@ class StatusUpdateSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'content', 'timestamp']
 
 
-class ChatRoomSerializer(serializers.ModelSerializer):
+class ChatRoomSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for chat rooms, including admin and members."""
     admin = UserSerializer()
     members = UserSerializer(many=True)
@@ -62,7 +147,16 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         fields = ['id', 'chat_name', 'admin', 'members']
 
 
-class EnrollmentSerializer(serializers.ModelSerializer):
+class MessageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for chat messages, as returned by the sync feed."""
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'chat_room', 'user', 'username', 'content', 'timestamp']
+
+
+class EnrollmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for course enrollments, linking students and courses."""
     student = serializers.PrimaryKeyRelatedField(
         queryset=elearnUser.objects.all())
@@ -73,18 +167,33 @@ class EnrollmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'student', 'course']
 
 
-class EnrollmentNotificationSerializer(serializers.ModelSerializer):
-    """Serializer for enrollment notifications, including course and user details."""
-    course = CourseListSerializer()
-    student = ElearnUserSerializer()
-    teacher = ElearnUserSerializer()
+class EnrollmentBulkSerializer(EnrollmentSerializer):
+    """Serializer for one row of a bulk enrollment, rejecting students already in the course."""
+    student = BulkPrimaryKeyRelatedField(
+        queryset=elearnUser.objects.filter(user_type='student').select_related('user'))
+    course = BulkPrimaryKeyRelatedField(queryset=Course.objects.all())
+
+    def validate(self, attrs):
+        if (attrs['student'].pk, attrs['course'].pk) in self.context.get('enrolled', ()):
+            raise serializers.ValidationError(
+                "The student is already enrolled in this course.")
+        return attrs
+
+
+class EnrollmentNotificationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for enrollment notifications; course and users are ids unless expanded."""
+    expandable_fields = {
+        'course': CourseListSerializer,
+        'student': ElearnUserSerializer,
+        'teacher': ElearnUserSerializer,
+    }
 
     class Meta:
         model = EnrollmentNotification
-        fields = ['id', 'course', 'student', 'teacher', 'read']
+        fields = ['id', 'course', 'student', 'teacher', 'read', 'timestamp']
 
 
-class FeedbackSerializer(serializers.ModelSerializer):
+class FeedbackSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for feedback, including student name and course name."""
     student_name = serializers.CharField(
         source='student.user.get_full_name', read_only=True)
@@ -99,7 +208,18 @@ class FeedbackSerializer(serializers.ModelSerializer):
         return obj.course.name
 
 
-class MaterialSerializer(serializers.ModelSerializer):
+class FeedbackBulkSerializer(FeedbackSerializer):
+    """Serializer for one row of a bulk feedback request, which names its course."""
+    course = BulkPrimaryKeyRelatedField(
+        queryset=Course.objects.all(), write_only=True)
+
+    class Meta(FeedbackSerializer.Meta):
+        fields = FeedbackSerializer.Meta.fields + ['course']
+        # Caught here so one bad row cannot fail the batch on the database CHECK constraint
+        extra_kwargs = {'rating': {'min_value': 0}}
+
+
+class MaterialSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for materials, including course name and uploader details."""
     course_name = serializers.CharField(
         source='course.name', read_only=True)  # Include course name
@@ -114,23 +234,87 @@ class MaterialSerializer(serializers.ModelSerializer):
                   'file_type', 'course_name', 'uploader_name', 'uploader_type']
 
 
-class MaterialNotificationSerializer(serializers.ModelSerializer):
-    """Serializer for material notifications, including material and student details."""
-    material = MaterialSerializer()
-    student = ElearnUserSerializer()
+class MaterialBulkSerializer(MaterialSerializer):
+    """Serializer for one row of a bulk material request, which names its course."""
+    course = BulkPrimaryKeyRelatedField(
+        queryset=Course.objects.all(), write_only=True)
+
+    class Meta(MaterialSerializer.Meta):
+        fields = MaterialSerializer.Meta.fields + ['course']
+
+
+class MaterialNotificationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for material notifications; material and student are ids unless expanded."""
+    expandable_fields = {
+        'material': MaterialSerializer,
+        'student': ElearnUserSerializer,
+    }
 
     class Meta:
         model = MaterialNotification
-        fields = ['id', 'material', 'student', 'read']
+        fields = ['id', 'material', 'student', 'read', 'timestamp']
+
+
+class BlockNotificationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for block notifications; course and student are ids unless expanded."""
+    expandable_fields = {
+        'course': CourseListSerializer,
+        'student': ElearnUserSerializer,
+    }
+
+    class Meta:
+        model = BlockNotification
+        fields = ['id', 'course', 'student', 'message', 'read', 'timestamp']
 
 
-class BlockNotificationSerializer(serializers.ModelSerializer):
-    """Serializer for block notifications, including user and course details."""
-    course = CourseListSerializer()  
-    student = ElearnUserSerializer()  
-    teacher = ElearnUserSerializer() 
+class InboxItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for inbox items; the payload holds the display fields of the notification."""
 
     class Meta:
-        model = BlockNotification  
-        fields = ['id', 'course', 'student', 'teacher',
-                  'read']  
+        model = InboxItem
+        fields = ['id', 'kind', 'source_id', 'course', 'payload', 'read', 'created']
+
+
+class MarkNotificationsReadSerializer(serializers.Serializer):
+    """Serializer for a bulk mark-as-read request; omitted filters select everything."""
+    type = serializers.ChoiceField(
+        choices=['enrollment', 'material', 'block'], required=False)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False)
+    course = serializers.IntegerField(required=False)
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        # Notification ids are only unique within one type
+        if 'ids' in attrs and 'type' not in attrs:
+            raise serializers.ValidationError(
+                {'type': "Required when selecting notifications by id."})
+        return attrs
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """Serializer for one sub-request of a batch; `path` is an API URL with its query string."""
+    method = serializers.ChoiceField(
+        choices=['GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict) and isinstance(data.get('method'), str):
+            data = {**data, 'method': data['method'].upper()}
+        return super().to_internal_value(data)
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    """Serializer for a batch request; `parallel` lets a batch of reads run concurrently."""
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        from .batch import batch_max_requests
+
+        if len(value) > batch_max_requests():
+            raise serializers.ValidationError(
+                f"At most {batch_max_requests()} requests can be batched.")
+        return value
@@ -29,9 +29,20 @@ router.register(r'enrollmentnotifications',
                 views.EnrollmentNotificationViewSet)
 router.register(r'materialnotifications', views.MaterialNotificationViewSet)
 router.register(r'blocknotifications', views.BlockNotificationViewSet)
+router.register(r'inbox', views.InboxItemViewSet)
 
 urlpatterns = [
+    path('notifications/summary/', views.NotificationSummaryView.as_view(),
+         name='notification-summary'),
+    path('notifications/mark-read/', views.NotificationMarkReadView.as_view(),
+         name='notification-mark-read'),
+    path('batch/', views.BatchView.as_view(), name='batch'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('autocomplete/', views.AutocompleteView.as_view(), name='autocomplete'),
+    path('search/', views.SearchView.as_view(), name='search'),
     path('', include(router.urls)),
+    path('cache-stats/', views.ResponseCacheStatsView.as_view(),
+         name='response-cache-stats'),
 ]
 
 # Swagger UI
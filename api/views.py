@@ -1,10 +1,26 @@
+import json
+from collections import defaultdict
 from rest_framework import viewsets, permissions, mixins, filters
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.views import APIView
+from rest_framework.exceptions import MethodNotAllowed, PermissionDenied, ValidationError
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from eLearning_app.models import User, elearnUser, Course, Material, Feedback, StatusUpdate, ChatRoom, Enrollment, EnrollmentNotification, MaterialNotification, BlockNotification
-from .serializers import UserSerializer, ElearnUserSerializer, CourseListSerializer, MaterialSerializer, FeedbackSerializer, StatusUpdateSerializer, ChatRoomSerializer, EnrollmentSerializer, EnrollmentNotificationSerializer, MaterialNotificationSerializer, BlockNotificationSerializer
+from django.db.models import Q
+from eLearning_app.models import User, elearnUser, Course, Material, Feedback, StatusUpdate, ChatRoom, Message, Enrollment, EnrollmentNotification, MaterialNotification, BlockNotification, InboxItem
+from eLearning_app.autocomplete import autocomplete
+from eLearning_app.change_log import changes_since, latest_token, parse_token
+from eLearning_app.notification_counters import unread_summary
+from eLearning_app.notifications import mark_notifications_read
+from eLearning_app.bulk import create_enrollments, create_materials, create_rows, update_materials, update_rows
+from eLearning_app.storage_accounting import check_storage_quota
+from eLearning_app.unified_search import SEARCHERS, unified_search
+from .batch import run_batch
+from .caching import response_cache_stats
+from .mixins import BulkWriteMixin, CachedResponseMixin, ConditionalGetMixin, EagerLoadingMixin
+from .pagination import CreatedCursorPagination, IdCursorPagination, TimestampCursorPagination, UploadDateCursorPagination
+from .serializers import UserSerializer, ElearnUserSerializer, CourseListSerializer, MaterialSerializer, MaterialBulkSerializer, FeedbackSerializer, FeedbackBulkSerializer, StatusUpdateSerializer, ChatRoomSerializer, MessageSerializer, EnrollmentSerializer, EnrollmentBulkSerializer, MarkNotificationsReadSerializer, BatchRequestSerializer, EnrollmentNotificationSerializer, MaterialNotificationSerializer, BlockNotificationSerializer, InboxItemSerializer
 
 # Custom permission class to allow only owners to update or delete objects
 
@@ -36,7 +52,7 @@ class IsTeacherOrReadOnly(permissions.BasePermission):
         return hasattr(request.user, 'elearnuser') and request.user.elearnuser.user_type == 'teacher'
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
@@ -48,16 +64,33 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         return [permission() for permission in permission_classes]
 
 
-class ElearnUserViewSet(viewsets.ModelViewSet):
+class ElearnUserViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = elearnUser.objects.all()
     serializer_class = ElearnUserSerializer
+    version_scopes = ['user']
+    select_related_fields = {'user': ['user']}
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
 
 
 # Allows full CRUD for teachers, read-only for students
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(CachedResponseMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseListSerializer
+    version_scopes = ['user']
+    select_related_fields = {'teacher_name': ['teacher__user']}
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filterset_fields = ['name', 'code']
+    search_fields = ['name']
+
+    def is_teacher(self):
+        elearnuser = getattr(self.request.user, 'elearnuser', None)
+        return elearnuser is not None and elearnuser.user_type == 'teacher'
+
+    def get_cache_scope(self):
+        # Teachers see their own courses, everyone else sees the same open ones
+        if self.is_teacher():
+            return super().get_cache_scope()
+        return 'students'
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -75,18 +108,28 @@ class CourseViewSet(viewsets.ModelViewSet):
             raise PermissionDenied("Only teachers can create courses.")
 
     def get_queryset(self):
-        if self.request.user.elearnuser.user_type == 'teacher':
-            return Course.objects.filter(teacher=self.request.user.elearnuser)
+        queryset = super().get_queryset()
+        if self.is_teacher():
+            return queryset.filter(teacher=self.request.user.elearnuser)
         else:  # Student
-            return Course.objects.filter(enrollment_status='open')
+            return queryset.filter(enrollment_status='open')
 
 # Allows for full CRUD operations for all logged in users
 
 
-class MaterialViewSet(viewsets.ModelViewSet):
+class MaterialViewSet(BulkWriteMixin, CachedResponseMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Material.objects.all()
     serializer_class = MaterialSerializer
+    bulk_serializer_class = MaterialBulkSerializer
+    bulk_update_fields = ['name', 'description']
+    version_scopes = ['course', 'user']
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UploadDateCursorPagination
+    select_related_fields = {
+        'course_name': ['course'],
+        'uploader_name': ['uploader__user'],
+        'uploader_type': ['uploader'],
+    }
 
     def get_permissions(self):
         # Allows everyone to read, but restrict create/update/delete to owners
@@ -99,22 +142,96 @@ class MaterialViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         # Automatically sets the user as the owner of the material
+        self.check_storage_quota(serializer, self.request.user.elearnuser)
         serializer.save(uploader=self.request.user.elearnuser)
 
+    def perform_update(self, serializer):
+        self.check_storage_quota(serializer, serializer.instance.uploader)
+        serializer.save()
+
+    def check_storage_quota(self, serializer, uploader):
+        # Rejects new or replacement files that would exceed the storage quotas
+        file = serializer.validated_data.get('file')
+        course = serializer.validated_data.get(
+            'course', getattr(serializer.instance, 'course', None))
+        if file is None or course is None:
+            return
+        try:
+            check_storage_quota(course, uploader, file.size,
+                                replacing=serializer.instance)
+        except DjangoValidationError as error:
+            raise ValidationError({'file': error.messages})
+
+    def get_cache_scope(self):
+        # Teachers all see every material, students only their own courses'
+        if self.request.user.elearnuser.user_type == 'teacher':
+            return 'teachers'
+        return super().get_cache_scope()
+
+    def get_bulk_rows(self, request):
+        # Files cannot travel inside JSON, so multipart uploads send the rows as a JSON
+        # `rows` part and each row's `file` names the part holding its file
+        if 'rows' not in request.data:
+            return request.data
+        try:
+            rows = json.loads(request.data['rows'])
+        except ValueError:
+            raise ValidationError({'rows': ['Expected a JSON list of rows.']})
+        if isinstance(rows, list):
+            for row in rows:
+                if isinstance(row, dict) and isinstance(row.get('file'), str):
+                    row['file'] = request.FILES.get(row['file'], row['file'])
+        return rows
+
+    def build_bulk_instance(self, validated_data, context):
+        uploader = self.request.user.elearnuser
+        course = validated_data['course']
+        size = validated_data['file'].size
+        # Bytes accepted from earlier rows count towards the quotas too
+        pending = context.setdefault('pending_storage', defaultdict(int))
+        try:
+            check_storage_quota(course, uploader, size,
+                                pending_course=pending['course', course.pk],
+                                pending_uploader=pending['uploader', uploader.pk])
+        except DjangoValidationError as error:
+            raise ValidationError({'file': error.messages})
+        pending['course', course.pk] += size
+        pending['uploader', uploader.pk] += size
+        return Material(uploader=uploader, **validated_data)
+
+    def perform_bulk_create(self, instances):
+        return create_materials(instances)
+
+    def check_bulk_update_permission(self, instance):
+        if instance.uploader_id != self.request.user.pk:
+            raise PermissionDenied("Only the uploader can edit this material.")
+
+    def perform_bulk_update(self, instances, fields):
+        update_materials(instances, fields)
+
     def get_queryset(self):
+        queryset = super().get_queryset()
         if self.request.user.elearnuser.user_type == 'teacher':
-            return Material.objects.all()
+            return queryset
         else:
-            return Material.objects.filter(
+            return queryset.filter(
                 # Materials for courses the student is enrolled in
                 Q(course__students=self.request.user.elearnuser) |
                 # Materials uploaded by the student
-                Q(uploader=self.request.user.elearnuser))
+                Q(uploader=self.request.user.elearnuser)).distinct()
 
 
-class FeedbackViewSet(viewsets.ModelViewSet):
+class FeedbackViewSet(BulkWriteMixin, ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Feedback.objects.all()
     serializer_class = FeedbackSerializer
+    bulk_serializer_class = FeedbackBulkSerializer
+    bulk_update_fields = ['rating', 'comment']
+    version_scopes = ['course', 'user']
+    pagination_class = IdCursorPagination
+    select_related_fields = {
+        'student_name': ['student__user'],
+        'course_name': ['course'],
+    }
 
     def get_permissions(self):
         # Allows read-only access to teachers, write access only for students
@@ -132,29 +249,73 @@ class FeedbackViewSet(viewsets.ModelViewSet):
         else:
             raise PermissionDenied("Only students can submit feedback.")
 
+    def bulk_create(self, rows, context):
+        if not (hasattr(self.request.user, 'elearnuser') and self.request.user.elearnuser.user_type == 'student'):
+            raise PermissionDenied("Only students can submit feedback.")
+        return super().bulk_create(rows, context)
+
+    def build_bulk_instance(self, validated_data, context):
+        return Feedback(student=self.request.user.elearnuser, **validated_data)
+
+    def perform_bulk_create(self, instances):
+        return create_rows(instances)
+
+    def check_bulk_update_permission(self, instance):
+        if instance.student_id != self.request.user.pk:
+            raise PermissionDenied("Only the author can edit this feedback.")
+
+    def perform_bulk_update(self, instances, fields):
+        update_rows(instances, fields)
+
 
-class StatusUpdateViewSet(viewsets.ModelViewSet):
+class StatusUpdateViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = StatusUpdate.objects.all()
     serializer_class = StatusUpdateSerializer
+    version_scopes = ['user']
+    pagination_class = TimestampCursorPagination
+    select_related_fields = {'user': ['user']}
     # Only owners can update/delete
     permission_classes = [permissions.IsAuthenticated,
                           IsOwnerOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # ?user=<id> lists one user's updates, a range scan of the (user, timestamp, id) index
+        user = self.request.query_params.get('user')
+        if self.action == 'list' and user is not None:
+            if not user.isdigit():
+                raise ValidationError({'user': ['Expected a user id.']})
+            queryset = queryset.filter(user_id=user)
+        return queryset
+
 
-class ChatRoomViewSet(viewsets.ReadOnlyModelViewSet):
+class ChatRoomViewSet(CachedResponseMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = ChatRoom.objects.all()
     serializer_class = ChatRoomSerializer
+    version_scopes = ['user']
+    cache_per_user = False
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = {'admin': ['admin']}
+    prefetch_related_fields = {'members': ['members']}
 
 
-class EnrollmentViewSet(mixins.CreateModelMixin,
+class EnrollmentViewSet(BulkWriteMixin,
+                        ConditionalGetMixin,
+                        mixins.CreateModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.ListModelMixin,
                         viewsets.GenericViewSet):
     queryset = Enrollment.objects.all()
     serializer_class = EnrollmentSerializer
+    bulk_serializer_class = EnrollmentBulkSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = None
+    pagination_class = IdCursorPagination
+
+    def get_permissions(self):
+        # Bulk enrollment is for staff accounts such as the SIS integration
+        if self.action == 'bulk':
+            return [permissions.IsAdminUser()]
+        return super().get_permissions()
 
     def perform_create(self, serializer):
         if self.request.user.elearnuser.user_type == 'teacher':
@@ -164,37 +325,247 @@ class EnrollmentViewSet(mixins.CreateModelMixin,
         course = get_object_or_404(Course, pk=course_id)
         serializer.save(student=self.request.user.elearnuser, course=course)
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
+    def get_bulk_context(self, rows):
+        context = super().get_bulk_context(rows)
+        # Pairs already enrolled, later extended with the rows accepted so far
+        context['enrolled'] = set(Enrollment.objects.filter(
+            student__in=context['preloaded']['student'].keys(),
+            course__in=context['preloaded']['course'].keys(),
+        ).values_list('student_id', 'course_id'))
+        return context
 
-        if queryset.count() == 1:
-            serializer = self.get_serializer(queryset.first())
-            return Response(serializer.data)
-        else:
-            return super().list(request, *args, **kwargs)
+    def build_bulk_instance(self, validated_data, context):
+        context['enrolled'].add(
+            (validated_data['student'].pk, validated_data['course'].pk))
+        return Enrollment(**validated_data)
 
+    def perform_bulk_create(self, instances):
+        return create_enrollments(instances)
 
-class CourseViewSet(viewsets.ModelViewSet):
-    queryset = Course.objects.all()
-    serializer_class = CourseListSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ['name', 'code']
-    search_fields = ['name']
+    def bulk_update(self, rows, context):
+        raise MethodNotAllowed('PATCH')
 
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_list_scopes(), self.list_enrollments, *args, **kwargs)
 
-class EnrollmentNotificationViewSet(viewsets.ModelViewSet):
+    def list_enrollments(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # A lone enrollment is returned on its own; two rows are enough to tell without a COUNT
+        if self.paginator.cursor_query_param not in request.query_params:
+            first_rows = list(queryset[:2])
+            if len(first_rows) == 1:
+                serializer = self.get_serializer(first_rows[0])
+                return Response(serializer.data)
+        return mixins.ListModelMixin.list(self, request, *args, **kwargs)
+
+
+class EnrollmentNotificationViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = EnrollmentNotification.objects.all()
     serializer_class = EnrollmentNotificationSerializer
+    version_scopes = ['course', 'user']
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IdCursorPagination
+    select_related_fields = {
+        'course': ['course__teacher__user'],
+        'student': ['student__user'],
+        'teacher': ['teacher__user'],
+    }
 
+    def get_queryset(self):
+        # Shown to both the enrolled student and the course's teacher
+        return super().get_queryset().filter(
+            Q(student_id=self.request.user.pk) | Q(teacher_id=self.request.user.pk))
 
-class MaterialNotificationViewSet(viewsets.ModelViewSet):
+
+class MaterialNotificationViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = MaterialNotification.objects.all()
     serializer_class = MaterialNotificationSerializer
+    version_scopes = ['material', 'course', 'user']
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IdCursorPagination
+    select_related_fields = {
+        'material': ['material__course', 'material__uploader__user'],
+        'student': ['student__user'],
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().filter(student_id=self.request.user.pk)
 
 
-class BlockNotificationViewSet(viewsets.ModelViewSet):
+class BlockNotificationViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = BlockNotification.objects.all()
     serializer_class = BlockNotificationSerializer
+    version_scopes = ['course', 'user']
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TimestampCursorPagination
+    select_related_fields = {
+        'course': ['course__teacher__user'],
+        'student': ['student__user'],
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().filter(student_id=self.request.user.pk)
+
+
+class InboxItemViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = InboxItem.objects.all()
+    serializer_class = InboxItemSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedCursorPagination
+
+    def get_list_scopes(self):
+        # Every change to a user's notifications bumps the user's own scope
+        return [*super().get_list_scopes(), f'user:{self.request.user.pk}']
+
+    def get_object_scopes(self):
+        return [*super().get_object_scopes(), f'user:{self.request.user.pk}']
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(recipient_id=self.request.user.pk)
+        # ?unread=true keeps the scan on the (recipient, read, created) index
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(read=False)
+        kind = self.request.query_params.get('kind')
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        return queryset
+
+
+class NotificationSummaryView(APIView):
+    """ Unread notification counts per type, read from the user's counter row """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(unread_summary(request.user.pk))
+
+
+class NotificationMarkReadView(APIView):
+    """ Marks the selected notifications as read with one UPDATE per type """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = MarkNotificationsReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        changed = mark_notifications_read(
+            request.user.pk,
+            kinds=[data['type']] if 'type' in data else None,
+            ids=data.get('ids'),
+            course_id=data.get('course'),
+            before=data.get('before'),
+        )
+        return Response({'updated': changed, 'unread': unread_summary(request.user.pk)})
+
+
+class AutocompleteView(APIView):
+    """
+    Type-ahead suggestions for people and courses: GET /api/autocomplete/?q=<prefix>
+    with optional &kind=user|course and &limit=. Served from the per-process prefix
+    index in eLearning_app/autocomplete.py without querying the database.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        kind = request.query_params.get('kind')
+        return Response(autocomplete(
+            request.query_params.get('q', ''), limit, kinds={kind} if kind else None))
+
+
+class SearchView(APIView):
+    """
+    Ranked search across people, courses, materials and messages: GET /api/search/?q=<text>,
+    optionally narrowed with &kind= (repeatable) and &limit=. Materials are limited to the
+    user's courses and messages to their chat rooms, see eLearning_app/unified_search.py.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_limit = 50
+
+    def get(self, request):
+        kinds = set(request.query_params.getlist('kind'))
+        unknown = kinds - set(SEARCHERS)
+        if unknown:
+            raise ValidationError({'kind': [f"Unknown kind(s): {', '.join(sorted(unknown))}."]})
+        try:
+            limit = min(max(int(request.query_params.get('limit', 0)), 0), self.max_limit) or None
+        except ValueError:
+            limit = None
+        return Response(unified_search(request.user, request.query_params.get('q', ''), kinds, limit))
+
+
+class SyncView(APIView):
+    """
+    Change feed for offline clients: GET /api/sync/?since=<token> returns the courses,
+    materials, messages and notifications created, updated or deleted since the token,
+    with the token to send next time. `has_more` asks for another call straight away.
+
+    Without a token, or with one older than the pruned log (see change_log.py), the
+    answer is {"reset": true, "next": token}: refetch the collections, then sync from there.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    page_size = 500
+    synced_models = {
+        'course': (Course.objects.select_related('teacher__user'), CourseListSerializer),
+        'material': (Material.objects.select_related('course', 'uploader__user'), MaterialSerializer),
+        'message': (Message.objects.select_related('user'), MessageSerializer),
+        'enrollmentnotification': (EnrollmentNotification.objects.all(), EnrollmentNotificationSerializer),
+        'materialnotification': (MaterialNotification.objects.all(), MaterialNotificationSerializer),
+        'blocknotification': (BlockNotification.objects.all(), BlockNotificationSerializer),
+    }
+
+    def get(self, request):
+        changes = changes_since(
+            request.user.pk, parse_token(request.query_params.get('since')), self.page_size)
+        if changes is None:
+            return Response({'reset': True, 'next': str(latest_token())})
+
+        updated, deleted = {}, {label: list(ids) for label, ids in changes['deletes'].items()}
+        for label, ids in changes['upserts'].items():
+            queryset, serializer_class = self.synced_models[label]
+            objects = queryset.in_bulk(ids)
+            # Deleted after the entry was read, the tombstone is on its way but may be on the next page
+            gone = [pk for pk in ids if pk not in objects]
+            if gone:
+                deleted.setdefault(label, []).extend(gone)
+            updated[label] = serializer_class(
+                [objects[pk] for pk in ids if pk in objects], many=True, context={'request': request}).data
+        return Response({
+            'reset': False,
+            'next': str(changes['next']),
+            'has_more': changes['has_more'],
+            'changes': updated,
+            'deleted': deleted,
+        })
+
+
+class ResponseCacheStatsView(APIView):
+    """ Hit/miss counters of the cached read-heavy endpoints """
+    permission_classes = [permissions.IsAdminUser]
+    cached_viewsets = [CourseViewSet, MaterialViewSet, ChatRoomViewSet]
+
+    def get(self, request):
+        names = [viewset.queryset.model._meta.model_name for viewset in self.cached_viewsets]
+        return Response(response_cache_stats(names))
+
+
+class BatchView(APIView):
+    """
+    Runs several API requests in one round trip and returns their responses in order.
+
+    POST {"requests": [{"method": "GET", "path": "/api/courses/"}, ...], "parallel": false};
+    each response is {"status", "headers", "body"}. The batch is authenticated once and
+    its user is reused by every sub-request, see api/batch.py.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return Response({'responses': run_batch(request, data['requests'], data['parallel'])})
@@ -0,0 +1,235 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import CharField, F, Value
+
+from .parallel import can_run_in_parallel
+from .search_index import normalize, words
+
+# Seconds before a process rebuilds its index, picking up changes saved by other processes
+DEFAULT_AUTOCOMPLETE_MAX_AGE = 300
+
+# Fields each indexed model's entries are built from
+INDEXED_FIELDS = {
+    'user': {'username', 'first_name', 'last_name'},
+    'course': {'code', 'name'},
+}
+
+
+def user_entry(username, first_name, last_name):
+    """ Return the (label, keys) indexed for a user """
+    full_name = f'{first_name} {last_name}'.strip()
+    keys = {normalize(username), normalize(full_name)}
+    keys.update(words(username), words(full_name))
+    return f'{username} ({full_name})' if full_name else username, keys
+
+
+def course_entry(code, name):
+    """ Return the (label, keys) indexed for a course """
+    keys = {normalize(code), normalize(name)}
+    keys.update(words(code), words(name))
+    return f'{code} - {name}', keys
+
+
+class PrefixIndex:
+    """
+    Sorted parallel arrays of (key, (kind, pk)): the entries whose keys start with a
+    prefix form one contiguous run found by binary search. A key sorts before its own
+    extensions, so exact matches come out first.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._refs = []
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Updates and removals made while a rebuild reads the database, replayed over its rows
+        self._journal = None
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def begin_rebuild(self):
+        """ Record changes from now on, so a load() of rows read afterwards does not lose them """
+        with self._lock:
+            self._journal = []
+
+    def load(self, rows):
+        """ Replace the whole index with (kind, pk, label, keys) rows """
+        pairs, entries = [], {}
+        for kind, pk, label, keys in rows:
+            keys = {key for key in keys if key}
+            entries[(kind, pk)] = (label, keys)
+            pairs += [(key, (kind, pk)) for key in keys]
+        pairs.sort()
+        with self._lock:
+            self._keys = [key for key, _ in pairs]
+            self._refs = [ref for _, ref in pairs]
+            self._entries = entries
+            journal, self._journal = self._journal or [], None
+            for ref, entry in journal:
+                if entry is None:
+                    self._remove(ref)
+                else:
+                    self._insert(ref, *entry)
+            self.built_at = time.monotonic()
+
+    def _remove(self, ref):
+        entry = self._entries.pop(ref, None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            position = bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._refs[position] == ref:
+                    del self._keys[position]
+                    del self._refs[position]
+                    break
+                position += 1
+
+    def _insert(self, ref, label, keys):
+        self._remove(ref)
+        self._entries[ref] = (label, keys)
+        for key in keys:
+            position = bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._refs.insert(position, ref)
+
+    def update(self, kind, pk, label, keys):
+        ref = (kind, pk)
+        keys = {key for key in keys if key}
+        with self._lock:
+            self._insert(ref, label, keys)
+            if self._journal is not None:
+                self._journal.append((ref, (label, keys)))
+
+    def remove(self, kind, pk):
+        with self._lock:
+            self._remove((kind, pk))
+            if self._journal is not None:
+                self._journal.append(((kind, pk), None))
+
+    def keys_of(self, kind, pk):
+        """ The keys an entry is indexed under, empty when it is not indexed """
+        entry = self._entries.get((kind, pk))
+        return entry[1] if entry else set()
+
+    def search(self, prefix, limit=10, kinds=None):
+        """ Return up to `limit` {'kind', 'id', 'label'} entries with a key starting with `prefix` """
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            position = bisect_left(self._keys, prefix)
+            while position < len(self._keys) and len(results) < limit:
+                if not self._keys[position].startswith(prefix):
+                    break
+                ref = self._refs[position]
+                position += 1
+                if ref in seen or (kinds and ref[0] not in kinds):
+                    continue
+                seen.add(ref)
+                results.append({'kind': ref[0], 'id': ref[1], 'label': self._entries[ref][0]})
+        return results
+
+
+_index = PrefixIndex()
+_build_lock = threading.Lock()
+
+
+def autocomplete_max_age():
+    return getattr(settings, 'AUTOCOMPLETE_MAX_AGE', DEFAULT_AUTOCOMPLETE_MAX_AGE)
+
+
+def index_rows():
+    """ Stream every user and course as (kind, pk, label, keys), both tables in a single UNION query """
+    from .models import Course, User
+
+    # Only annotations, so both halves select their columns in the same order
+    users = User.objects.annotate(
+        kind=Value('user', output_field=CharField()), first=F('username'),
+        second=F('first_name'), third=F('last_name'),
+    ).values_list('kind', 'pk', 'first', 'second', 'third')
+    courses = Course.objects.annotate(
+        kind=Value('course', output_field=CharField()), first=F('code'),
+        second=F('name'), third=Value('', output_field=CharField()),
+    ).values_list('kind', 'pk', 'first', 'second', 'third')
+    for kind, pk, first, second, third in users.union(courses, all=True).iterator():
+        if kind == 'user':
+            yield (kind, pk, *user_entry(first, second, third))
+        else:
+            yield (kind, pk, *course_entry(first, second))
+
+
+def _rebuild():
+    try:
+        _index.begin_rebuild()
+        _index.load(index_rows())
+    finally:
+        _build_lock.release()
+
+
+def _rebuild_in_background():
+    try:
+        _rebuild()
+    finally:
+        # The thread opened its own connection, don't leave it open
+        connections.close_all()
+
+
+def get_index():
+    """
+    Return this process's index. The first search builds it; after that, a search finding
+    it older than AUTOCOMPLETE_MAX_AGE starts one rebuild on a background thread and keeps
+    being served the current index, which the rebuilt one replaces when it is ready.
+    """
+    if _index.built_at is None:
+        with _build_lock:
+            if _index.built_at is None:
+                _index.begin_rebuild()
+                _index.load(index_rows())
+    elif time.monotonic() - _index.built_at > autocomplete_max_age() and _build_lock.acquire(blocking=False):
+        if not can_run_in_parallel():
+            # Another thread could not see this transaction's rows
+            _rebuild()
+        else:
+            threading.Thread(target=_rebuild_in_background, name='autocomplete-rebuild', daemon=True).start()
+    return _index
+
+
+def autocomplete(prefix, limit=10, kinds=None):
+    return get_index().search(prefix, limit, kinds)
+
+
+def _apply_on_commit(update):
+    # Not built yet means the first search loads everything from the database anyway,
+    # and the in-process index must not show rows a rollback removes again
+    if _index.built_at is not None:
+        transaction.on_commit(update)
+
+
+def schedule_update(instance):
+    """ Refresh a saved user or course in this process's index once the transaction commits """
+    if instance._meta.model_name == 'user':
+        label, keys = user_entry(instance.username, instance.first_name, instance.last_name)
+    else:
+        label, keys = course_entry(instance.code, instance.name)
+    kind, pk = instance._meta.model_name, instance.pk
+    _apply_on_commit(lambda: _index.update(kind, pk, label, keys))
+
+
+def schedule_removal(instance):
+    kind, pk = instance._meta.model_name, instance.pk
+    _apply_on_commit(lambda: _index.remove(kind, pk))
+
+
+def reset_index():
+    """ Forget the index, the next search rebuilds it """
+    with _build_lock:
+        _index.load([])
+        _index.built_at = None
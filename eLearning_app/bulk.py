@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from .change_log import log_changes, log_enrollment_changes
+from .notification_counters import count_notifications
+from .notifications import add_to_inbox
+from .search_index import INDEXED_TEXT_FIELDS, index_texts
+from .storage_accounting import account_new_materials
+from .timelines import refresh_enrollment_timelines
+from .versions import bump_instance_versions
+
+# Rows per INSERT or UPDATE statement, keeps each statement below SQLite's variable limit
+BATCH_SIZE = 500
+
+# bulk_create and bulk_update send no model signals, so every helper below does the
+# work of the post_save receivers in models.py itself, a batch at a time.
+
+
+def create_enrollments(enrollments):
+    """ Insert enrollments, add the students to their courses and notify the teachers, in one transaction """
+    from .models import Course, Enrollment, EnrollmentNotification
+
+    CourseStudent = Course.students.through
+    with transaction.atomic():
+        created = Enrollment.objects.bulk_create(enrollments, batch_size=BATCH_SIZE)
+        CourseStudent.objects.bulk_create(
+            [CourseStudent(course_id=enrollment.course_id, elearnuser_id=enrollment.student_id)
+             for enrollment in created],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        log_enrollment_changes(
+            [(enrollment.course_id, enrollment.student_id) for enrollment in created], 'upsert')
+        # The through rows are bulk inserted, so no m2m_changed refreshes the timelines
+        refresh_enrollment_timelines({enrollment.course_id for enrollment in created},
+                                     {enrollment.student_id for enrollment in created})
+        # Related objects are passed on so the inbox payloads need no extra queries
+        notifications = EnrollmentNotification.objects.bulk_create(
+            [EnrollmentNotification(course=enrollment.course,
+                                    student=enrollment.student,
+                                    teacher_id=enrollment.course.teacher_id)
+             for enrollment in created],
+            batch_size=BATCH_SIZE)
+        count_notifications(notifications, 1)
+        add_to_inbox(notifications, BATCH_SIZE)
+        log_changes(notifications)
+    bump_instance_versions(created + notifications)
+    return created
+
+
+def notify_students_of_materials(materials):
+    """
+    Create a notification of each saved material for every student of its course, in
+    batches, and return them. Their versions are left for the caller to bump.
+    """
+    from .models import Course, MaterialNotification
+
+    students = defaultdict(list)
+    enrolled = Course.students.through.objects.filter(
+        course_id__in={material.course_id for material in materials})
+    for course_id, student_id in enrolled.values_list('course_id', 'elearnuser_id'):
+        students[course_id].append(student_id)
+    notifications = MaterialNotification.objects.bulk_create(
+        [MaterialNotification(material=material, student_id=student_id)
+         for material in materials for student_id in students[material.course_id]],
+        batch_size=BATCH_SIZE)
+    count_notifications(notifications, 1)
+    add_to_inbox(notifications, BATCH_SIZE)
+    log_changes(notifications)
+    return notifications
+
+
+def create_materials(materials):
+    """ Insert materials, count their storage and notify each course's students, in one transaction """
+    from .models import Material
+
+    for material in materials:
+        material.file_size = material.file.size
+
+    with transaction.atomic():
+        # Files are written to storage as each row is prepared for the INSERT
+        created = Material.objects.bulk_create(materials, batch_size=BATCH_SIZE)
+        account_new_materials(created)
+        log_changes(created)
+        index_texts(created, created=True)
+        notifications = notify_students_of_materials(created)
+    bump_instance_versions(created + notifications)
+    return created
+
+
+def create_rows(instances):
+    """ Insert instances of a model that has no post_save side effects besides versioning """
+    if not instances:
+        return []
+    with transaction.atomic():
+        created = type(instances[0]).objects.bulk_create(instances, batch_size=BATCH_SIZE)
+        log_changes(created)
+    bump_instance_versions(created)
+    return created
+
+
+def update_materials(materials, fields):
+    """ Like update_rows, and index the materials for search again when their text changed """
+    if not materials:
+        return
+    with transaction.atomic():
+        type(materials[0]).objects.bulk_update(materials, fields, batch_size=BATCH_SIZE)
+        log_changes(materials)
+        if set(fields) & set(INDEXED_TEXT_FIELDS['material']):
+            index_texts(materials)
+    bump_instance_versions(materials)
+
+
+def update_rows(instances, fields):
+    """ Write `fields` of already saved instances with one UPDATE per batch, in one transaction """
+    if not instances:
+        return
+    with transaction.atomic():
+        type(instances[0]).objects.bulk_update(instances, fields, batch_size=BATCH_SIZE)
+        log_changes(instances)
+    bump_instance_versions(instances)
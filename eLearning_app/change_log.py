@@ -0,0 +1,217 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .notification_counters import COUNTED_NOTIFICATIONS
+
+# Models a client can keep in sync through /api/sync/
+SYNCED_MODELS = ('course', 'material', 'message', *COUNTED_NOTIFICATIONS)
+
+DEFAULT_SYNC_LOG_RETENTION_DAYS = 30
+DEFAULT_SYNC_LOG_MAX_ENTRIES = 1000000
+
+# Highest entry id removed by prune_change_log; older tokens must resync in full
+FLOOR_KEY = 'change-log:floor'
+
+
+def _course_audiences(course_ids):
+    """ Return {course_id: user ids} of each course's teacher and enrolled students """
+    from .models import Course
+
+    audiences = defaultdict(set)
+    for pk, teacher_id in Course.objects.filter(pk__in=course_ids).values_list('pk', 'teacher_id'):
+        audiences[pk].add(teacher_id)
+    enrolled = Course.students.through.objects.filter(course_id__in=course_ids)
+    for course_id, student_id in enrolled.values_list('course_id', 'elearnuser_id'):
+        audiences[course_id].add(student_id)
+    return audiences
+
+
+def change_audiences(instances):
+    """
+    Return {instance pk: user ids} of the users shown each instance, all of one synced
+    model. elearnUser shares its user's primary key, so both kinds of id can be mixed.
+    """
+    from .models import ChatRoom
+
+    label = instances[0]._meta.model_name
+    if label == 'course':
+        audiences = _course_audiences({course.pk for course in instances})
+        return {course.pk: audiences[course.pk] for course in instances}
+    if label == 'material':
+        audiences = _course_audiences({material.course_id for material in instances})
+        return {material.pk: audiences[material.course_id] for material in instances}
+    if label == 'message':
+        members = defaultdict(set)
+        rows = ChatRoom.members.through.objects.filter(
+            chatroom_id__in={message.chat_room_id for message in instances})
+        for chat_room_id, user_id in rows.values_list('chatroom_id', 'user_id'):
+            members[chat_room_id].add(user_id)
+        return {message.pk: members[message.chat_room_id] for message in instances}
+    recipient_fields = COUNTED_NOTIFICATIONS[label][1]
+    return {notification.pk: {getattr(notification, field) for field in recipient_fields}
+            for notification in instances}
+
+
+def record_changes(label, audiences, action):
+    """ Append one entry per user for each {object_id: user ids} of model `label` """
+    from .models import ChangeLogEntry
+
+    ChangeLogEntry.objects.bulk_create(
+        [ChangeLogEntry(user_id=user_id, model=label, object_id=object_id, action=action)
+         for object_id, user_ids in audiences.items() for user_id in user_ids],
+        batch_size=500)
+
+
+def log_changes(instances, action='upsert'):
+    """ Log created or updated objects for everyone shown them; unsynced models are ignored """
+    instances = [instance for instance in instances if instance.pk is not None]
+    if not instances or instances[0]._meta.model_name not in SYNCED_MODELS:
+        return
+    record_changes(instances[0]._meta.model_name, change_audiences(instances), action)
+
+
+def remember_audience(instance):
+    """ Keep who was shown an object about to be deleted, while its relations still exist """
+    if instance._meta.model_name in SYNCED_MODELS:
+        instance._change_audience = change_audiences([instance])[instance.pk]
+
+
+def log_deletion(instance):
+    audience = getattr(instance, '_change_audience', None)
+    if audience:
+        record_changes(instance._meta.model_name, {instance.pk: audience}, 'delete')
+
+
+def log_enrollment_changes(pairs, action):
+    """
+    Log (course_id, student_id) enrollments that were added or removed: the student
+    gains or loses the course and every material in it.
+    """
+    from .models import Material
+
+    students = defaultdict(set)
+    for course_id, student_id in pairs:
+        students[course_id].add(student_id)
+    if not students:
+        return
+    record_changes('course', students, action)
+    materials = defaultdict(set)
+    for pk, course_id in Material.objects.filter(course_id__in=students).values_list('pk', 'course_id'):
+        materials[pk] = students[course_id]
+    if materials:
+        record_changes('material', materials, action)
+
+
+def latest_token():
+    """ Token of the newest entry, from which a client that just resynced in full continues """
+    from .models import ChangeLogEntry
+
+    return ChangeLogEntry.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def sync_floor():
+    floor = cache.get(FLOOR_KEY)
+    if floor is None:
+        # The stored floor was lost: every entry below the oldest kept one may have been pruned
+        from .models import ChangeLogEntry
+
+        oldest = ChangeLogEntry.objects.order_by('id').values_list('id', flat=True).first()
+        floor = oldest - 1 if oldest else 0
+        cache.add(FLOOR_KEY, floor, None)
+    return floor
+
+
+def parse_token(token):
+    try:
+        since = int(token)
+    except (TypeError, ValueError):
+        return None
+    return since if since >= 0 else None
+
+
+def changes_since(user_id, since, limit=500):
+    """
+    Return the user's changes after token `since`, compacted to the last action per object:
+    {'upserts': {model: [ids]}, 'deletes': {model: [ids]}, 'next': token, 'has_more': bool},
+    or None when the token is missing or older than the log and the client must resync in full.
+    """
+    from .models import ChangeLogEntry
+
+    if since is None or since < sync_floor():
+        return None
+
+    entries = list(ChangeLogEntry.objects.filter(user_id=user_id, id__gt=since).order_by('id').values_list(
+        'id', 'model', 'object_id', 'action')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for _, label, object_id, action in entries:
+        latest[(label, object_id)] = action
+    upserts, deletes = defaultdict(list), defaultdict(list)
+    for (label, object_id), action in latest.items():
+        (upserts if action == 'upsert' else deletes)[label].append(object_id)
+    return {
+        'upserts': dict(upserts),
+        'deletes': dict(deletes),
+        'next': entries[-1][0] if entries else since,
+        'has_more': has_more,
+    }
+
+
+def _delete_in_batches(queryset, batch_size):
+    from .models import ChangeLogEntry
+
+    removed, highest = 0, 0
+    while True:
+        pks = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not pks:
+            return removed, highest
+        ChangeLogEntry.objects.filter(pk__in=pks).delete()
+        removed += len(pks)
+        highest = max(highest, pks[-1])
+
+
+def _raise_floor(token):
+    if token > sync_floor():
+        cache.set(FLOOR_KEY, token, None)
+
+
+def prune_change_log(days=None, max_entries=None, batch_size=1000):
+    """
+    Keep the change log small, `batch_size` rows per DELETE:
+      - entries superseded by a later one for the same user and object are compacted away,
+      - entries older than `days` (SYNC_LOG_RETENTION_DAYS) are removed,
+      - the oldest entries beyond `max_entries` (SYNC_LOG_MAX_ENTRIES) are removed.
+    Tokens older than what the last two steps removed get a full-resync answer.
+    Returns {'compacted', 'expired', 'trimmed'} counts.
+    """
+    from .models import ChangeLogEntry
+
+    if days is None:
+        days = getattr(settings, 'SYNC_LOG_RETENTION_DAYS', DEFAULT_SYNC_LOG_RETENTION_DAYS)
+    if max_entries is None:
+        max_entries = getattr(settings, 'SYNC_LOG_MAX_ENTRIES', DEFAULT_SYNC_LOG_MAX_ENTRIES)
+
+    # Compacting never loses a change: the later entry is returned to every token the earlier one was
+    superseded = ChangeLogEntry.objects.filter(Exists(ChangeLogEntry.objects.filter(
+        user_id=OuterRef('user_id'), model=OuterRef('model'),
+        object_id=OuterRef('object_id'), id__gt=OuterRef('id'))))
+    compacted, _ = _delete_in_batches(superseded, batch_size)
+
+    expired, highest = _delete_in_batches(
+        ChangeLogEntry.objects.filter(created__lt=timezone.now() - timedelta(days=days)), batch_size)
+    _raise_floor(highest)
+
+    trimmed = 0
+    excess = ChangeLogEntry.objects.count() - max_entries
+    if excess > 0:
+        last = ChangeLogEntry.objects.order_by('id').values_list('id', flat=True)[excess - 1]
+        trimmed, highest = _delete_in_batches(ChangeLogEntry.objects.filter(id__lte=last), batch_size)
+        _raise_floor(highest)
+    return {'compacted': compacted, 'expired': expired, 'trimmed': trimmed}
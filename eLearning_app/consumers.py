@@ -2,7 +2,10 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import async_to_sync
 from .models import ChatRoom, Message
+from .notification_counters import unread_summary
+from .notifications import inbox_page, notification_group, serialize_inbox_item
 from channels.db import database_sync_to_async
+from .sqlite import database_write
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -62,6 +65,53 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def get_chat_room(self, room_name):
         return ChatRoom.objects.get(chat_name=room_name)
 
-    @database_sync_to_async
+    @database_write
     def create_message(self, chat_room, user, content):
         Message.objects.create(chat_room=chat_room, user=user, content=content)
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """ Pushes a user's new notifications and unread counts as they happen """
+    # Unread items sent when a connection opens
+    catch_up_limit = 50
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = notification_group(user.pk)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        # Whatever arrived while the client was away, read from the inbox index
+        items, unread = await self.get_catch_up(user.pk)
+        await self.send(text_data=json.dumps({
+            'type': 'catch_up',
+            'items': items,
+            'unread': unread,
+        }))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    # A notification was created for this user
+    async def notification_created(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification',
+            'item': event['item'],
+        }))
+
+    # Notifications were marked read, possibly from another tab or device
+    async def notification_unread(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'unread',
+            'unread': event['unread'],
+        }))
+
+    @database_sync_to_async
+    def get_catch_up(self, user_id):
+        items, _ = inbox_page(user_id, limit=self.catch_up_limit)
+        return [serialize_inbox_item(item) for item in items], unread_summary(user_id)
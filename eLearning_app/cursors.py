@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(moment, pk):
+    """ Opaque 'micros-id' position of a row in a (timestamp, id) ordering """
+    micros = (moment - _EPOCH) // timedelta(microseconds=1)
+    return f'{micros}-{pk}'
+
+
+def decode_cursor(cursor):
+    """ Return the (timestamp, id) position a cursor points at, or None for a missing or malformed cursor """
+    try:
+        micros, pk = (int(part) for part in cursor.split('-'))
+        return _EPOCH + timedelta(microseconds=micros), pk
+    except (AttributeError, ValueError, OverflowError):
+        # OverflowError: a position beyond the dates Python can represent
+        return None
@@ -0,0 +1,139 @@
+import random
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Seconds a client keeps reading from the primary after a write, long enough for replicas to catch up
+DEFAULT_REPLICA_STICKINESS_SECONDS = 5
+# Seconds a replica's health is trusted before it is checked again
+DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL = 10
+
+PIN_COOKIE = 'db_primary'
+
+
+class _Pin:
+    """ Whether the current request wrote, whether it must read from the primary, and the replica it reads from """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+# Set per request by ReplicaPinningMiddleware; a mutable holder, so a write in a copied context still pins.
+# Code outside a request (commands, consumers, background threads) has none and always uses the primary.
+_pin = ContextVar('db_pin', default=None)
+
+
+def replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def replica_stickiness():
+    return getattr(settings, 'REPLICA_STICKINESS_SECONDS', DEFAULT_REPLICA_STICKINESS_SECONDS)
+
+
+def health_check_interval():
+    return getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL)
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def check_replica(alias):
+    """ A replica is healthy when it answers and holds the schema; an empty SQLite stand-in does not """
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1 FROM django_migrations LIMIT 1')
+        return True
+    except (DatabaseError, sqlite3.Error):
+        connections[alias].close()
+        return False
+
+
+def replica_is_healthy(alias):
+    """ check_replica(alias), remembered for REPLICA_HEALTH_CHECK_INTERVAL seconds """
+    now = time.monotonic()
+    known = _health.get(alias)
+    if known is not None and now - known[1] < health_check_interval():
+        return known[0]
+    with _health_lock:
+        healthy = check_replica(alias)
+        _health[alias] = (healthy, now)
+    return healthy
+
+
+def forget_replica_health():
+    _health.clear()
+
+
+def pin_to_primary():
+    pin = _pin.get()
+    if pin is not None:
+        pin.pinned = pin.wrote = True
+
+
+def read_from_primary():
+    """
+    Send the rest of the current request's reads to the primary, without pinning its client
+    like a write does. For responses kept under version stamps: a replica that has not yet
+    seen the write behind a stamp would have its old rows cached under the new stamp.
+    """
+    pin = _pin.get()
+    if pin is not None:
+        pin.pinned = True
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary and the reads of a request to one healthy replica in
+    DATABASE_REPLICAS, picked at random on its first read so all its queries see the same
+    replica. Reads stay on the primary outside requests, inside a transaction, once the
+    request has written or read version stamps, and for REPLICA_STICKINESS_SECONDS after
+    its client's last write (see ReplicaPinningMiddleware), so users always see their own
+    changes. Without healthy replicas everything uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        pin = _pin.get()
+        if pin is None or pin.pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if pin.replica is None:
+            healthy = [alias for alias in replica_aliases() if replica_is_healthy(alias)]
+            pin.replica = random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+        return pin.replica
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db not in replica_aliases()
+
+
+class ReplicaPinningMiddleware:
+    """ Pins a request to the primary when its client wrote recently, and marks clients that write """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pin = _Pin(pinned=PIN_COOKIE in request.COOKIES)
+        token = _pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pin.reset(token)
+        if pin.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=replica_stickiness(), httponly=True, samesite='Lax')
+        return response
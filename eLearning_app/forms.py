@@ -3,6 +3,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import Group, Permission
 from .models import User, Course, elearnUser, Material, Feedback, StatusUpdate, ChatRoom
+from .storage_accounting import check_storage_quota
 
 
 class StudentRegistrationForm(UserCreationForm):
@@ -108,12 +109,31 @@ class CourseCreationForm(forms.ModelForm):
 
 
 class MaterialForm(forms.ModelForm):
-    """Form for uploading course materials."""
+    """Form for uploading course materials, enforcing the storage quotas when a course is given."""
     class Meta:
         model = Material
         fields = ['file', 'name', 'description', 'uploader']
         widgets = {'uploader': forms.HiddenInput()}
 
+    def __init__(self, *args, course=None, uploader=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.course = course
+        self.uploader = uploader
+
+    def clean(self):
+        """Reject new or replacement files that would exceed the course or uploader quota."""
+        cleaned_data = super().clean()
+        file = cleaned_data.get('file')
+        if self.course is not None and file and 'file' in self.changed_data:
+            uploader = self.uploader or cleaned_data.get('uploader')
+            replacing = self.instance if self.instance.pk else None
+            try:
+                check_storage_quota(self.course, uploader,
+                                    file.size, replacing=replacing)
+            except forms.ValidationError as error:
+                self.add_error('file', error)
+        return cleaned_data
+
 
 class FeedbackForm(forms.ModelForm):
     """Form for submitting feedback on a course."""
@@ -148,3 +168,33 @@ class ChatRoomForm(forms.ModelForm):
             raise forms.ValidationError(
                 "Chat room name must be a single word.")
         return chat_name
+
+
+class IntegerListField(forms.Field):
+    """Field accepting a repeated integer value, such as one checkbox per notification."""
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            return [int(item) for item in value]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Enter whole numbers.", code='invalid')
+
+
+class MarkNotificationsReadForm(forms.Form):
+    """Form selecting which notifications to mark as read; empty fields select everything."""
+    type = forms.ChoiceField(required=False, choices=[
+        ('', 'All'), ('enrollment', 'Enrollment'), ('material', 'Material'), ('block', 'Block')])
+    ids = IntegerListField(required=False)
+    course = forms.IntegerField(required=False)
+    before = forms.DateTimeField(required=False)
+
+    def clean(self):
+        """Notification ids are only unique within one type."""
+        cleaned_data = super().clean()
+        if cleaned_data.get('ids') and not cleaned_data.get('type'):
+            raise forms.ValidationError(
+                "Choose a notification type when selecting notifications.")
+        return cleaned_data
@@ -0,0 +1,139 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Square edge length in pixels for every stored profile picture variant
+DEFAULT_PROFILE_PICTURE_SIZES = {
+    'small': 64,
+    'medium': 160,
+    'large': 320,
+}
+
+# Pillow format name and save options for each variant extension
+PROFILE_PICTURE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# A single worker keeps resizing off the request path without competing with it for CPU
+_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='profile-pictures')
+
+
+def profile_picture_sizes():
+    return getattr(settings, 'PROFILE_PICTURE_SIZES', DEFAULT_PROFILE_PICTURE_SIZES)
+
+
+def _variant_name(user_id, source_name, size_name, extension):
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    return f'profile_pics/variants/{user_id}/{stem}_{size_name}.{extension}'
+
+
+def _flatten(image):
+    """ Drop transparency onto a white background so the image can be saved as JPEG """
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def _delete_variant_files(storage, variants):
+    for formats in variants.get('sizes', {}).values():
+        for path in formats.values():
+            try:
+                storage.delete(path)
+            except OSError:
+                logger.warning("Could not delete profile picture variant %s", path)
+
+
+def generate_profile_picture_variants(user_id):
+    """ Resize the user's original profile picture into every configured size and format """
+    from .models import User
+
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.profile_picture:
+        return {}
+
+    source = user.profile_picture
+    storage = source.storage
+    with source.open('rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    sizes = {}
+    for size_name, edge in profile_picture_sizes().items():
+        resized = ImageOps.fit(image, (edge, edge), Image.LANCZOS)
+        sizes[size_name] = {}
+        for extension, (pil_format, options) in PROFILE_PICTURE_FORMATS.items():
+            output = resized if pil_format == 'WEBP' else _flatten(resized)
+            buffer = BytesIO()
+            output.save(buffer, format=pil_format, **options)
+            name = _variant_name(user_id, source.name, size_name, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            sizes[size_name][extension] = storage.save(
+                name, ContentFile(buffer.getvalue()))
+
+    variants = {'source': source.name, 'sizes': sizes}
+    # Only record the variants if the picture was not replaced while we were resizing
+    updated = User.objects.filter(pk=user_id, profile_picture=source.name).update(
+        profile_picture_variants=variants)
+    if not updated:
+        _delete_variant_files(storage, variants)
+        return {}
+
+    previous = user.profile_picture_variants or {}
+    if previous.get('source') != source.name:
+        _delete_variant_files(storage, previous)
+    bump_version('user', f'user:{user_id}')
+    return variants
+
+
+def delete_profile_picture_variants(user_id):
+    """ Remove stored variants once the user no longer has a profile picture """
+    from .models import User
+
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+    _delete_variant_files(
+        user.profile_picture.storage, user.profile_picture_variants or {})
+    User.objects.filter(pk=user_id).update(profile_picture_variants={})
+    bump_version('user', f'user:{user_id}')
+
+
+def _run_in_background(user_id):
+    close_old_connections()
+    try:
+        generate_profile_picture_variants(user_id)
+    except Exception:
+        logger.exception(
+            "Failed to generate profile picture variants for user %s", user_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_profile_picture_variants(user_id):
+    """ Queue variant generation to run once the upload has been committed """
+    def submit():
+        if getattr(settings, 'PROFILE_PICTURE_ASYNC', True):
+            _executor.submit(_run_in_background, user_id)
+        else:
+            generate_profile_picture_variants(user_id)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from eLearning_app.message_archive import archive_cutoff, archive_messages
+
+
+class Command(BaseCommand):
+    help = "Move chat messages older than the retention period into compressed per-room, per-month segment files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=None,
+                            help="Keep this many whole months of messages in the database "
+                                 "(default MESSAGE_ARCHIVE_AFTER_MONTHS, 6).")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Messages archived per pass (default 1000).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if options['months'] is not None and options['months'] < 0:
+            raise CommandError("--months cannot be negative.")
+        cutoff = archive_cutoff(options['months'])
+        archived, segments = archive_messages(cutoff, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} message(s) posted before {cutoff:%Y-%m-%d} into {segments} segment(s)."))
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from eLearning_app.sqlite import apply_pragmas
+
+
+def _connect(path, pragmas):
+    # isolation_level=None: transactions are opened explicitly, see _write
+    db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    apply_pragmas(db, pragmas)
+    return db
+
+
+def _write(db, room, body, begin='BEGIN'):
+    """
+    Read then write in one transaction, like saving a chat message and its room's counters.
+    `begin` is BEGIN for a deferred transaction, as Django's stock backend opens them, or
+    BEGIN IMMEDIATE as DATABASES['default'] does.
+    """
+    db.execute(begin)
+    try:
+        db.execute('SELECT COUNT(*) FROM message WHERE room = ?', (room,)).fetchone()
+        db.execute('INSERT INTO message (room, body) VALUES (?, ?)', (room, body))
+        db.execute('COMMIT')
+    except sqlite3.OperationalError:
+        db.execute('ROLLBACK')
+        raise
+
+
+def run_profile(path, pragmas, queued, writers, readers, writes, begin='BEGIN'):
+    """ Return (seconds, committed writes, failed writes, reads) for one run against a fresh database """
+    setup = _connect(path, pragmas)
+    setup.execute('CREATE TABLE message (id INTEGER PRIMARY KEY, room INTEGER, body TEXT)')
+    setup.execute('CREATE INDEX message_room ON message (room)')
+    setup.close()
+
+    counts = {'committed': 0, 'failed': 0, 'reads': 0}
+    lock = threading.Lock()
+    done = threading.Event()
+    # With `queued`, every write goes through one thread and its single connection
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer') if queued else None
+    writer_db = _connect(path, pragmas) if queued else None
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def write_loop(number):
+        db = None if queued else _connect(path, pragmas)
+        for i in range(writes):
+            try:
+                if queued:
+                    writer.submit(_write, writer_db, number, f'message {i}', begin).result()
+                else:
+                    _write(db, number, f'message {i}', begin)
+                count('committed')
+            except sqlite3.OperationalError:
+                count('failed')
+
+    def read_loop():
+        db = _connect(path, pragmas)
+        while not done.is_set():
+            db.execute('SELECT room, COUNT(*) FROM message GROUP BY room').fetchall()
+            count('reads')
+
+    reader_threads = [threading.Thread(target=read_loop) for _ in range(readers)]
+    for thread in reader_threads:
+        thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        list(pool.map(write_loop, range(writers)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+    if writer is not None:
+        writer.shutdown()
+    return elapsed, counts['committed'], counts['failed'], counts['reads']
+
+
+class Command(BaseCommand):
+    help = ("Compare SQLite's default settings with the SQLITE_PRAGMAS profile, immediate transactions "
+            "and the single-writer queue under concurrent readers and writers, on a scratch database file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="Concurrent writer threads.")
+        parser.add_argument('--readers', type=int, default=4, help="Concurrent reader threads.")
+        parser.add_argument('--writes', type=int, default=200, help="Writes per writer thread.")
+
+    def handle(self, *args, **options):
+        pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+        profiles = [
+            ('default', {}, False, 'BEGIN'),
+            ('pragmas', pragmas, False, 'BEGIN'),
+            ('pragmas + immediate', pragmas, False, 'BEGIN IMMEDIATE'),
+            ('pragmas + write queue', pragmas, True, 'BEGIN'),
+        ]
+        self.stdout.write(f"{'profile':<24}{'seconds':>9}{'writes/s':>10}{'failed':>8}{'reads/s':>10}")
+        for name, profile_pragmas, queued, begin in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                elapsed, committed, failed, reads = run_profile(
+                    os.path.join(directory, 'benchmark.sqlite3'), profile_pragmas, queued,
+                    options['writers'], options['readers'], options['writes'], begin)
+            self.stdout.write(
+                f'{name:<24}{elapsed:>9.2f}{committed / elapsed:>10.0f}{failed:>8}{reads / elapsed:>10.0f}')
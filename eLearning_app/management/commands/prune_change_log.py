@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from eLearning_app.change_log import prune_change_log
+
+
+class Command(BaseCommand):
+    help = "Compact the sync change log and drop entries beyond its age and size limits."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Keep entries this many days (default SYNC_LOG_RETENTION_DAYS, 30).")
+        parser.add_argument('--max-entries', type=int, default=None,
+                            help="Keep at most this many entries (default SYNC_LOG_MAX_ENTRIES).")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows deleted per statement (default 1000).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        removed = prune_change_log(options['days'], options['max_entries'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {removed['compacted']}, expired {removed['expired']} and "
+            f"trimmed {removed['trimmed']} change log entries."))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from eLearning_app.notifications import prune_notifications, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = "Delete read notifications older than the retention period, in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Keep read notifications this many days "
+                                 "(default NOTIFICATION_RETENTION_DAYS, 90).")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows deleted per transaction (default 1000).")
+        parser.add_argument('--archive', metavar='PATH',
+                            help="Append every deleted notification to this file as a JSON line.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        cutoff = retention_cutoff(options['days'])
+
+        if options['archive']:
+            with open(options['archive'], 'a', encoding='utf-8') as archive:
+                deleted, items = prune_notifications(cutoff, options['batch_size'], archive)
+        else:
+            deleted, items = prune_notifications(cutoff, options['batch_size'])
+
+        for kind, count in deleted.items():
+            self.stdout.write(f"  {kind:<12} {count:>8} deleted")
+        self.stdout.write(self.style.SUCCESS(
+            f"Pruned {sum(deleted.values())} notification(s) and {items} other inbox item(s) "
+            f"read before {cutoff:%Y-%m-%d %H:%M}."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from eLearning_app.models import NotificationCounter
+from eLearning_app.notification_counters import rebuild_notification_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the cached unread notification counters from the notification tables."
+
+    def handle(self, *args, **options):
+        rebuild_notification_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt unread counters for {NotificationCounter.objects.count()} user(s)."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from eLearning_app.images import generate_profile_picture_variants
+from eLearning_app.models import User
+
+
+class Command(BaseCommand):
+    help = "Regenerate resized profile picture variants from the stored originals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Only rebuild the given user id (can be repeated).")
+        parser.add_argument('--missing', action='store_true',
+                            help="Skip users whose variants are already up to date.")
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(profile_picture='').exclude(
+            profile_picture__isnull=True)
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+
+        rebuilt = 0
+        for user in users.only('id', 'profile_picture', 'profile_picture_variants').iterator():
+            if options['missing'] and user.profile_picture_variants.get('source') == user.profile_picture.name:
+                continue
+            try:
+                generate_profile_picture_variants(user.pk)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f"User {user.pk}: {error}")
+                continue
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt profile pictures for {rebuilt} user(s)."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from eLearning_app.models import MaterialSearchToken, MessageSearchToken, UserSearchToken
+from eLearning_app.search_index import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the search index from the usernames and names of users, the names and "
+            "descriptions of materials and the content of chat messages.")
+
+    def handle(self, *args, **options):
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {UserSearchToken.objects.values('user').distinct().count()} user(s), "
+            f"{MaterialSearchToken.objects.values('material').distinct().count()} material(s) and "
+            f"{MessageSearchToken.objects.values('message').distinct().count()} message(s)."))
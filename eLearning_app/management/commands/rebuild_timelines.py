@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from eLearning_app.models import User
+from eLearning_app.timelines import RedisTimelineStore, get_store, rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = ("Refill every user's status update timeline in Redis from the database, e.g. after Redis lost "
+            "them. Needs TIMELINE_REDIS_URL: without it each process keeps its own timelines, which it "
+            "builds on first read.")
+
+    def handle(self, *args, **options):
+        if not isinstance(get_store(), RedisTimelineStore):
+            raise CommandError("Timelines are kept in each process's memory; set TIMELINE_REDIS_URL to use this command.")
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        for user_id in user_ids:
+            rebuild_timeline(user_id)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(user_ids)} timeline(s)."))
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from eLearning_app.models import Course, elearnUser
+from eLearning_app.storage_accounting import rebuild_storage_counters
+
+
+class Command(BaseCommand):
+    help = "Report material storage per course and per uploader from the usage counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help="Number of courses and uploaders to list (default 20).")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Recompute the counters from recorded material sizes first.")
+
+    def _usage(self, used, quota):
+        if quota is None:
+            return filesizeformat(used)
+        return f"{filesizeformat(used)} / {filesizeformat(quota)} ({used * 100 // quota}%)"
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rebuild_storage_counters()
+            self.stdout.write("Counters rebuilt from material sizes.")
+
+        top = options['top']
+        course_quota = getattr(settings, 'COURSE_STORAGE_QUOTA', None)
+        uploader_quota = getattr(settings, 'UPLOADER_STORAGE_QUOTA', None)
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Courses"))
+        courses = Course.objects.filter(storage_files__gt=0).order_by(
+            '-storage_bytes').only('code', 'name', 'storage_bytes', 'storage_files')[:top]
+        for course in courses:
+            self.stdout.write(
+                f"  {course.code:<20} {course.storage_files:>6} files  "
+                f"{self._usage(course.storage_bytes, course_quota)}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Uploaders"))
+        uploaders = elearnUser.objects.filter(storage_files__gt=0).select_related(
+            'user').order_by('-storage_bytes')[:top]
+        for uploader in uploaders:
+            self.stdout.write(
+                f"  {uploader.user.username:<20} {uploader.storage_files:>6} files  "
+                f"{self._usage(uploader.storage_bytes, uploader_quota)}")
@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from eLearning_app.db_router import forget_replica_health
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database over each SQLite replica stand-in in DATABASE_REPLICAS."
+
+    def handle(self, *args, **options):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("Only SQLite replicas can be refreshed this way; real replicas follow the primary themselves.")
+        if not replicas:
+            self.stdout.write("No replicas configured, set DATABASE_REPLICA_PATHS.")
+            return
+
+        source = sqlite3.connect(connections['default'].settings_dict['NAME'])
+        try:
+            for alias in replicas:
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    # The backup API takes a consistent snapshot even while the primary is written to
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"Refreshed {alias}.")
+        finally:
+            source.close()
+        forget_replica_health()
+        self.stdout.write(self.style.SUCCESS(f"Synced {len(replicas)} replica(s)."))
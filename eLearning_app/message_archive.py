@@ -0,0 +1,199 @@
+"""
+Old chat messages leave the Message table for compressed segment files, one per room and
+month, so the table only holds recent conversation. A segment file is gzip-compressed JSON
+lines, one message per line; it is only ever appended to, each archiving batch adding one
+more gzip member. Its MessageArchiveSegment row is the index: where the file lives, how many
+messages it holds and the positions of its oldest and newest message.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone as django_timezone
+
+from .cursors import decode_cursor, encode_cursor
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Whole months of messages kept in the Message table before `manage.py archive_messages` moves them
+DEFAULT_MESSAGE_ARCHIVE_AFTER_MONTHS = 6
+MESSAGE_PAGE_SIZE = 50
+
+
+def archive_root():
+    return getattr(settings, 'MESSAGE_ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'message_archive'))
+
+
+def archive_cutoff(months=None):
+    """ Start of the UTC month `months` before the current one; messages posted before it are archived """
+    if months is None:
+        months = getattr(settings, 'MESSAGE_ARCHIVE_AFTER_MONTHS', DEFAULT_MESSAGE_ARCHIVE_AFTER_MONTHS)
+    now = django_timezone.now().astimezone(timezone.utc)
+    year, month = divmod(now.year * 12 + now.month - 1 - months, 12)
+    return datetime(year, month + 1, 1, tzinfo=timezone.utc)
+
+
+def _month_of(moment):
+    return moment.astimezone(timezone.utc).date().replace(day=1)
+
+
+def segment_path(chat_room_id, month):
+    return f'{chat_room_id}/{month:%Y-%m}.jsonl.gz'
+
+
+def _append_to_segment(path, messages):
+    """ Add `messages` to a segment file as one more gzip member, and make sure it reached the disk """
+    absolute = os.path.join(archive_root(), path)
+    os.makedirs(os.path.dirname(absolute), exist_ok=True)
+    with open(absolute, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as member:
+            for message in messages:
+                row = {'id': message.pk, 'user_id': message.user_id, 'content': message.content,
+                       'timestamp': message.timestamp.isoformat()}
+                member.write((json.dumps(row) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def read_segment(path):
+    """ Return the rows of a segment file as dicts, with their timestamps parsed """
+    try:
+        with gzip.open(os.path.join(archive_root(), path), 'rt', encoding='utf-8') as segment:
+            rows = [json.loads(line) for line in segment]
+    except FileNotFoundError:
+        logger.error("Message archive segment %s is missing", path)
+        return []
+    for row in rows:
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return rows
+
+
+def delete_segment_file(path):
+    try:
+        os.remove(os.path.join(archive_root(), path))
+    except FileNotFoundError:
+        pass
+
+
+def schedule_segment_file_deletion(path):
+    # A rolled back delete keeps its segment row, which still needs the file
+    transaction.on_commit(lambda: delete_segment_file(path))
+
+
+def _archive_group(chat_room_id, month, messages):
+    from .models import Message, MessageArchiveSegment, MessageSearchToken
+
+    path = segment_path(chat_room_id, month)
+    first, last = messages[0], messages[-1]
+    with transaction.atomic():
+        segment = MessageArchiveSegment.objects.select_for_update().filter(
+            chat_room_id=chat_room_id, month=month).first()
+        # Rows written here before a failed commit are still in the table; reads skip the duplicates
+        _append_to_segment(path, messages)
+        if segment is None:
+            segment = MessageArchiveSegment(
+                chat_room_id=chat_room_id, month=month, path=path,
+                first_timestamp=first.timestamp, first_message_id=first.pk,
+                last_timestamp=last.timestamp, last_message_id=last.pk)
+        if (first.timestamp, first.pk) < (segment.first_timestamp, segment.first_message_id):
+            segment.first_timestamp, segment.first_message_id = first.timestamp, first.pk
+        if (last.timestamp, last.pk) > (segment.last_timestamp, segment.last_message_id):
+            segment.last_timestamp, segment.last_message_id = last.timestamp, last.pk
+        segment.message_count += len(messages)
+        segment.save()
+        # Archived messages still exist for their readers: no delete signals, so sync clients
+        # are not told to drop them, and no per-message audience lookups. Search only covers
+        # the table, so their tokens go first.
+        archived_ids = [message.pk for message in messages]
+        tokens = MessageSearchToken.objects.filter(message_id__in=archived_ids)
+        tokens._raw_delete(tokens.db)
+        archived = Message.objects.filter(pk__in=archived_ids)
+        archived._raw_delete(archived.db)
+    # The segment's save bumped its room; API lists of messages change too
+    bump_version('message', f'chatroom:{chat_room_id}')
+
+
+def archive_messages(cutoff, batch_size=1000):
+    """
+    Move messages posted before `cutoff` into their room's segment for the month they were
+    posted in, at most `batch_size` messages per pass. Each room and month of a pass is
+    appended and deleted in its own transaction. Returns (messages archived, segments written).
+    """
+    from .models import Message
+
+    archived, segments = 0, set()
+    while True:
+        batch = list(Message.objects.filter(timestamp__lt=cutoff).order_by(
+            'chat_room_id', 'timestamp', 'id')[:batch_size])
+        if not batch:
+            break
+        for (chat_room_id, month), messages in groupby(
+                batch, key=lambda message: (message.chat_room_id, _month_of(message.timestamp))):
+            _archive_group(chat_room_id, month, list(messages))
+            segments.add((chat_room_id, month))
+        archived += len(batch)
+    return archived, len(segments)
+
+
+def _archived_before(chat_room_id, position, count, seen):
+    """ Up to `count` archived rows of a room before `position`, newest first, skipping ids in `seen` """
+    from .models import MessageArchiveSegment
+
+    segments = MessageArchiveSegment.objects.filter(chat_room_id=chat_room_id)
+    if position is not None:
+        timestamp, pk = position
+        segments = segments.filter(
+            Q(first_timestamp__lt=timestamp) | Q(first_timestamp=timestamp, first_message_id__lt=pk))
+
+    rows = []
+    # Months do not overlap, so once enough rows are found older segments need not be opened
+    for segment in segments.order_by('-month').only('path'):
+        segment_rows = [row for row in read_segment(segment.path)
+                        if position is None or (row['timestamp'], row['id']) < position]
+        segment_rows.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+        for row in segment_rows:
+            if row['id'] not in seen:
+                seen.add(row['id'])
+                rows.append(row)
+        if len(rows) >= count:
+            break
+    return rows
+
+
+def message_history_page(chat_room_id, cursor=None, limit=MESSAGE_PAGE_SIZE):
+    """
+    Return (messages, next_cursor) for one page of a room's history, oldest first, ending
+    just before `cursor` or with the newest message. Pages come from the Message table
+    while it has older messages and then read on into the archive segments; archived
+    messages are unsaved Message instances with `archived` set, and the messages of
+    deleted users are left out as they would have been deleted with them.
+    """
+    from .models import Message, User
+
+    messages = Message.objects.filter(chat_room_id=chat_room_id).select_related('user')
+    position = decode_cursor(cursor)
+    if position is not None:
+        timestamp, pk = position
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+    page = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+
+    if len(page) <= limit:
+        rows = _archived_before(chat_room_id, position, limit + 1 - len(page), {message.pk for message in page})
+        users = User.objects.in_bulk({row['user_id'] for row in rows})
+        for row in rows:
+            if row['user_id'] in users:
+                message = Message(id=row['id'], chat_room_id=chat_room_id, user=users[row['user_id']],
+                                  content=row['content'], timestamp=row['timestamp'])
+                message.archived = True
+                page.append(message)
+        page.sort(key=lambda message: (message.timestamp, message.pk), reverse=True)
+
+    next_cursor = encode_cursor(page[limit - 1].timestamp, page[limit - 1].pk) if len(page) > limit else None
+    return page[:limit][::-1], next_cursor
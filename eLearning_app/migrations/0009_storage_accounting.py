@@ -0,0 +1,62 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:01
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_storage_usage(apps, schema_editor):
+    # One-off stat of the existing files; afterwards the counters are kept up to date on save
+    Material = apps.get_model('eLearning_app', 'Material')
+    Course = apps.get_model('eLearning_app', 'Course')
+    elearnUser = apps.get_model('eLearning_app', 'elearnUser')
+
+    for material in Material.objects.only('id', 'file').iterator():
+        try:
+            size = material.file.size if material.file else 0
+        except OSError:
+            size = 0
+        Material.objects.filter(pk=material.pk).update(file_size=size)
+
+    for model, field in ((Course, 'course'), (elearnUser, 'uploader')):
+        totals = Material.objects.values(field).annotate(
+            total=Sum('file_size'), files=Count('id'))
+        for row in totals:
+            model.objects.filter(pk=row[field]).update(
+                storage_bytes=row['total'] or 0, storage_files=row['files'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0008_user_profile_picture_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='storage_bytes',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='storage_files',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='elearnuser',
+            name='storage_bytes',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='elearnuser',
+            name='storage_files',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='file_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_storage_usage,
+                             migrations.RunPython.noop),
+    ]
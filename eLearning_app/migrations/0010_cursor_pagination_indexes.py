@@ -0,0 +1,25 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0009_storage_accounting'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blocknotification',
+            index=models.Index(fields=['timestamp', 'id'], name='eLearning_a_timesta_14781f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['upload_date', 'id'], name='eLearning_a_upload__acb949_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statusupdate',
+            index=models.Index(fields=['timestamp', 'id'], name='eLearning_a_timesta_de0891_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:12
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def backfill_notification_counters(apps, schema_editor):
+    # Count the unread notifications once; afterwards the counters are kept up to date on save
+    NotificationCounter = apps.get_model('eLearning_app', 'NotificationCounter')
+    counted = (
+        ('EnrollmentNotification', 'enrollment_unread', ('student', 'teacher')),
+        ('MaterialNotification', 'material_unread', ('student',)),
+        ('BlockNotification', 'block_unread', ('student',)),
+    )
+
+    counters = defaultdict(dict)
+    for model_name, field, recipient_fields in counted:
+        model = apps.get_model('eLearning_app', model_name)
+        for recipient_field in recipient_fields:
+            totals = model.objects.filter(read=False).values(
+                recipient_field).annotate(unread=Count('id'))
+            for row in totals:
+                user_counts = counters[row[recipient_field]]
+                user_counts[field] = user_counts.get(field, 0) + row['unread']
+
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id, **counts) for user_id, counts in counters.items()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0010_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_counter', serialize=False, to='eLearning_app.elearnuser')),
+                ('enrollment_unread', models.PositiveIntegerField(default=0)),
+                ('material_unread', models.PositiveIntegerField(default=0)),
+                ('block_unread', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_notification_counters,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0011_notification_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrollmentnotification',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='materialnotification',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_inbox(apps, schema_editor):
+    # Historical models have no custom __str__, so the display strings are built here
+    InboxItem = apps.get_model('eLearning_app', 'InboxItem')
+    EnrollmentNotification = apps.get_model('eLearning_app', 'EnrollmentNotification')
+    MaterialNotification = apps.get_model('eLearning_app', 'MaterialNotification')
+    BlockNotification = apps.get_model('eLearning_app', 'BlockNotification')
+
+    def course_label(course):
+        return f"{course.code} - {course.name}"
+
+    def items():
+        for notification in EnrollmentNotification.objects.select_related(
+                'course', 'student__user').iterator():
+            payload = {
+                'student': f"{notification.student.user.first_name} {notification.student.user.last_name}",
+                'course': course_label(notification.course),
+            }
+            for recipient_id in (notification.student_id, notification.teacher_id):
+                yield InboxItem(recipient_id=recipient_id, kind='enrollment', source_id=notification.pk,
+                                course_id=notification.course_id, payload=payload,
+                                read=notification.read, created=notification.timestamp)
+        for notification in MaterialNotification.objects.select_related('material__course').iterator():
+            yield InboxItem(recipient_id=notification.student_id, kind='material', source_id=notification.pk,
+                            course_id=notification.material.course_id,
+                            payload={'material': notification.material.name,
+                                     'course': course_label(notification.material.course)},
+                            read=notification.read, created=notification.timestamp)
+        for notification in BlockNotification.objects.select_related('course').iterator():
+            yield InboxItem(recipient_id=notification.student_id, kind='block', source_id=notification.pk,
+                            course_id=notification.course_id,
+                            payload={'message': notification.message,
+                                     'course': course_label(notification.course)},
+                            read=notification.read, created=notification.timestamp)
+
+    batch = []
+    for item in items():
+        batch.append(item)
+        if len(batch) == 500:
+            InboxItem.objects.bulk_create(batch)
+            batch = []
+    InboxItem.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0012_notification_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxItem',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('enrollment', 'Enrollment'), ('material', 'Material'), ('block', 'Block')], max_length=20)),
+                ('source_id', models.BigIntegerField()),
+                ('payload', models.JSONField(default=dict)),
+                ('read', models.BooleanField(default=False)),
+                ('created', models.DateTimeField()),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='eLearning_app.course')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_items', to='eLearning_app.elearnuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', 'read', 'created'], name='eLearning_a_recipie_c022ef_idx'), models.Index(fields=['kind', 'source_id'], name='eLearning_a_kind_9f69fc_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
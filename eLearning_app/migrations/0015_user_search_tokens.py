@@ -0,0 +1,44 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from eLearning_app.search_index import user_tokens
+
+
+def index_existing_users(apps, schema_editor):
+    User = apps.get_model('eLearning_app', 'User')
+    UserSearchToken = apps.get_model('eLearning_app', 'UserSearchToken')
+
+    batch = []
+    for user in User.objects.only('username', 'first_name', 'last_name').iterator():
+        batch += [UserSearchToken(user_id=user.pk, kind=kind, token=token)
+                  for kind, token in user_tokens(user)]
+        if len(batch) >= 500:
+            UserSearchToken.objects.bulk_create(batch)
+            batch = []
+    UserSearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0014_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('word', 'Word'), ('trigram', 'Trigram')], max_length=10)),
+                ('token', models.CharField(max_length=64)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'token'], name='eLearning_a_kind_00d1e1_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_users, migrations.RunPython.noop),
+    ]
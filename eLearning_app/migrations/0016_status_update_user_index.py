@@ -0,0 +1,17 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0015_user_search_tokens'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='statusupdate',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='eLearning_a_user_id_7e4051_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0016_status_update_user_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blocknotification',
+            index=models.Index(fields=['student', 'course'], name='eLearning_a_student_53064e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blocknotification',
+            index=models.Index(condition=models.Q(('read', False)), fields=['student', 'timestamp'], name='blocknotif_unread_student'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['enrollment_status'], name='eLearning_a_enrollm_b80e14_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materialnotification',
+            index=models.Index(condition=models.Q(('read', False)), fields=['student', 'timestamp'], name='matnotif_unread_student'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_room', 'timestamp', 'id'], name='eLearning_a_chat_ro_fffb2e_idx'),
+        ),
+    ]
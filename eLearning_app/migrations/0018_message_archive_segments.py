@@ -0,0 +1,32 @@
+# Generated by Django 4.2.15 on 2026-10-19 18:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0017_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('chat_room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='eLearning_app.chatroom')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='messagearchivesegment',
+            constraint=models.UniqueConstraint(fields=('chat_room', 'month'), name='unique_archive_segment_per_room_month'),
+        ),
+    ]
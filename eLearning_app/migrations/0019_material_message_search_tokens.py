@@ -0,0 +1,55 @@
+# Generated by Django 4.2.15 on 2026-10-19 19:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from eLearning_app.search_index import INDEXED_TEXT_FIELDS, words
+
+
+def index_existing_texts(apps, schema_editor):
+    for model_name, token_model in (('Material', 'MaterialSearchToken'), ('Message', 'MessageSearchToken')):
+        Model = apps.get_model('eLearning_app', model_name)
+        Token = apps.get_model('eLearning_app', token_model)
+        fields = INDEXED_TEXT_FIELDS[model_name.lower()]
+
+        batch = []
+        for instance in Model.objects.only(*fields).iterator():
+            tokens = {word for field in fields for word in words(getattr(instance, field))}
+            batch += [Token(**{f'{model_name.lower()}_id': instance.pk}, token=token) for token in tokens]
+            if len(batch) >= 500:
+                Token.objects.bulk_create(batch)
+                batch = []
+        Token.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eLearning_app', '0018_message_archive_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchToken',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=64)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='eLearning_app.message')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'message'], name='eLearning_a_token_edc609_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MaterialSearchToken',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=64)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='eLearning_app.material')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'material'], name='eLearning_a_token_8dfbd5_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_texts, migrations.RunPython.noop),
+    ]
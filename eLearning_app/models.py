@@ -1,8 +1,9 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
 from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 
 
@@ -12,10 +13,23 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=256)
     last_name = models.CharField(max_length=256)
     email = models.EmailField(max_length=256)
+    # Resized copies of profile_picture, filled in by images.py after upload
+    profile_picture_variants = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    def profile_picture_url(self, size='medium', fmt='webp'):
+        """ Return the URL of a resized profile picture, falling back to the original until it has been processed """
+        if not self.profile_picture:
+            return None
+        variants = self.profile_picture_variants or {}
+        if variants.get('source') == self.profile_picture.name:
+            path = variants.get('sizes', {}).get(size, {}).get(fmt)
+            if path:
+                return self.profile_picture.storage.url(path)
+        return self.profile_picture.url
+
 
 class elearnUser(models.Model):
     USER_TYPE_CHOICES = [
@@ -25,6 +39,9 @@ class elearnUser(models.Model):
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, primary_key=True)
     user_type = models.CharField(max_length=10, choices=USER_TYPE_CHOICES)
+    # Running totals of the materials this user uploaded, see storage_accounting.py
+    storage_bytes = models.PositiveBigIntegerField(default=0)
+    storage_files = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -45,6 +62,13 @@ class Course(models.Model):
         'open', 'Open'), ('closed', 'Closed')], default='open')
     blocked_students = models.ManyToManyField(
         settings.AUTH_USER_MODEL, related_name='blocked_courses', blank=True)
+    # Running totals of the course's materials, see storage_accounting.py
+    storage_bytes = models.PositiveBigIntegerField(default=0)
+    storage_files = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Serves the list of courses open for enrollment
+        indexes = [models.Index(fields=['enrollment_status'])]
 
     def __str__(self):
         return f"{self.code} - {self.name}"
@@ -69,6 +93,12 @@ class Material(models.Model):
     file_type = models.CharField(max_length=50, blank=True)
     name = models.CharField(max_length=255, default="Untitled Material")
     description = models.TextField(blank=True)
+    # Size in bytes of the stored file, recorded when the file is uploaded
+    file_size = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        # Supports cursor pagination of /api/materials/
+        indexes = [models.Index(fields=['upload_date', 'id'])]
 
 
 class Feedback(models.Model):
@@ -87,6 +117,14 @@ class StatusUpdate(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     content = models.TextField()
 
+    class Meta:
+        indexes = [
+            # Supports cursor pagination of /api/statusupdates/
+            models.Index(fields=['timestamp', 'id']),
+            # Serves one user's updates, newest first, as one range scan, see status_updates.py
+            models.Index(fields=['user', 'timestamp', 'id']),
+        ]
+
 
 class Enrollment(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -103,6 +141,7 @@ class EnrollmentNotification(models.Model):
     teacher = models.ForeignKey(elearnUser, on_delete=models.CASCADE,
                                 related_name='teacher', limit_choices_to=Q(user_type='teacher'))
     read = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(auto_now_add=True)
 
 
 class MaterialNotification(models.Model):
@@ -111,6 +150,14 @@ class MaterialNotification(models.Model):
     student = models.ForeignKey(
         elearnUser, on_delete=models.CASCADE, limit_choices_to=Q(user_type='student'))
     read = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Unread notifications only: the read ones pile up until pruned and are never looked up by student
+        indexes = [
+            models.Index(fields=['student', 'timestamp'], condition=Q(read=False),
+                         name='matnotif_unread_student'),
+        ]
 
 
 class ChatRoom(models.Model):
@@ -138,6 +185,13 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # Set on the unsaved copies message_archive.py builds from archive segments
+    archived = False
+
+    class Meta:
+        # Serves a room's messages in posting order without sorting them
+        indexes = [models.Index(fields=['chat_room', 'timestamp', 'id'])]
+
     def __str__(self):
         return f'{self.user.username}: {self.content[:20]}'
 
@@ -149,6 +203,130 @@ class Message(models.Model):
         return False
 
 
+class MessageArchiveSegment(models.Model):
+    """ The archived messages of one room for one month, stored in a compressed file, see message_archive.py """
+    id = models.BigAutoField(primary_key=True)
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archive_segments')
+    # First day of the month, in UTC
+    month = models.DateField()
+    # Relative to MESSAGE_ARCHIVE_ROOT
+    path = models.CharField(max_length=255)
+    message_count = models.PositiveIntegerField(default=0)
+    # Position of the oldest and newest archived message, so history reads skip segments they do not need
+    first_timestamp = models.DateTimeField()
+    first_message_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat_room', 'month'], name='unique_archive_segment_per_room_month'),
+        ]
+
+    def __str__(self):
+        return f'{self.chat_room_id} {self.month:%Y-%m}'
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    from .sqlite import configure_connection
+    configure_connection(connection)
+
+
+@receiver(post_save, sender=User)
+def process_profile_picture(sender, instance, **kwargs):
+    from .images import delete_profile_picture_variants, schedule_profile_picture_variants
+    variants = instance.profile_picture_variants or {}
+    if instance.profile_picture:
+        if variants.get('source') != instance.profile_picture.name:
+            schedule_profile_picture_variants(instance.pk)
+    elif variants:
+        delete_profile_picture_variants(instance.pk)
+
+
+class UserSearchToken(models.Model):
+    """ A normalized word or trigram of a user's username or names, see search_index.py """
+    KIND_CHOICES = [
+        ('word', 'Word'),
+        ('trigram', 'Trigram'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_tokens')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            # Serves exact, prefix (as a range) and trigram lookups
+            models.Index(fields=['kind', 'token']),
+        ]
+
+
+class MaterialSearchToken(models.Model):
+    """ A normalized word of a material's name or description, see search_index.py """
+    id = models.BigAutoField(primary_key=True)
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            # Serves word prefix lookups as a range, without reading the rows
+            models.Index(fields=['token', 'material']),
+        ]
+
+
+class MessageSearchToken(models.Model):
+    """ A normalized word of a chat message, see search_index.py """
+    id = models.BigAutoField(primary_key=True)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'message']),
+        ]
+
+
+@receiver(post_save, sender=User)
+def index_user_for_search(sender, instance, update_fields=None, **kwargs):
+    from .search_index import INDEXED_USER_FIELDS, index_users
+    if update_fields is not None and not set(update_fields) & set(INDEXED_USER_FIELDS):
+        return
+    index_users([instance])
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Message)
+def index_text_for_search(sender, instance, created, update_fields=None, **kwargs):
+    from .search_index import INDEXED_TEXT_FIELDS, index_texts
+    if update_fields is not None and not set(update_fields) & set(INDEXED_TEXT_FIELDS[sender._meta.model_name]):
+        return
+    index_texts([instance], created=created)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Course)
+def update_autocomplete(sender, instance, update_fields=None, **kwargs):
+    from .autocomplete import INDEXED_FIELDS, schedule_update
+    if update_fields is not None and not set(update_fields) & INDEXED_FIELDS[sender._meta.model_name]:
+        return
+    schedule_update(instance)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Course)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    from .autocomplete import schedule_removal
+    schedule_removal(instance)
+
+
+@receiver(post_save, sender=StatusUpdate)
+def push_status_update_to_timelines(sender, instance, created, **kwargs):
+    from .timelines import schedule_fan_out
+    if created:
+        schedule_fan_out(instance)
+
+
 @receiver(post_save, sender=Enrollment)
 def create_enrollment_notification(sender, instance, created, **kwargs):
     if created:
@@ -159,14 +337,35 @@ def create_enrollment_notification(sender, instance, created, **kwargs):
         )
 
 
+@receiver(pre_save, sender=Material)
+def record_material_file_size(sender, instance, **kwargs):
+    from .storage_accounting import remember_stored_material
+    if instance.file and not instance.file._committed:
+        instance.file_size = instance.file.size
+    remember_stored_material(instance)
+
+
+@receiver(post_save, sender=Material)
+def account_material_storage(sender, instance, **kwargs):
+    from .storage_accounting import apply_material_change
+    apply_material_change(instance)
+
+
+@receiver(post_delete, sender=Material)
+def release_material_storage(sender, instance, **kwargs):
+    from .storage_accounting import release_material
+    release_material(instance)
+
+
 @receiver(post_save, sender=Material)
 def create_material_notification(sender, instance, created, **kwargs):
     if created:
-        for student in instance.course.students.all():
-            MaterialNotification.objects.create(
-                material=instance,
-                student=student
-            )
+        # In batches like bulk uploads, rather than one save and its receivers per student
+        from .bulk import notify_students_of_materials
+        from .versions import bump_instance_versions
+        with transaction.atomic():
+            notifications = notify_students_of_materials([instance])
+        bump_instance_versions(notifications)
 
 
 class BlockNotification(models.Model):
@@ -178,5 +377,214 @@ class BlockNotification(models.Model):
     read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Supports cursor pagination of /api/blocknotifications/
+            models.Index(fields=['timestamp', 'id']),
+            # Whether, and from which courses, a student is blocked
+            models.Index(fields=['student', 'course']),
+            models.Index(fields=['student', 'timestamp'], condition=Q(read=False),
+                         name='blocknotif_unread_student'),
+        ]
+
     def __str__(self):
         return f"Blocked Notification for {self.student.user.username} in {self.course.name}"
+
+
+class NotificationCounter(models.Model):
+    """ Unread notifications of each type for one user, see notification_counters.py """
+    user = models.OneToOneField(
+        elearnUser, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    enrollment_unread = models.PositiveIntegerField(default=0)
+    material_unread = models.PositiveIntegerField(default=0)
+    block_unread = models.PositiveIntegerField(default=0)
+
+
+class InboxItem(models.Model):
+    """ One notification as shown to one recipient, written alongside the per-type tables, see notifications.py """
+    KIND_CHOICES = [
+        ('enrollment', 'Enrollment'),
+        ('material', 'Material'),
+        ('block', 'Block'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    recipient = models.ForeignKey(
+        elearnUser, on_delete=models.CASCADE, related_name='inbox_items')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Primary key of the notification in the table for its kind
+    source_id = models.BigIntegerField()
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, null=True, blank=True)
+    # Everything needed to display the item without joining the source tables
+    payload = models.JSONField(default=dict)
+    read = models.BooleanField(default=False)
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Serves the unread inbox of a user as one range scan, newest first
+            models.Index(fields=['recipient', 'read', 'created']),
+            models.Index(fields=['kind', 'source_id']),
+        ]
+
+
+class ChangeLogEntry(models.Model):
+    """ One created, updated or deleted object as seen by one user, read back by /api/sync/, see change_log.py """
+    ACTION_CHOICES = [
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    ]
+    # Doubles as the sync token: clients ask for the entries after the last id they saw
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='change_log')
+    model = models.CharField(max_length=40)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Serves a user's feed as one range scan from their token
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'model', 'object_id']),
+        ]
+
+
+@receiver(pre_save, sender=EnrollmentNotification)
+@receiver(pre_save, sender=MaterialNotification)
+@receiver(pre_save, sender=BlockNotification)
+def record_notification_read(sender, instance, **kwargs):
+    from .notification_counters import remember_stored_read
+    remember_stored_read(instance)
+
+
+@receiver(post_save, sender=EnrollmentNotification)
+@receiver(post_save, sender=MaterialNotification)
+@receiver(post_save, sender=BlockNotification)
+def count_saved_notification(sender, instance, created, **kwargs):
+    from .notification_counters import apply_read_change
+    apply_read_change(instance, created)
+
+
+@receiver(post_delete, sender=EnrollmentNotification)
+@receiver(post_delete, sender=MaterialNotification)
+@receiver(post_delete, sender=BlockNotification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    from .notification_counters import count_notifications
+    if instance.__dict__.get('read') is False:
+        count_notifications([instance], -1)
+
+
+@receiver(post_save, sender=EnrollmentNotification)
+@receiver(post_save, sender=MaterialNotification)
+@receiver(post_save, sender=BlockNotification)
+def mirror_notification_in_inbox(sender, instance, created, **kwargs):
+    from .notifications import add_to_inbox, sync_inbox_read
+    if created:
+        add_to_inbox([instance])
+    else:
+        sync_inbox_read(instance)
+
+
+@receiver(post_delete, sender=EnrollmentNotification)
+@receiver(post_delete, sender=MaterialNotification)
+@receiver(post_delete, sender=BlockNotification)
+def remove_notification_from_inbox(sender, instance, **kwargs):
+    from .notifications import remove_from_inbox
+    remove_from_inbox(instance)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=EnrollmentNotification)
+@receiver(post_save, sender=MaterialNotification)
+@receiver(post_save, sender=BlockNotification)
+def log_saved_change(sender, instance, **kwargs):
+    from .change_log import log_changes
+    log_changes([instance])
+
+
+@receiver(pre_delete, sender=Course)
+@receiver(pre_delete, sender=Material)
+@receiver(pre_delete, sender=Message)
+@receiver(pre_delete, sender=EnrollmentNotification)
+@receiver(pre_delete, sender=MaterialNotification)
+@receiver(pre_delete, sender=BlockNotification)
+def remember_change_audience(sender, instance, **kwargs):
+    from .change_log import remember_audience
+    remember_audience(instance)
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Material)
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=EnrollmentNotification)
+@receiver(post_delete, sender=MaterialNotification)
+@receiver(post_delete, sender=BlockNotification)
+def log_deleted_change(sender, instance, **kwargs):
+    from .change_log import log_deletion
+    log_deletion(instance)
+
+
+@receiver(post_delete, sender=MessageArchiveSegment)
+def delete_archive_segment_file(sender, instance, **kwargs):
+    from .message_archive import schedule_segment_file_deletion
+    schedule_segment_file_deletion(instance.path)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def log_enrollment_change(sender, instance, action, reverse, pk_set, **kwargs):
+    from .change_log import log_enrollment_changes
+    if action == 'pre_clear':
+        # The cleared ids are gone by post_clear
+        related = instance.enrolled_courses if reverse else instance.students
+        instance._cleared_ids = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_ids', set())
+    pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set or ()]
+    log_enrollment_changes(pairs, 'upsert' if action == 'post_add' else 'delete')
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def refresh_enrollment_timelines(sender, instance, action, reverse, pk_set, **kwargs):
+    from .timelines import refresh_enrollment_timelines
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        # Remembered by log_enrollment_change at pre_clear
+        pk_set = getattr(instance, '_cleared_ids', set())
+    if not pk_set:
+        return
+    if reverse:
+        refresh_enrollment_timelines(pk_set, [instance.pk])
+    else:
+        refresh_enrollment_timelines([instance.pk], pk_set)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_model_versions(sender, instance, **kwargs):
+    """ Invalidate the ETags of pages and API responses built from this object """
+    from .versions import UNVERSIONED_MODELS, bump_version, version_scopes
+    if sender._meta.app_label != 'eLearning_app' or sender._meta.model_name in UNVERSIONED_MODELS:
+        return
+    # Logging in only touches last_login, which no page shows
+    if kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    bump_version(*version_scopes(instance))
+
+
+@receiver(m2m_changed)
+def bump_relation_versions(sender, instance, action, model, pk_set, **kwargs):
+    from .versions import bump_version, version_scopes
+    if instance._meta.app_label != 'eLearning_app' or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    scopes = version_scopes(instance)
+    # The other side of the relation changed too (elearnUser shares its user's primary key)
+    related_label = 'user' if model._meta.model_name == 'elearnuser' else model._meta.model_name
+    scopes += [related_label] + [f'{related_label}:{pk}' for pk in pk_set or ()]
+    bump_version(*scopes)
@@ -0,0 +1,98 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+
+# Counter field of each notification type and the fields naming the users it is shown to.
+# Enrollment notifications appear on both the student's and the teacher's profile.
+COUNTED_NOTIFICATIONS = {
+    'enrollmentnotification': ('enrollment_unread', ('student_id', 'teacher_id')),
+    'materialnotification': ('material_unread', ('student_id',)),
+    'blocknotification': ('block_unread', ('student_id',)),
+}
+
+SUMMARY_FIELDS = {
+    'enrollment': 'enrollment_unread',
+    'material': 'material_unread',
+    'block': 'block_unread',
+}
+
+
+def adjust_unread(field, deltas):
+    """ Add {recipient_id: delta} to one unread counter, creating missing counter rows """
+    from .models import NotificationCounter
+
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=pk) for pk in deltas], ignore_conflicts=True)
+    # One UPDATE per distinct delta, a single one in the common case
+    recipients = defaultdict(list)
+    for pk, delta in deltas.items():
+        recipients[delta].append(pk)
+    for delta, pks in recipients.items():
+        NotificationCounter.objects.filter(pk__in=pks).update(
+            **{field: Greatest(F(field) + delta, Value(0))})
+
+
+def count_notifications(notifications, delta):
+    """ Add `delta` to the counters of every user each notification is shown to """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for notification in notifications:
+        field, recipient_fields = COUNTED_NOTIFICATIONS[notification._meta.model_name]
+        for recipient_field in recipient_fields:
+            deltas[field][getattr(notification, recipient_field)] += delta
+    with transaction.atomic():
+        for field, per_recipient in deltas.items():
+            adjust_unread(field, per_recipient)
+
+
+def remember_stored_read(notification):
+    """ Keep the read flag currently stored for a notification, so a later save can be compared with it """
+    if notification.pk is None:
+        notification._stored_read = None
+    else:
+        notification._stored_read = type(notification).objects.filter(
+            pk=notification.pk).values_list('read', flat=True).first()
+
+
+def apply_read_change(notification, created):
+    """ Update the counters after a notification was created, read or marked unread again """
+    stored = getattr(notification, '_stored_read', None)
+    read = notification.read
+    if created or stored is None:
+        delta = 0 if read else 1
+    elif stored == read:
+        delta = 0
+    else:
+        delta = -1 if read else 1
+    notification._stored_read = read
+    if delta:
+        count_notifications([notification], delta)
+
+
+def unread_summary(user_id):
+    """ Return unread counts per notification type and in total, from the user's counter row """
+    from .models import NotificationCounter
+
+    counts = NotificationCounter.objects.filter(pk=user_id).values(
+        *SUMMARY_FIELDS.values()).first() or {}
+    summary = {name: counts.get(field, 0) for name, field in SUMMARY_FIELDS.items()}
+    summary['total'] = sum(summary.values())
+    return summary
+
+
+def rebuild_notification_counters():
+    """ Recompute every counter by counting the unread notifications """
+    from .models import BlockNotification, EnrollmentNotification, MaterialNotification, NotificationCounter
+
+    with transaction.atomic():
+        NotificationCounter.objects.all().delete()
+        for model in (EnrollmentNotification, MaterialNotification, BlockNotification):
+            field, recipient_fields = COUNTED_NOTIFICATIONS[model._meta.model_name]
+            for recipient_field in recipient_fields:
+                totals = model.objects.filter(read=False).values(
+                    recipient_field).annotate(unread=Count('id'))
+                adjust_unread(field, {row[recipient_field]: row['unread'] for row in totals})
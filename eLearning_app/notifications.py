@@ -0,0 +1,418 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.forms.models import model_to_dict
+from django.utils import timezone as django_timezone
+
+from .change_log import record_changes
+from .cursors import decode_cursor, encode_cursor
+from .notification_counters import COUNTED_NOTIFICATIONS, adjust_unread
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+# InboxItem.kind of each notification model
+NOTIFICATION_KINDS = {
+    'enrollmentnotification': 'enrollment',
+    'materialnotification': 'material',
+    'blocknotification': 'block',
+}
+
+# Lookup from each notification type to the course it is about
+COURSE_LOOKUPS = {
+    'enrollment': 'course_id',
+    'material': 'material__course_id',
+    'block': 'course_id',
+}
+
+# Notification types in the inbox of each user type; students are not shown their own enrollments
+INBOX_KINDS = {
+    'student': ('material', 'block'),
+    'teacher': ('enrollment',),
+}
+
+# Material names listed in a digest inbox item, newest first
+DIGEST_MATERIALS = 5
+
+# Read notifications older than this many days are removed by prune_notifications
+DEFAULT_NOTIFICATION_RETENTION_DAYS = 90
+
+
+def notification_models():
+    """ Return {type: model} for the notification types, as used in URLs and API requests """
+    from .models import BlockNotification, EnrollmentNotification, MaterialNotification
+
+    return {
+        'enrollment': EnrollmentNotification,
+        'material': MaterialNotification,
+        'block': BlockNotification,
+    }
+
+
+def recipient_notifications(model, user_id):
+    """ Notifications of `model` shown to the user """
+    recipients = Q()
+    for recipient_field in COUNTED_NOTIFICATIONS[model._meta.model_name][1]:
+        recipients |= Q(**{recipient_field: user_id})
+    return model.objects.filter(recipients)
+
+
+def inbox_kinds(user_type):
+    return list(INBOX_KINDS.get(user_type, ()))
+
+
+def mark_notifications_read(user_id, kinds=None, ids=None, course_id=None, before=None):
+    """
+    Mark the user's unread notifications as read, one UPDATE per type, and return how many changed.
+
+    Only the notifications in the user's own inbox are marked: the types INBOX_KINDS gives
+    their user type, addressed to them in their role, so a student never marks the
+    teacher's copy of an enrollment. The filters combine: `kinds` limits the types (all
+    of the inbox by default), `ids` the rows of a single type, `course_id` the course
+    they are about and `before` their creation time.
+    """
+    from .models import InboxItem, elearnUser
+
+    models = notification_models()
+    user_type = elearnUser.objects.filter(pk=user_id).values_list('user_type', flat=True).first()
+    own_kinds = inbox_kinds(user_type)
+    kinds = list(kinds or own_kinds)
+    if ids is not None and len(kinds) != 1:
+        raise ValueError("Notification ids must be given together with a single type.")
+    recipient_field = 'teacher_id' if user_type == 'teacher' else 'student_id'
+
+    changed = 0
+    for kind in kinds:
+        if kind not in own_kinds:
+            continue
+        model = models[kind]
+        field, recipient_fields = COUNTED_NOTIFICATIONS[model._meta.model_name]
+        notifications = model.objects.filter(read=False, **{recipient_field: user_id})
+        if ids is not None:
+            notifications = notifications.filter(pk__in=ids)
+        if course_id is not None:
+            notifications = notifications.filter(**{COURSE_LOOKUPS[kind]: course_id})
+        if before is not None:
+            notifications = notifications.filter(timestamp__lt=before)
+
+        with transaction.atomic():
+            # Locks the rows where the database supports it, so each is uncounted exactly once
+            rows = list(notifications.select_for_update(of=('self',)).values_list(
+                'pk', *recipient_fields, COURSE_LOOKUPS[kind]))
+            if not rows:
+                continue
+            pks = [row[0] for row in rows]
+            model.objects.filter(pk__in=pks).update(read=True)
+            if kind == 'material':
+                # Before the update below, so a digest still holding unread materials is kept open
+                refresh_material_digests({(row[1], row[-1]) for row in rows})
+            InboxItem.objects.filter(kind=kind, source_id__in=pks).update(read=True)
+            recipients = set()
+            for position, recipient_field in enumerate(recipient_fields, start=1):
+                unread = Counter(row[position] for row in rows)
+                adjust_unread(field, {pk: -count for pk, count in unread.items()})
+                recipients.update(unread)
+            record_changes(model._meta.model_name, {
+                row[0]: set(row[1:len(recipient_fields) + 1]) for row in rows}, 'upsert')
+        # update() sends no signals, invalidate the pages and API objects showing these notifications here
+        model_name = model._meta.model_name
+        bump_version(model_name, *(f'{model_name}:{pk}' for pk in pks), *(f'user:{pk}' for pk in recipients))
+        publish_unread_counts(recipients)
+        changed += len(rows)
+    return changed
+
+
+def inbox_payload(kind, notification):
+    """ The fields an inbox item displays, copied from its notification when it is created """
+    if kind == 'enrollment':
+        return {'student': str(notification.student.user), 'course': str(notification.course)}
+    if kind == 'material':
+        name = notification.material.name
+        return {'material': name, 'course': str(notification.material.course),
+                'count': 1, 'materials': [name]}
+    return {'message': notification.message, 'course': str(notification.course)}
+
+
+def _fold_material_payload(older, newer):
+    """ Payload of a digest covering the materials of both payloads, `newer` being the latest upload """
+    materials = newer.get('materials', [newer['material']]) + older.get('materials', [older['material']])
+    return {
+        'material': newer['material'],
+        'course': newer['course'],
+        'count': older.get('count', 1) + newer.get('count', 1),
+        'materials': materials[:DIGEST_MATERIALS],
+    }
+
+
+def _merge_material_digests(digests, batch_size):
+    """
+    Fold {(recipient_id, course_id): item} into the recipients' open digests for those
+    courses. Returns (new, updated): items still to be created and digests that grew.
+    """
+    from .models import InboxItem
+
+    recipients = {recipient_id for recipient_id, _ in digests}
+    courses = {course_id for _, course_id in digests}
+    existing = {}
+    for digest in InboxItem.objects.filter(
+            kind='material', read=False, recipient_id__in=recipients, course_id__in=courses):
+        existing.setdefault((digest.recipient_id, digest.course_id), digest)
+
+    new, updated = [], []
+    for key, item in digests.items():
+        digest = existing.get(key)
+        if digest is None:
+            new.append(item)
+            continue
+        digest.payload = _fold_material_payload(digest.payload, item.payload)
+        digest.source_id = item.source_id
+        digest.created = item.created
+        updated.append(digest)
+    InboxItem.objects.bulk_update(updated, ['payload', 'source_id', 'created'], batch_size=batch_size)
+    return new, updated
+
+
+def add_to_inbox(notifications, batch_size=500):
+    """
+    Write an inbox item for every recipient of each newly created notification.
+
+    Unread material notifications are digested: a recipient has at most one unread
+    material item per course, counting the uploads it stands for, so a batch of
+    uploads adds one row per student instead of one per file.
+    """
+    from .models import InboxItem
+
+    items, digests = [], {}
+    for notification in notifications:
+        model_name = notification._meta.model_name
+        kind = NOTIFICATION_KINDS[model_name]
+        payload = inbox_payload(kind, notification)
+        course_id = notification.material.course_id if kind == 'material' else notification.course_id
+        for recipient_field in COUNTED_NOTIFICATIONS[model_name][1]:
+            item = InboxItem(
+                recipient_id=getattr(notification, recipient_field), kind=kind,
+                source_id=notification.pk, course_id=course_id, payload=payload,
+                read=notification.read, created=notification.timestamp)
+            if kind != 'material' or item.read:
+                items.append(item)
+                continue
+            key = (item.recipient_id, course_id)
+            if key in digests:
+                earlier = digests[key]
+                item.payload = _fold_material_payload(earlier.payload, item.payload)
+            digests[key] = item
+
+    updated = []
+    if digests:
+        new, updated = _merge_material_digests(digests, batch_size)
+        items += new
+    InboxItem.objects.bulk_create(items, batch_size=batch_size)
+    if updated:
+        # bulk_update sends no signals
+        bump_version('inboxitem', *(f'user:{digest.recipient_id}' for digest in updated))
+    publish_inbox_items(items + updated)
+
+
+def refresh_material_digests(pairs):
+    """
+    Recount the open material digests of (recipient_id, course_id) pairs from the
+    notifications still unread, after some were read or deleted. A digest left
+    with nothing unread is marked read.
+    """
+    from .models import InboxItem, MaterialNotification
+
+    for recipient_id, course_id in pairs:
+        digest = InboxItem.objects.filter(
+            recipient_id=recipient_id, kind='material', course_id=course_id, read=False,
+        ).order_by('-created', '-id').first()
+        if digest is None:
+            continue
+        unread = MaterialNotification.objects.filter(
+            student_id=recipient_id, material__course_id=course_id, read=False)
+        latest = list(unread.order_by('-timestamp', '-id').values_list(
+            'pk', 'material__name')[:DIGEST_MATERIALS])
+        if not latest:
+            digest.read = True
+            digest.save(update_fields=['read'])
+            continue
+        digest.source_id = latest[0][0]
+        digest.payload = {
+            'material': latest[0][1],
+            'course': digest.payload.get('course'),
+            'count': unread.count() if len(latest) == DIGEST_MATERIALS else len(latest),
+            'materials': [name for _, name in latest],
+        }
+        digest.save(update_fields=['source_id', 'payload'])
+
+
+def sync_inbox_read(notification):
+    from .models import InboxItem
+
+    kind = NOTIFICATION_KINDS[notification._meta.model_name]
+    if kind == 'material':
+        refresh_material_digests([(notification.student_id, notification.material.course_id)])
+    InboxItem.objects.filter(
+        kind=kind, source_id=notification.pk,
+    ).exclude(read=notification.read).update(read=notification.read)
+
+
+def remove_from_inbox(notification):
+    from .models import InboxItem
+
+    kind = NOTIFICATION_KINDS[notification._meta.model_name]
+    if kind == 'material' and not notification.read:
+        # Point the digest at the uploads it still stands for instead of dropping it
+        refresh_material_digests([(notification.student_id, notification.material.course_id)])
+    InboxItem.objects.filter(kind=kind, source_id=notification.pk).delete()
+
+
+def retention_cutoff(days=None):
+    """ Creation time before which read notifications are pruned """
+    if days is None:
+        days = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', DEFAULT_NOTIFICATION_RETENTION_DAYS)
+    return django_timezone.now() - timedelta(days=days)
+
+
+def _archive_rows(archive, kind, notifications):
+    for notification in notifications:
+        row = model_to_dict(notification)
+        row.update(kind=kind, timestamp=notification.timestamp)
+        archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+
+
+def prune_notifications(cutoff, batch_size=1000, archive=None):
+    """
+    Delete read notifications created before `cutoff`, and their inbox items, at most
+    `batch_size` rows per transaction so no lock is held for long. Each notification
+    is first written to `archive`, a text file, as a JSON line when one is given.
+    Returns {type: deleted} and the number of read inbox items removed on their own.
+    """
+    from .models import InboxItem
+
+    deleted = {}
+    for kind, model in notification_models().items():
+        deleted[kind] = 0
+        while True:
+            batch = list(model.objects.filter(read=True, timestamp__lt=cutoff).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            if archive is not None:
+                _archive_rows(archive, kind, batch)
+            pks = [notification.pk for notification in batch]
+            with transaction.atomic():
+                InboxItem.objects.filter(kind=kind, source_id__in=pks).delete()
+                model.objects.filter(pk__in=pks).delete()
+            deleted[kind] += len(pks)
+
+    # Read digests whose latest upload is still kept, and items left behind by older code
+    items = 0
+    while True:
+        pks = list(InboxItem.objects.filter(read=True, created__lt=cutoff).order_by('pk').values_list(
+            'pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        InboxItem.objects.filter(pk__in=pks).delete()
+        items += len(pks)
+    return deleted, items
+
+
+def encode_inbox_cursor(item):
+    return encode_cursor(item.created, item.pk)
+
+
+def decode_inbox_cursor(cursor):
+    """ Return the (created, id) position a cursor points at, or None for a missing or malformed cursor """
+    return decode_cursor(cursor)
+
+
+def inbox_page(recipient_id, kinds=None, unread_only=True, cursor=None, limit=20):
+    """
+    Return (items, next_cursor) for one page of a user's inbox, newest first.
+    Pages continue from the (created, id) of the previous page's last item, so every
+    page is a range scan of the (recipient, read, created) index without OFFSET.
+    """
+    from .models import InboxItem
+
+    items = InboxItem.objects.filter(recipient_id=recipient_id)
+    if unread_only:
+        items = items.filter(read=False)
+    if kinds:
+        items = items.filter(kind__in=kinds)
+    position = decode_inbox_cursor(cursor)
+    if position is not None:
+        created, pk = position
+        items = items.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+
+    page = list(items.order_by('-created', '-id')[:limit + 1])
+    next_cursor = encode_inbox_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def notification_group(user_id):
+    """ Channel layer group of one user's NotificationConsumer connections """
+    return f'notifications_{user_id}'
+
+
+def serialize_inbox_item(item):
+    return {
+        'id': item.pk,
+        'kind': item.kind,
+        'source_id': item.source_id,
+        'course': item.course_id,
+        'payload': item.payload,
+        'read': item.read,
+        'created': item.created.isoformat(),
+    }
+
+
+async def _group_send_all(channel_layer, events):
+    return await asyncio.gather(
+        *(channel_layer.group_send(notification_group(user_id), event) for user_id, event in events),
+        return_exceptions=True)
+
+
+def _send_to_users(events):
+    """
+    Send (user_id, event) pairs through the channel layer, all at once in a single trip to
+    the event loop; delivery is best effort
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    # A missing push is caught up when the client reconnects, never fail the write for it
+    try:
+        results = async_to_sync(_group_send_all)(channel_layer, events)
+    except Exception:
+        logger.warning("Could not push %d notifications", len(events), exc_info=True)
+        return
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        logger.warning("Could not push %d of %d notifications", len(failures), len(events), exc_info=failures[0])
+
+
+def publish_inbox_items(items):
+    """ Push new inbox items to their recipients' open connections once the transaction commits """
+    events = [(item.recipient_id, {'type': 'notification.created', 'item': serialize_inbox_item(item)})
+              for item in items if not item.read]
+    if events:
+        transaction.on_commit(lambda: _send_to_users(events))
+
+
+def publish_unread_counts(user_ids):
+    """ Push fresh unread counts after notifications were marked read, once the transaction commits """
+    from .notification_counters import unread_summary
+
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: _send_to_users(
+            [(user_id, {'type': 'notification.unread', 'unread': unread_summary(user_id)})
+             for user_id in user_ids]))
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from django.db import connection, connections
+
+
+def _call_in_worker(context, call):
+    try:
+        # Context variables, such as a request's primary-database pin, follow the call
+        return context.run(call)
+    finally:
+        # Worker threads open their own connections, don't leave them to the pool's next task
+        connections.close_all()
+
+
+def can_run_in_parallel():
+    """
+    Whether work may move to other threads. Each thread has its own database connection,
+    which cannot see the rows of a transaction still open on this one.
+    """
+    return not connection.in_atomic_block
+
+
+def run_in_parallel(calls, max_workers, thread_name_prefix='parallel'):
+    """
+    Run zero-argument callables on up to `max_workers` threads and return their results
+    in order, or run them one after the other on this thread when that is not safe.
+    """
+    calls = list(calls)
+    workers = min(max_workers, len(calls))
+    if workers < 2 or not can_run_in_parallel():
+        return [call() for call in calls]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix) as executor:
+        return list(executor.map(_call_in_worker, [copy_context() for _ in calls], calls))
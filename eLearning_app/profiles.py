@@ -0,0 +1,72 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .status_updates import status_update_page
+from .versions import get_versions
+
+# Cached profiles also carry the version stamps in their key, so the timeout only bounds memory use
+DEFAULT_PROFILE_CACHE_TIMEOUT = 300
+
+
+def profile_cache_timeout():
+    return getattr(settings, 'PROFILE_CACHE_TIMEOUT', DEFAULT_PROFILE_CACHE_TIMEOUT)
+
+
+def profile_version_scopes(user):
+    """ Scopes a profile is built from: everything about the user, plus the courses, materials and rooms it lists """
+    return [f'user:{user.pk}', 'course', 'material', 'chatroom']
+
+
+def build_profile(user):
+    """
+    Return everything the profile page lists for `user` except its inbox, in a fixed
+    number of queries whatever the number of courses, materials or rooms:
+    {'user_type', 'enrolled_courses', 'feedback', 'courses_taught', 'status_updates',
+    'status_updates_next', 'chat_rooms'}. Taught courses come with their materials prefetched,
+    and only the first page of status updates is included.
+    """
+    from .models import ChatRoom, Course, Feedback, Material, elearnUser
+
+    user_type = elearnUser.objects.filter(pk=user.pk).values_list('user_type', flat=True).first()
+    profile = {
+        'user_type': user_type,
+        'enrolled_courses': [],
+        'feedback': [],
+        'courses_taught': [],
+        'chat_rooms': list(ChatRoom.objects.filter(members=user.pk).order_by('chat_name')),
+    }
+    profile['status_updates'], profile['status_updates_next'] = status_update_page(user.pk)
+    if user_type == 'student':
+        profile['enrolled_courses'] = list(Course.objects.filter(students=user.pk).order_by('name', 'pk'))
+        profile['feedback'] = list(Feedback.objects.filter(student_id=user.pk).select_related('course'))
+    elif user_type == 'teacher':
+        profile['courses_taught'] = list(
+            Course.objects.filter(teacher_id=user.pk).order_by('name', 'pk').prefetch_related(
+                Prefetch('material_set', queryset=Material.objects.order_by('upload_date', 'id'))))
+    return profile
+
+
+def profile_cache_key(user):
+    versions = get_versions(*profile_version_scopes(user))
+    parts = [f'{scope}={versions[scope]}' for scope in sorted(versions)]
+    return f'profile:{user.pk}:{hashlib.md5("|".join(parts).encode()).hexdigest()}'
+
+
+def get_profile(user):
+    """
+    Return build_profile(user), cached for PROFILE_CACHE_TIMEOUT seconds (0 disables the
+    cache). Any save, delete or relation change behind the profile bumps a version stamp
+    through the model signals and so moves the profile to a new key.
+    """
+    timeout = profile_cache_timeout()
+    if not timeout:
+        return build_profile(user)
+    key = profile_cache_key(user)
+    profile = cache.get(key)
+    if profile is None:
+        profile = build_profile(user)
+        cache.set(key, profile, timeout)
+    return profile
@@ -0,0 +1,162 @@
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Q, Sum, Value, When
+
+# Fields of User whose words are searchable
+INDEXED_USER_FIELDS = ('username', 'first_name', 'last_name')
+# Fields of materials and messages whose words are searchable, by model name
+INDEXED_TEXT_FIELDS = {
+    'material': ('name', 'description'),
+    'message': ('content',),
+}
+
+TOKEN_LENGTH = 64
+
+# Score of each kind of match; every shared trigram adds one
+EXACT_SCORE = 6
+PREFIX_SCORE = 4
+
+# Sorts after every character, so [word, word + PREFIX_END) holds the words starting with `word`
+PREFIX_END = '\U0010ffff'
+
+
+def normalize(text):
+    """ Lowercase `text` and strip accents, so 'Élodie' is found by 'elodie' """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def words(text):
+    """ Split on anything but letters and digits, underscores included: 'john_doe' is 'john' and 'doe' """
+    return [word[:TOKEN_LENGTH] for word in re.findall(r'[^\W_]+', normalize(text))]
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def user_tokens(user):
+    """ Return the (kind, token) pairs indexed for a user """
+    tokens = set()
+    for field in INDEXED_USER_FIELDS:
+        for word in words(getattr(user, field)):
+            tokens.add(('word', word))
+            tokens.update(('trigram', gram) for gram in trigrams(word))
+    return tokens
+
+
+def index_users(users):
+    """ Replace the search tokens of `users` """
+    from .models import UserSearchToken
+
+    users = list(users)
+    with transaction.atomic():
+        UserSearchToken.objects.filter(user__in=[user.pk for user in users]).delete()
+        UserSearchToken.objects.bulk_create(
+            [UserSearchToken(user_id=user.pk, kind=kind, token=token)
+             for user in users for kind, token in user_tokens(user)],
+            batch_size=500)
+
+
+def _token_model(model_name):
+    from .models import MaterialSearchToken, MessageSearchToken
+    return {'material': MaterialSearchToken, 'message': MessageSearchToken}[model_name]
+
+
+def text_tokens(instance):
+    """ Return the distinct words of a material or message """
+    return {word for field in INDEXED_TEXT_FIELDS[instance._meta.model_name]
+            for word in words(getattr(instance, field))}
+
+
+def index_texts(instances, created=False):
+    """ Replace the search tokens of saved materials or messages, all of one model; new ones have none yet """
+    instances = list(instances)
+    if not instances:
+        return
+    name = instances[0]._meta.model_name
+    Token = _token_model(name)
+    with transaction.atomic():
+        if not created:
+            Token.objects.filter(**{f'{name}__in': [instance.pk for instance in instances]}).delete()
+        Token.objects.bulk_create(
+            [Token(**{f'{name}_id': instance.pk}, token=token)
+             for instance in instances for token in text_tokens(instance)],
+            batch_size=500)
+
+
+def matching_texts(queryset, query):
+    """
+    Narrow a queryset of materials or messages to those with a word starting with each
+    word of `query`, each looked up as a range on the token index instead of a scan
+    """
+    name = queryset.model._meta.model_name
+    query_words = words(query)
+    if not query_words:
+        return queryset.none()
+    Token = _token_model(name)
+    for word in query_words:
+        queryset = queryset.filter(pk__in=Token.objects.filter(
+            token__gte=word, token__lt=word + PREFIX_END).values(name))
+    return queryset
+
+
+def _reindex(queryset, index, batch_size):
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return
+        index(batch)
+        last_pk = batch[-1].pk
+
+
+def rebuild_search_index(batch_size=500):
+    """ Index every user, material and message again, `batch_size` at a time """
+    from .models import Material, Message, User
+
+    _reindex(User.objects.only(*INDEXED_USER_FIELDS), index_users, batch_size)
+    _reindex(Material.objects.only(*INDEXED_TEXT_FIELDS['material']), index_texts, batch_size)
+    _reindex(Message.objects.only(*INDEXED_TEXT_FIELDS['message']), index_texts, batch_size)
+
+
+def find_users(query, offset=0, limit=20):
+    """
+    Return (users, has_more): one page of the users matching `query`, best match first.
+
+    Each query word scores an exact word match, a word prefix match (as a range on the
+    (kind, token) index, which any database can scan) and one point per shared trigram,
+    so misspelt or partial words still match. Scoring and ranking run in a single query.
+    """
+    from .models import User
+
+    query_words = words(query)
+    if not query_words:
+        return [], False
+
+    matches, scores, grams = Q(), [], set()
+    for word in query_words:
+        prefix = Q(search_tokens__kind='word', search_tokens__token__gte=word,
+                   search_tokens__token__lt=word + PREFIX_END)
+        matches |= prefix
+        scores += [
+            When(search_tokens__kind='word', search_tokens__token=word, then=Value(EXACT_SCORE)),
+            When(prefix, then=Value(PREFIX_SCORE)),
+        ]
+        grams |= trigrams(word)
+    if grams:
+        trigram = Q(search_tokens__kind='trigram', search_tokens__token__in=grams)
+        matches |= trigram
+        scores.append(When(trigram, then=Value(1)))
+
+    # Rows sharing a single trigram with a long query are noise, ask for half of them
+    min_score = min(PREFIX_SCORE, max(1, len(grams) // 2))
+    users = (User.objects.filter(matches)
+             .annotate(search_score=Sum(Case(*scores, default=Value(0), output_field=IntegerField())))
+             .filter(search_score__gte=min_score)
+             .select_related('elearnuser')
+             .order_by('-search_score', 'username', 'pk'))
+    page = list(users[offset:offset + limit + 1])
+    return page[:limit], len(page) > limit
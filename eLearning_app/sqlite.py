@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def apply_pragmas(cursor, pragmas):
+    """ Run `PRAGMA name = value` for each of `pragmas` on a DB-API cursor """
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_connection(wrapper):
+    """ connection_created handler: apply SQLITE_PRAGMAS to every new SQLite connection """
+    if wrapper.vendor != 'sqlite':
+        return
+    with wrapper.cursor() as cursor:
+        apply_pragmas(cursor, sqlite_pragmas())
+
+
+class WriteQueue:
+    """
+    Runs database writes one at a time on a single thread with its own connection.
+    SQLite allows one writer at a time; writers of one process queue here instead of
+    competing for the lock and failing with "database is locked" once busy_timeout runs out.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+    @staticmethod
+    def _run(call):
+        # Like a request: drop a connection that broke or outlived CONN_MAX_AGE, keep a healthy one
+        close_old_connections()
+        try:
+            return call()
+        finally:
+            close_old_connections()
+
+    async def run(self, call):
+        return await asyncio.wrap_future(self._executor.submit(self._run, call))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteQueue()
+    return _queue
+
+
+def uses_write_queue():
+    """
+    Whether writes go through the single writer: only for a SQLite file shared with other
+    connections. An in-memory database has no other writer to wait for, and inside a test
+    the writer thread could not see the test's uncommitted rows.
+    """
+    return (getattr(settings, 'SQLITE_WRITE_QUEUE', False) and connection.vendor == 'sqlite'
+            and not connection.is_in_memory_db())
+
+
+def database_write(func):
+    """
+    Like channels' database_sync_to_async, for functions that write: on a SQLite file they
+    run on the single writer thread, otherwise on the usual database thread.
+    """
+    fallback = database_sync_to_async(func)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not uses_write_queue():
+            return await fallback(*args, **kwargs)
+        return await get_write_queue().run(partial(func, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,23 @@
+"""
+Django's SQLite backend, with OPTIONS['transaction_mode'] choosing how transactions begin.
+
+Django opens deferred transactions: one that reads first takes the write lock only at its
+first write, and in WAL mode that upgrade fails with "database is locked" at once when
+another connection has written since the read, whatever busy_timeout is. With 'IMMEDIATE'
+every transaction takes the write lock when it begins, where busy_timeout does apply.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    transaction_mode = None
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.transaction_mode = kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
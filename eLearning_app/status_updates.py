@@ -0,0 +1,24 @@
+from django.db.models import Q
+
+from .cursors import decode_cursor, encode_cursor
+
+STATUS_UPDATE_PAGE_SIZE = 10
+
+
+def status_update_page(user_id, cursor=None, limit=STATUS_UPDATE_PAGE_SIZE):
+    """
+    Return (status_updates, next_cursor) for one page of a user's status updates, newest first.
+    Pages continue from the (timestamp, id) of the previous page's last update, so every
+    page is a range scan of the (user, timestamp, id) index however much the user posted.
+    """
+    from .models import StatusUpdate
+
+    status_updates = StatusUpdate.objects.filter(user_id=user_id)
+    position = decode_cursor(cursor)
+    if position is not None:
+        timestamp, pk = position
+        status_updates = status_updates.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+    page = list(status_updates.order_by('-timestamp', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1].timestamp, page[limit - 1].pk) if len(page) > limit else None
+    return page[:limit], next_cursor
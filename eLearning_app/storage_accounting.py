@@ -0,0 +1,126 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Greatest
+from django.template.defaultfilters import filesizeformat
+
+
+def _stored_state(material):
+    return {
+        'course_id': material.course_id,
+        'uploader_id': material.uploader_id,
+        'file_size': material.file_size,
+    }
+
+
+def _adjust(course_id, uploader_id, size, files):
+    """ Add (or with negative values, remove) usage on a course and an uploader counter """
+    from .models import Course, elearnUser
+
+    changes = {
+        'storage_bytes': Greatest(F('storage_bytes') + size, Value(0)),
+        'storage_files': Greatest(F('storage_files') + files, Value(0)),
+    }
+    Course.objects.filter(pk=course_id).update(**changes)
+    elearnUser.objects.filter(pk=uploader_id).update(**changes)
+
+
+def remember_stored_material(material):
+    """ Keep the owner and size currently stored for a material, so a later save can be diffed against it """
+    from .models import Material
+
+    if material.pk is None:
+        material._stored_storage = None
+    else:
+        material._stored_storage = Material.objects.filter(pk=material.pk).values(
+            'course_id', 'uploader_id', 'file_size').first()
+
+
+def apply_material_change(material):
+    """ Move a material's usage between counters after it was created, replaced or reassigned """
+    previous = getattr(material, '_stored_storage', None)
+    current = _stored_state(material)
+    if previous == current:
+        return
+
+    with transaction.atomic():
+        if previous:
+            _adjust(previous['course_id'], previous['uploader_id'],
+                    -previous['file_size'], -1)
+        _adjust(current['course_id'], current['uploader_id'],
+                current['file_size'], 1)
+    material._stored_storage = current
+
+
+def release_material(material):
+    _adjust(material.course_id, material.uploader_id, -material.file_size, -1)
+
+
+def account_new_materials(materials):
+    """ Add a batch of materials created with bulk_create, one update per course and per uploader """
+    from .models import Course, elearnUser
+
+    for model, field in ((Course, 'course_id'), (elearnUser, 'uploader_id')):
+        totals = defaultdict(lambda: [0, 0])
+        for material in materials:
+            totals[getattr(material, field)][0] += material.file_size
+            totals[getattr(material, field)][1] += 1
+        for pk, (size, files) in totals.items():
+            model.objects.filter(pk=pk).update(
+                storage_bytes=F('storage_bytes') + size,
+                storage_files=F('storage_files') + files)
+
+
+def _check_quota(label, used, size, quota):
+    if quota is not None and used + size > quota:
+        raise ValidationError(
+            f"This upload would exceed the {label} storage quota "
+            f"({filesizeformat(used)} of {filesizeformat(quota)} used).")
+
+
+def check_storage_quota(course, uploader, size, replacing=None, pending_course=0, pending_uploader=0):
+    """
+    Raise ValidationError if storing `size` more bytes would exceed the course or uploader quota.
+    `pending_course` and `pending_uploader` are bytes accepted earlier in the same bulk upload.
+    """
+    from .models import Course, elearnUser
+
+    course_used = Course.objects.filter(pk=course.pk).values_list(
+        'storage_bytes', flat=True).first() or 0
+    course_used += pending_course
+    uploader_used = 0
+    if uploader is not None:
+        uploader_used = elearnUser.objects.filter(pk=uploader.pk).values_list(
+            'storage_bytes', flat=True).first() or 0
+        uploader_used += pending_uploader
+
+    # The file being replaced is released when the new one is saved
+    if replacing is not None:
+        if replacing.course_id == course.pk:
+            course_used -= replacing.file_size
+        if uploader is not None and replacing.uploader_id == uploader.pk:
+            uploader_used -= replacing.file_size
+
+    _check_quota("course's", course_used, size,
+                 getattr(settings, 'COURSE_STORAGE_QUOTA', None))
+    if uploader is not None:
+        _check_quota("uploader's", uploader_used, size,
+                     getattr(settings, 'UPLOADER_STORAGE_QUOTA', None))
+
+
+def rebuild_storage_counters():
+    """ Recompute every counter from the recorded material sizes """
+    from .models import Course, Material, elearnUser
+
+    with transaction.atomic():
+        Course.objects.update(storage_bytes=0, storage_files=0)
+        elearnUser.objects.update(storage_bytes=0, storage_files=0)
+        for model, field in ((Course, 'course'), (elearnUser, 'uploader')):
+            totals = Material.objects.values(field).annotate(
+                total=Sum('file_size'), files=Count('id'))
+            for row in totals:
+                model.objects.filter(pk=row[field]).update(
+                    storage_bytes=row['total'] or 0, storage_files=row['files'])
@@ -0,0 +1,21 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def profile_picture_url(user, size='medium', fmt='webp'):
+    """Return the URL of the requested profile picture variant for a user."""
+    return user.profile_picture_url(size, fmt) or ''
+
+
+@register.inclusion_tag('eLearning_app/profile_picture.html')
+def profile_picture(user, size='medium', css_class='', width=None):
+    """Render a <picture> element serving WebP with a JPEG fallback."""
+    return {
+        'user': user,
+        'webp_url': user.profile_picture_url(size, 'webp'),
+        'jpeg_url': user.profile_picture_url(size, 'jpeg'),
+        'css_class': css_class,
+        'width': width,
+    }
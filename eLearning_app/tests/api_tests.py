@@ -1,14 +1,26 @@
-from django.test import TestCase, Client
+import json
+import threading
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.parsers import MultiPartParser
 from rest_framework.test import APIClient
 from rest_framework import status
-from ..models import User
+from ..models import User, Feedback, EnrollmentNotification, MaterialNotification
+from ..autocomplete import reset_index
+from ..change_log import prune_change_log
+from ..timelines import get_store, read_timeline
 from rest_framework_simplejwt.tokens import RefreshToken
+from api import batch
 from django.core.files.uploadedfile import SimpleUploadedFile
 from datetime import date, timedelta
+from django.utils import timezone
 import uuid
 import pytest
+from .mixins import TemporaryMediaMixin
 from .factories import (
     UserFactory,
     ElearnUserFactory,
@@ -21,6 +33,7 @@ from .factories import (
     EnrollmentFactory,
     EnrollmentNotificationFactory,
     MaterialNotificationFactory,
+    BlockNotificationFactory,
 )
 
 
@@ -322,3 +335,544 @@ class APITestCase(TestCase):
         # Assert the response
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], self.material.name)
+
+    def test_material_list_uses_cursor_pagination(self):
+        """
+        Test that materials are paged with an opaque cursor and no total count.
+        """
+        for _ in range(3):
+            MaterialFactory(course=self.course, uploader=self.teacher)
+
+        url = reverse('material-list')
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIn('cursor=', response.data['next'])
+
+        # Follow the cursor to the remaining materials, newest first
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+
+    def test_page_size_is_bounded(self):
+        """
+        Test that clients cannot request pages above the maximum size.
+        """
+        StatusUpdateFactory.create_batch(105, user=self.student_user)
+
+        url = reverse('statusupdate-list')
+        response = self.client.get(url, {'page_size': 10000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 100)
+
+    def test_status_updates_of_one_user(self):
+        """
+        Test that ?user= pages through one user's status updates only.
+        """
+        StatusUpdateFactory.create_batch(12, user=self.student_user)
+        StatusUpdateFactory.create_batch(3)
+
+        url = reverse('statusupdate-list')
+        response = self.client.get(url, {'user': self.student_user.pk})
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual({row['user']['id'] for row in response.data['results']}, {self.student_user.pk})
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(url, {'user': 'me'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_enrollment_list_is_paginated(self):
+        """
+        Test that several enrollments are returned as a cursor page.
+        """
+        EnrollmentFactory(course=self.course)
+
+        url = reverse('enrollment-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_sparse_fieldset_on_courses(self):
+        """
+        Test that ?fields= limits the response and skips the teacher join.
+        """
+        url = reverse('course-list')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'fields': 'id,name,code'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]),
+                         {'id', 'name', 'code'})
+        course_queries = [query['sql'] for query in context.captured_queries
+                          if 'eLearning_app_course' in query['sql']]
+        self.assertFalse(any('JOIN' in sql for sql in course_queries))
+
+    def test_notification_relations_expand_on_request(self):
+        """
+        Test that notification relations are ids unless named in ?expand=.
+        """
+        notification = EnrollmentNotificationFactory(
+            course=self.course, student=self.student, teacher=self.teacher)
+        url = reverse('enrollmentnotification-detail',
+                      kwargs={'pk': notification.pk})
+
+        response = self.client.get(url)
+        self.assertEqual(response.data['course'], self.course.pk)
+        self.assertEqual(response.data['student'], self.student.pk)
+
+        response = self.client.get(url, {'expand': 'course'})
+        self.assertEqual(response.data['course']['code'], self.course.code)
+        self.assertEqual(response.data['student'], self.student.pk)
+
+    def test_notification_summary(self):
+        """
+        Test that the summary returns unread counts from the counter row alone.
+        """
+        EnrollmentFactory(student=self.student, course=self.course)
+        url = reverse('notification-summary')
+        # Authenticating the request, then a single counter lookup
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data['enrollment'], 2)
+        self.assertEqual(response.data['total'], 2)
+
+    def test_mark_notifications_read_before_timestamp(self):
+        """
+        Test that older notifications are marked read with a single UPDATE.
+        """
+        old = MaterialNotification.objects.create(material=self.material, student=self.student)
+        MaterialNotification.objects.filter(pk=old.pk).update(
+            timestamp=timezone.now() - timedelta(days=2))
+        MaterialNotification.objects.create(material=self.material, student=self.student)
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + self.student_access_token)
+        url = reverse('notification-mark-read')
+        before = (timezone.now() - timedelta(days=1)).isoformat()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {'type': 'material', 'before': before}, format='json')
+
+        self.assertEqual(response.data['updated'], 1)
+        # The setUp material notified nobody, so only the newest is left unread
+        self.assertEqual(response.data['unread']['material'], 1)
+        updates = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE "eLearning_app_materialnotification"')]
+        self.assertEqual(len(updates), 1)
+
+    def test_mark_notifications_read_rejects_ids_without_type(self):
+        url = reverse('notification-mark-read')
+        response = self.client.post(url, {'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_inbox_lists_own_unread_items(self):
+        """
+        Test that the inbox endpoint lists the user's unread items across types.
+        """
+        # setUp's enrollment notified both the student and the teacher
+        BlockNotificationFactory(student=self.student, course=self.course, read=True)
+
+        url = reverse('inboxitem-list')
+        response = self.client.get(url, {'unread': 'true'})
+        self.assertEqual([item['kind'] for item in response.data['results']], ['enrollment'])
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + self.student_access_token)
+        response = self.client.get(url)
+        self.assertEqual(sorted(item['kind'] for item in response.data['results']),
+                         ['block', 'enrollment'])
+
+    def test_notification_lists_only_show_own_notifications(self):
+        """
+        Test that users only list notifications addressed to them.
+        """
+        MaterialNotificationFactory(student=self.student)
+        url = reverse('materialnotification-list')
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'], [])
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + self.student_access_token)
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class BulkWriteTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.admin = UserFactory(is_staff=True)
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_bulk_enrollment_reports_errors_per_row(self):
+        """
+        Test that invalid rows are reported by index while the others are enrolled and notified.
+        """
+        enrolled = ElearnUserFactory(user_type='student')
+        EnrollmentFactory(student=enrolled, course=self.course)
+        new_students = ElearnUserFactory.create_batch(2, user_type='student')
+        rows = [
+            {'student': new_students[0].pk, 'course': self.course.pk},
+            {'student': enrolled.pk, 'course': self.course.pk},
+            {'student': self.teacher.pk, 'course': self.course.pk},
+            {'student': new_students[1].pk, 'course': self.course.pk},
+            {'student': new_students[1].pk, 'course': self.course.pk},
+        ]
+
+        self.authenticate(self.admin)
+        response = self.client.post(reverse('enrollment-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row['index'] for row in response.data['created']], [0, 3])
+        self.assertEqual([row['index'] for row in response.data['errors']], [1, 2, 4])
+
+        self.assertEqual(set(self.course.students.all()), set(new_students))
+        self.assertEqual(EnrollmentNotification.objects.filter(
+            teacher=self.teacher, student__in=new_students).count(), 2)
+
+    def test_bulk_enrollment_query_count_does_not_grow_with_rows(self):
+        """
+        Test that validating and writing a batch takes a fixed number of queries.
+        """
+        self.authenticate(self.admin)
+
+        def enroll(count):
+            students = ElearnUserFactory.create_batch(count, user_type='student')
+            rows = [{'student': student.pk, 'course': self.course.pk} for student in students]
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(reverse('enrollment-bulk'), rows, format='json')
+            self.assertEqual(len(response.data['created']), count)
+            return len(context.captured_queries)
+
+        self.assertEqual(enroll(3), enroll(30))
+
+    def test_bulk_enrollment_refreshes_timelines(self):
+        get_store().clear()
+        self.addCleanup(get_store().clear)
+        classmate = ElearnUserFactory(user_type='student')
+        self.course.students.add(classmate)
+        with self.captureOnCommitCallbacks(execute=True):
+            StatusUpdateFactory(user=classmate.user, content='Welcome to the course')
+        self.assertEqual([update.content for update in read_timeline(classmate.pk)[0]], ['Welcome to the course'])
+
+        self.authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('enrollment-bulk'),
+                                        [{'student': self.student.pk, 'course': self.course.pk}], format='json')
+        self.assertEqual(len(response.data['created']), 1)
+        # The new student's timeline is rebuilt with the course's updates; the classmates' are dropped
+        self.assertTrue(get_store().has(self.student.pk))
+        self.assertFalse(get_store().has(classmate.pk))
+        self.assertEqual([update.content for update in read_timeline(self.student.pk)[0]], ['Welcome to the course'])
+
+    def test_bulk_enrollment_requires_staff(self):
+        self.authenticate(self.student.user)
+        rows = [{'student': self.student.pk, 'course': self.course.pk}]
+        response = self.client.post(reverse('enrollment-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_feedback_create_and_update(self):
+        """
+        Test that students create feedback in bulk and can only edit their own.
+        """
+        other = FeedbackFactory(course=self.course)
+        self.authenticate(self.student.user)
+        rows = [
+            {'course': self.course.pk, 'rating': 5, 'comment': 'Great'},
+            {'course': self.course.pk, 'rating': -1, 'comment': 'Invalid'},
+        ]
+        response = self.client.post(reverse('feedback-bulk'), rows, format='json')
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertIn('rating', response.data['errors'][0]['errors'])
+
+        own_id = response.data['created'][0]['id']
+        rows = [{'id': own_id, 'rating': 4}, {'id': other.pk, 'rating': 1}]
+        response = self.client.patch(reverse('feedback-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], [{'index': 0, 'id': own_id}])
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertEqual(Feedback.objects.get(pk=own_id).rating, 4)
+        other.refresh_from_db()
+        self.assertNotEqual(other.comment, 'Invalid')
+
+    def test_bulk_material_upload(self):
+        """
+        Test that a multipart bulk upload stores files, counts storage and notifies students.
+        """
+        self.course.students.add(self.student)
+        self.authenticate(self.teacher.user)
+        rows = [
+            {'course': self.course.pk, 'name': 'Week 1', 'file': 'first'},
+            {'course': self.course.pk, 'name': 'Week 2', 'file': 'missing'},
+            {'course': self.course.pk, 'name': 'Week 3', 'file': 'second'},
+        ]
+        data = {
+            'rows': json.dumps(rows),
+            'first': SimpleUploadedFile('week1.pdf', b'a' * 10),
+            'second': SimpleUploadedFile('week3.pdf', b'b' * 20),
+        }
+        response = self.client.post(reverse('material-bulk'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row['index'] for row in response.data['created']], [0, 2])
+        self.assertIn('file', response.data['errors'][0]['errors'])
+
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.storage_bytes, self.course.storage_files), (30, 2))
+        self.assertEqual(MaterialNotification.objects.filter(student=self.student).count(), 2)
+
+    @override_settings(COURSE_STORAGE_QUOTA=25)
+    def test_bulk_material_upload_counts_earlier_rows_against_quota(self):
+        self.authenticate(self.teacher.user)
+        rows = [{'course': self.course.pk, 'file': 'first'},
+                {'course': self.course.pk, 'file': 'second'}]
+        data = {
+            'rows': json.dumps(rows),
+            'first': SimpleUploadedFile('a.pdf', b'a' * 20),
+            'second': SimpleUploadedFile('b.pdf', b'b' * 20),
+        }
+        response = self.client.post(reverse('material-bulk'), data, format='multipart')
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_bulk_material_update_only_allows_listed_fields(self):
+        material = MaterialFactory(course=self.course, uploader=self.teacher)
+        self.authenticate(self.teacher.user)
+        rows = [{'id': material.pk, 'name': 'Renamed'},
+                {'id': material.pk, 'course': CourseFactory().pk}]
+        response = self.client.patch(reverse('material-bulk'), rows, format='json')
+        self.assertEqual(len(response.data['updated']), 1)
+        self.assertIn('course', response.data['errors'][0]['errors'])
+        material.refresh_from_db()
+        self.assertEqual((material.name, material.course), ('Renamed', self.course))
+
+
+class AutocompleteEndpointTests(TestCase):
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.client = APIClient()
+        self.user = UserFactory(username='ann_lee', first_name='Ann', last_name='Lee')
+        # A random teacher name could also start with 'Ann'
+        CourseFactory(code='ANN101', name='Annotations', teacher__user__first_name='Zoe',
+                      teacher__user__last_name='Park')
+
+    def test_suggests_people_and_courses(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('autocomplete'), {'q': 'Ann'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({(entry['kind'], entry['label']) for entry in response.data},
+                         {('user', 'ann_lee (Ann Lee)'), ('course', 'ANN101 - Annotations')})
+
+        response = self.client.get(reverse('autocomplete'), {'q': 'ann', 'kind': 'course', 'limit': 1})
+        self.assertEqual([entry['kind'] for entry in response.data], ['course'])
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse('autocomplete'), {'q': 'ann'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SearchEndpointTests(TestCase):
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.client = APIClient()
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(code='WEB101', name='Web Development')
+        self.course.students.add(self.student)
+        MaterialFactory(course=self.course, uploader=self.course.teacher, name='Web servers')
+
+    def test_searches_the_requested_kinds(self):
+        self.client.force_authenticate(self.student.user)
+        response = self.client.get(reverse('search'), {'q': 'web'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({(hit['kind'], hit['label']) for hit in response.data},
+                         {('course', 'WEB101 - Web Development'), ('material', 'Web servers (WEB101)')})
+
+        response = self.client.get(reverse('search'), {'q': 'web', 'kind': 'material'})
+        self.assertEqual([hit['kind'] for hit in response.data], ['material'])
+
+        response = self.client.get(reverse('search'), {'q': 'web', 'kind': 'files'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse('search'), {'q': 'web'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BatchRequestTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+        MaterialFactory.create_batch(2, course=self.course, uploader=self.teacher)
+
+        token = RefreshToken.for_user(self.student.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def batch(self, *requests, **options):
+        return self.client.post(reverse('batch'), {'requests': list(requests), **options}, format='json')
+
+    def test_responses_match_individual_requests_in_order(self):
+        paths = [reverse('course-list'), reverse('notification-summary'),
+                 reverse('inboxitem-list') + '?unread=true']
+        response = self.batch(*({'path': path} for path in paths), parallel=True)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for path, sub_response in zip(paths, response.data['responses']):
+            single = self.client.get(path)
+            self.assertEqual(sub_response['status'], single.status_code)
+            self.assertEqual(json.loads(json.dumps(sub_response['body'])), single.json())
+            self.assertEqual(sub_response['headers'].get('ETag'), single.get('ETag'))
+
+    def test_writes_run_in_order(self):
+        response = self.batch(
+            {'method': 'post', 'path': reverse('notification-mark-read'), 'body': {'type': 'material'}},
+            {'path': reverse('notification-summary')},
+        )
+        marked, summary = response.data['responses']
+        self.assertEqual(marked['body']['updated'], 2)
+        self.assertEqual(summary['body']['material'], 0)
+
+    def test_sub_requests_share_authentication(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(*[{'path': reverse('notification-summary')}] * 3)
+        # The batch loads its user once, each summary is then a single counter lookup
+        user_queries = [query for query in queries if f'FROM "{User._meta.db_table}"' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+
+    def test_sub_request_conditional_headers(self):
+        etag = self.client.get(reverse('inboxitem-list'))['ETag']
+        response = self.batch({'path': reverse('inboxitem-list'), 'headers': {'If-None-Match': etag}})
+        self.assertEqual(response.data['responses'][0]['status'], status.HTTP_304_NOT_MODIFIED)
+
+    def test_only_api_endpoints_can_be_batched(self):
+        response = self.batch({'path': reverse('profile')}, {'path': reverse('batch')},
+                              {'path': '/api/missing/'})
+        self.assertEqual([sub['status'] for sub in response.data['responses']], [404] * 3)
+
+    def test_batch_requires_authentication_and_a_bounded_list(self):
+        with override_settings(API_BATCH_MAX_REQUESTS=2):
+            response = self.batch(*[{'path': reverse('course-list')}] * 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.credentials()
+        response = self.batch({'path': reverse('course-list')})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ParallelBatchTests(TransactionTestCase):
+    def test_parallel_reads_run_on_worker_threads(self):
+        student = ElearnUserFactory(user_type='student')
+        MaterialFactory.create_batch(2, course=CourseFactory(), uploader=ElearnUserFactory(user_type='teacher'))
+        client = APIClient()
+        client.force_authenticate(student.user)
+        paths = [reverse('course-list'), reverse('notification-summary'), reverse('inboxitem-list')]
+
+        threads = []
+        original = batch.dispatch_sub_request
+
+        def record_thread(request, item):
+            threads.append(threading.current_thread().name)
+            return original(request, item)
+
+        with mock.patch.object(batch, 'dispatch_sub_request', record_thread):
+            response = client.post(reverse('batch'), {
+                'requests': [{'path': path} for path in paths], 'parallel': True}, format='json')
+        self.assertEqual([sub['status'] for sub in response.data['responses']], [200] * 3)
+        self.assertEqual(response.data['responses'][0]['body']['count'], 1)
+        self.assertTrue(all(name.startswith('api-batch') for name in threads))
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        # The pruning floor is kept in the cache, which outlives each test's database
+        cache.clear()
+        self.client = APIClient()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+        self.material = MaterialFactory(course=self.course, uploader=self.teacher)
+        self.client.force_authenticate(self.student.user)
+        self.token = self.sync()['next']
+
+    def sync(self, since=None):
+        url = reverse('sync') if since is None else f"{reverse('sync')}?since={since}"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_missing_token_asks_for_a_full_resync(self):
+        self.assertEqual(self.client.get(reverse('sync')).data['reset'], True)
+        self.assertEqual(self.sync('bogus')['reset'], True)
+
+    def test_returns_changes_and_tombstones_since_the_token(self):
+        self.course.name = 'Renamed'
+        self.course.save()
+        added = MaterialFactory(course=self.course, uploader=self.teacher)
+        deleted_pk = self.material.pk
+        self.material.delete()
+        MaterialFactory(course=CourseFactory(), uploader=self.teacher)
+
+        data = self.sync(self.token)
+        self.assertFalse(data['reset'])
+        self.assertEqual([course['name'] for course in data['changes']['course']], ['Renamed'])
+        self.assertEqual([material['id'] for material in data['changes']['material']], [added.pk])
+        self.assertEqual(data['deleted']['material'], [deleted_pk])
+        # The new material's notification, and the deleted one's
+        self.assertEqual(len(data['changes']['materialnotification']), 1)
+        self.assertEqual(len(data['deleted']['materialnotification']), 1)
+
+        again = self.sync(data['next'])
+        self.assertEqual((again['changes'], again['deleted']), ({}, {}))
+
+    def test_enrollment_changes_bring_or_drop_the_course(self):
+        other = CourseFactory(teacher=self.teacher)
+        material = MaterialFactory(course=other, uploader=self.teacher)
+        other.students.add(self.student)
+        data = self.sync(self.token)
+        self.assertEqual({course['id'] for course in data['changes']['course']}, {other.pk})
+        self.assertIn(material.pk, [row['id'] for row in data['changes']['material']])
+
+        self.student.enrolled_courses.remove(other)
+        data = self.sync(data['next'])
+        self.assertEqual(data['deleted']['course'], [other.pk])
+        self.assertEqual(data['deleted']['material'], [material.pk])
+
+    def test_messages_are_sent_to_room_members_only(self):
+        room = ChatRoomFactory(admin=self.teacher.user)
+        room.members.add(self.teacher.user)
+        MessageFactory(chat_room=room, user=self.teacher.user)
+        self.assertNotIn('message', self.sync(self.token)['changes'])
+
+        room.members.add(self.student.user)
+        message = MessageFactory(chat_room=room, user=self.teacher.user)
+        self.assertEqual([row['id'] for row in self.sync(self.token)['changes']['message']], [message.pk])
+
+    def test_marking_notifications_read_is_synced(self):
+        self.client.post(reverse('notification-mark-read'), {}, format='json')
+        data = self.sync(self.token)
+        self.assertTrue(all(row['read'] for row in data['changes']['materialnotification']))
+
+    def test_pruned_log_asks_old_tokens_to_resync(self):
+        for name in ('First', 'Second'):
+            self.course.name = name
+            self.course.save()
+        self.assertEqual(prune_change_log(max_entries=10 ** 6)['compacted'] > 0, True)
+        self.assertEqual([row['name'] for row in self.sync(self.token)['changes']['course']], ['Second'])
+
+        token = self.sync(self.token)['next']
+        MaterialFactory(course=self.course, uploader=self.teacher)
+        prune_change_log(max_entries=1)
+        self.assertEqual(self.sync(self.token)['reset'], True)
+        self.assertEqual(self.sync(token)['reset'], True)
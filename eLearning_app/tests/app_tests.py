@@ -1,12 +1,49 @@
-from django.test import TestCase, Client
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import shutil
+import sqlite3
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
+from django.template import Context, Template
 from django.contrib.auth.models import Group, Permission
-from ..models import User, elearnUser, Course, Material, Enrollment, Feedback, StatusUpdate
+from ..models import User, elearnUser, Course, Material, Enrollment, Feedback, StatusUpdate, MaterialNotification, NotificationCounter, InboxItem, Message, MessageArchiveSegment, MessageSearchToken, ChangeLogEntry
 from ..forms import ChatRoomForm, CourseCreationForm, FeedbackForm, MaterialForm, StatusUpdateForm, StudentRegistrationForm, TeacherRegistrationForm
 from django.core.files.uploadedfile import SimpleUploadedFile
 from channels.testing import WebsocketCommunicator
-from ..consumers import ChatConsumer
+from ..consumers import ChatConsumer, NotificationConsumer
+from ..bulk import update_materials
+from ..images import generate_profile_picture_variants
+from ..notification_counters import rebuild_notification_counters, unread_summary
+from ..notifications import _send_to_users, inbox_page, mark_notifications_read, notification_group
+from ..search_index import EXACT_SCORE, find_users
+from .. import autocomplete as autocomplete_module
+from ..autocomplete import autocomplete, reset_index
+from ..unified_search import SEARCHERS, unified_search
+from ..sqlite import WriteQueue, apply_pragmas, sqlite_pragmas, uses_write_queue
+from ..management.commands.benchmark_sqlite import run_profile
+from .. import db_router
+from ..db_router import PIN_COOKIE, ReplicaPinningMiddleware, ReplicaRouter
+from ..versions import compute_validators
+from ..status_updates import status_update_page
+from ..message_archive import archive_cutoff, archive_messages, message_history_page, read_segment
+from ..timelines import get_store, read_timeline
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from .mixins import TemporaryMediaMixin
 from .factories import (
     UserFactory,
     ElearnUserFactory,
@@ -294,6 +331,1008 @@ class IdentificationAndRegistrationTests(TestCase):
         self.assertRedirects(response, reverse('profile'))
 
 
+class ProfilePictureVariantTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), (200, 30, 30)).save(buffer, 'PNG')
+        self.user = UserFactory()
+        self.user.profile_picture = SimpleUploadedFile(
+            'avatar.png', buffer.getvalue(), content_type='image/png')
+        self.user.save()
+
+    def test_upload_schedules_variant_generation(self):
+        user = UserFactory()
+        user.profile_picture = self.user.profile_picture.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.save()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_original_served_until_variants_exist(self):
+        self.assertEqual(self.user.profile_picture_url('small'),
+                         self.user.profile_picture.url)
+
+    def test_generates_square_variants_in_each_format(self):
+        generate_profile_picture_variants(self.user.pk)
+        self.user.refresh_from_db()
+
+        variants = self.user.profile_picture_variants
+        self.assertEqual(variants['source'], self.user.profile_picture.name)
+        for size_name, edge in {'small': 64, 'medium': 160, 'large': 320}.items():
+            for fmt in ('webp', 'jpeg'):
+                path = variants['sizes'][size_name][fmt]
+                with self.user.profile_picture.storage.open(path) as stored:
+                    self.assertEqual(Image.open(stored).size, (edge, edge))
+
+        self.assertTrue(self.user.profile_picture_url(
+            'small', 'webp').endswith('_small.webp'))
+
+    def test_template_tag_renders_variant(self):
+        generate_profile_picture_variants(self.user.pk)
+        self.user.refresh_from_db()
+        rendered = Template(
+            "{% load profile_pictures %}{% profile_picture user 'medium' %}"
+        ).render(Context({'user': self.user}))
+        self.assertIn('_medium.webp', rendered)
+        self.assertIn('_medium.jpeg', rendered)
+        self.assertNotIn('avatar.png', rendered)
+
+
+class StorageAccountingTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.course = CourseFactory(teacher=self.teacher)
+
+    def upload(self, size, **kwargs):
+        return MaterialFactory(course=self.course, uploader=self.teacher,
+                               file=SimpleUploadedFile('notes.txt', b'x' * size), **kwargs)
+
+    def assertUsage(self, obj, size, files):
+        obj.refresh_from_db()
+        self.assertEqual((obj.storage_bytes, obj.storage_files), (size, files))
+
+    def test_upload_and_delete_update_counters(self):
+        first = self.upload(100)
+        self.upload(50)
+        self.assertEqual(first.file_size, 100)
+        self.assertUsage(self.course, 150, 2)
+        self.assertUsage(self.teacher, 150, 2)
+
+        first.delete()
+        self.assertUsage(self.course, 50, 1)
+        self.assertUsage(self.teacher, 50, 1)
+
+    def test_replacing_file_swaps_size(self):
+        material = self.upload(100)
+        material.file = SimpleUploadedFile('notes_v2.txt', b'y' * 30)
+        material.save()
+        material.name = 'Renamed'
+        material.save()
+        self.assertUsage(self.course, 30, 1)
+
+    def test_reassigning_uploader_moves_usage(self):
+        material = self.upload(100)
+        other = ElearnUserFactory(user_type='teacher')
+        material.uploader = other
+        material.save()
+        self.assertUsage(self.teacher, 0, 0)
+        self.assertUsage(other, 100, 1)
+        self.assertUsage(self.course, 100, 1)
+
+    @override_settings(COURSE_STORAGE_QUOTA=120)
+    def test_course_quota_enforced_on_upload(self):
+        self.upload(100)
+        form = MaterialForm(
+            data={'name': 'Big', 'description': '', 'uploader': self.teacher.pk},
+            files={'file': SimpleUploadedFile('big.txt', b'z' * 40)},
+            course=self.course, uploader=self.teacher)
+        self.assertFalse(form.is_valid())
+        self.assertIn('file', form.errors)
+
+    @override_settings(UPLOADER_STORAGE_QUOTA=120)
+    def test_replacement_within_quota_is_allowed(self):
+        material = self.upload(100)
+        form = MaterialForm(
+            data={'name': 'Notes', 'description': '', 'uploader': self.teacher.pk},
+            files={'file': SimpleUploadedFile('notes_v2.txt', b'z' * 110)},
+            instance=material, course=self.course, uploader=self.teacher)
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class NotificationCounterTests(TestCase):
+    def setUp(self):
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    def add_material_notifications(self, count):
+        # Each new material notifies the enrolled student through the post_save receiver
+        materials = MaterialFactory.create_batch(
+            count, course=self.course, uploader=self.teacher)
+        return list(MaterialNotification.objects.filter(material__in=materials))
+
+    def test_enrollment_counts_for_student_and_teacher(self):
+        EnrollmentFactory(student=self.student, course=self.course)
+        self.assertEqual(unread_summary(self.teacher.pk)['enrollment'], 1)
+        self.assertEqual(unread_summary(self.student.pk)['enrollment'], 1)
+
+    def test_new_material_notifies_enrolled_students(self):
+        self.add_material_notifications(1)
+        self.assertEqual(unread_summary(self.student.pk),
+                         {'enrollment': 0, 'material': 1, 'block': 0, 'total': 1})
+
+    def test_mark_read_decrements_once(self):
+        notification = self.add_material_notifications(1)[0]
+        self.client.force_login(self.student.user)
+        url = reverse('mark_notification_as_read', kwargs={
+            'notification_id': notification.pk, 'notification_type': 'material'})
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(unread_summary(self.student.pk)['material'], 0)
+
+        notification.refresh_from_db()
+        notification.read = False
+        notification.save()
+        self.assertEqual(unread_summary(self.student.pk)['material'], 1)
+
+    def test_deleting_unread_notification_decrements(self):
+        notifications = self.add_material_notifications(2)
+        notifications[0].delete()
+        self.assertEqual(unread_summary(self.student.pk)['material'], 1)
+
+    def test_bulk_mark_read_by_course(self):
+        other_course = CourseFactory(teacher=self.teacher)
+        other_course.students.add(self.student)
+        self.add_material_notifications(2)
+        MaterialFactory(course=other_course, uploader=self.teacher)
+
+        self.client.force_login(self.student.user)
+        self.client.post(reverse('mark_notifications_as_read'),
+                         {'type': 'material', 'course': self.course.pk})
+        self.assertEqual(unread_summary(self.student.pk)['material'], 1)
+        self.assertEqual(MaterialNotification.objects.filter(
+            read=False, material__course=other_course).count(), 1)
+
+    def test_bulk_mark_read_ids_require_type(self):
+        notification = self.add_material_notifications(1)[0]
+        self.client.force_login(self.student.user)
+        self.client.post(reverse('mark_notifications_as_read'), {'ids': [notification.pk]})
+        self.assertEqual(unread_summary(self.student.pk)['material'], 1)
+
+    def test_teacher_reading_enrollment_updates_both_counters(self):
+        EnrollmentFactory(student=self.student, course=self.course)
+        self.client.force_login(self.teacher.user)
+        self.client.post(reverse('mark_notifications_as_read'))
+        self.assertEqual(unread_summary(self.teacher.pk)['enrollment'], 0)
+        self.assertEqual(unread_summary(self.student.pk)['enrollment'], 0)
+
+    def test_student_marking_all_read_leaves_the_teachers_inbox(self):
+        EnrollmentFactory(student=self.student, course=self.course)
+        self.add_material_notifications(1)
+        self.client.force_login(self.student.user)
+        self.client.post(reverse('mark_notifications_as_read'))
+        self.assertEqual(unread_summary(self.student.pk)['material'], 0)
+        self.assertEqual(unread_summary(self.teacher.pk),
+                         {'enrollment': 1, 'material': 0, 'block': 0, 'total': 1})
+        self.assertTrue(InboxItem.objects.filter(recipient=self.teacher, kind='enrollment', read=False).exists())
+
+        # Naming the type does not reach the teacher's copy either
+        self.client.post(reverse('mark_notifications_as_read'), {'type': 'enrollment'})
+        self.assertEqual(unread_summary(self.teacher.pk)['enrollment'], 1)
+
+    def test_rebuild_matches_tables(self):
+        self.add_material_notifications(3)
+        EnrollmentFactory(student=self.student, course=self.course)
+        expected = unread_summary(self.student.pk)
+        NotificationCounter.objects.update(material_unread=0, enrollment_unread=0)
+        rebuild_notification_counters()
+        self.assertEqual(unread_summary(self.student.pk), expected)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    def test_enrollment_reaches_both_inboxes(self):
+        EnrollmentFactory(student=self.student, course=self.course)
+        items = InboxItem.objects.filter(kind='enrollment')
+        self.assertEqual({item.recipient_id for item in items},
+                         {self.student.pk, self.teacher.pk})
+        self.assertEqual(items[0].payload['course'], str(self.course))
+
+    def test_read_state_and_deletion_are_mirrored(self):
+        material = MaterialFactory(course=self.course, uploader=self.teacher)
+        notification = MaterialNotification.objects.get(material=material)
+        notification.read = True
+        notification.save()
+        self.assertTrue(InboxItem.objects.get(source_id=notification.pk, kind='material').read)
+
+        notification.delete()
+        self.assertFalse(InboxItem.objects.filter(kind='material').exists())
+
+    def test_bulk_mark_read_updates_inbox(self):
+        MaterialFactory.create_batch(3, course=self.course, uploader=self.teacher)
+        mark_notifications_read(self.student.pk, kinds=['material'])
+        self.assertFalse(InboxItem.objects.filter(read=False).exists())
+
+    def test_inbox_pages_follow_keyset(self):
+        # Uploads to one course share a digest, so spread them over several
+        for course in CourseFactory.create_batch(5, teacher=self.teacher):
+            course.students.add(self.student)
+            MaterialFactory(course=course, uploader=self.teacher)
+        # Equal timestamps must still page without gaps or repeats
+        InboxItem.objects.update(created=InboxItem.objects.first().created)
+
+        seen, cursor = [], None
+        while True:
+            items, cursor = inbox_page(self.student.pk, cursor=cursor, limit=2)
+            seen += [item.pk for item in items]
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(InboxItem.objects.values_list('pk', flat=True), reverse=True))
+
+    def test_profile_renders_inbox(self):
+        material = MaterialFactory(course=self.course, uploader=self.teacher, name='Week 1 slides')
+        self.client.force_login(self.student.user)
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, "New material 'Week 1 slides'")
+        self.assertContains(response, reverse('mark_notification_as_read', kwargs={
+            'notification_id': MaterialNotification.objects.get(material=material).pk,
+            'notification_type': 'material'}))
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.john = UserFactory(username='john_doe', first_name='John', last_name='Doe')
+        self.jane = UserFactory(username='jane_smith', first_name='Jane', last_name='Smith')
+        self.client.force_login(self.john)
+
+    def usernames(self, query, **kwargs):
+        return [user.username for user in find_users(query, **kwargs)[0]]
+
+    def test_matches_word_prefixes_case_and_accent_insensitively(self):
+        self.assertEqual(self.usernames('john'), ['john_doe'])
+        self.assertEqual(self.usernames('ja'), ['jane_smith'])
+        self.assertEqual(self.usernames('DOE'), ['john_doe'])
+        elodie = UserFactory(username='elodie', first_name='Élodie', last_name='Brun')
+        self.assertEqual(self.usernames('elo'), [elodie.username])
+
+    def test_trigrams_match_inside_words(self):
+        self.assertEqual(self.usernames('mith'), ['jane_smith'])
+
+    def test_exact_words_rank_first(self):
+        UserFactory(username='annabel', first_name='Annabel', last_name='Lee')
+        UserFactory(username='ann', first_name='Ann', last_name='Lee')
+        self.assertEqual(self.usernames('ann'), ['ann', 'annabel'])
+
+    def test_ranked_page_is_one_query(self):
+        UserFactory.create_batch(5, last_name='Doe')
+        with self.assertNumQueries(1):
+            users, has_more = find_users('doe', limit=4)
+            [user.elearnuser if hasattr(user, 'elearnuser') else None for user in users]
+        self.assertTrue(has_more)
+        self.assertEqual(len(users), 4)
+
+    def test_index_follows_renames(self):
+        self.jane.last_name = 'Jones'
+        self.jane.save()
+        self.assertEqual(self.usernames('smith'), ['jane_smith'])
+        self.assertEqual(self.usernames('jones'), ['jane_smith'])
+
+        tokens = set(self.jane.search_tokens.values_list('token', flat=True))
+        self.jane.save(update_fields=['last_login'])
+        self.assertEqual(set(self.jane.search_tokens.values_list('token', flat=True)), tokens)
+
+    def test_results_page_links_to_the_next_page(self):
+        UserFactory.create_batch(25, last_name='Doe')
+        response = self.client.get(reverse('search_users'), {'q': 'doe'})
+        self.assertEqual(len(response.context['users']), 20)
+        self.assertContains(response, '?q=doe&page=2')
+        response = self.client.get(reverse('search_users'), {'q': 'doe', 'page': 2})
+        self.assertEqual(len(response.context['users']), 6)
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.teacher = ElearnUserFactory(
+            user=UserFactory(username='ann_lee', first_name='Ann', last_name='Lee'), user_type='teacher')
+        self.course = CourseFactory(teacher=self.teacher, code='CM3035', name='Advanced Web Development')
+
+    def labels(self, prefix, **kwargs):
+        return [entry['label'] for entry in autocomplete(prefix, **kwargs)]
+
+    def test_index_is_built_from_one_query_then_served_from_memory(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.labels('ann'), ['ann_lee (Ann Lee)'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels('cm30'), ['CM3035 - Advanced Web Development'])
+            self.assertEqual(self.labels('web'), ['CM3035 - Advanced Web Development'])
+            self.assertEqual(self.labels('lee'), ['ann_lee (Ann Lee)'])
+
+    def test_exact_matches_come_first_and_results_are_bounded(self):
+        UserFactory(username='annabel', first_name='Annabel', last_name='Smith')
+        UserFactory.create_batch(5, first_name='Annie')
+        self.assertEqual(self.labels('ann', limit=2), ['ann_lee (Ann Lee)', 'annabel (Annabel Smith)'])
+        self.assertEqual(len(self.labels('ann', limit=20)), 7)
+        self.assertEqual(self.labels('a', kinds={'course'}), ['CM3035 - Advanced Web Development'])
+
+    def test_saves_and_deletes_update_a_built_index(self):
+        autocomplete('warm up')
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFactory(username='zoe', first_name='Zoe', last_name='Park')
+            self.course.name = 'Databases'
+            self.course.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels('zoe'), ['zoe (Zoe Park)'])
+            self.assertEqual(self.labels('databases'), ['CM3035 - Databases'])
+            self.assertEqual(self.labels('advanced'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.delete()
+        self.assertEqual(self.labels('cm'), [])
+
+    def test_stale_index_is_served_while_a_background_rebuild_runs(self):
+        autocomplete('warm up')
+        reading, release = threading.Event(), threading.Event()
+
+        def slow_rows():
+            reading.set()
+            release.wait(5)
+            yield ('user', 999, 'bo_kim (Bo Kim)', {'bo_kim', 'bo kim', 'bo', 'kim'})
+
+        with override_settings(AUTOCOMPLETE_MAX_AGE=0), \
+                mock.patch.object(autocomplete_module, 'can_run_in_parallel', return_value=True), \
+                mock.patch.object(autocomplete_module, 'index_rows', slow_rows):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.labels('ann'), ['ann_lee (Ann Lee)'])
+            self.assertTrue(reading.wait(5))
+            rebuild = next(thread for thread in threading.enumerate() if thread.name == 'autocomplete-rebuild')
+            # Searches meanwhile neither wait nor start a second rebuild, and changes made now survive the swap
+            self.assertEqual(self.labels('ann'), ['ann_lee (Ann Lee)'])
+            autocomplete_module.get_index().update('course', 7, 'CM1005 - Algorithms', {'cm1005', 'algorithms'})
+            release.set()
+            rebuild.join(5)
+        self.assertEqual(self.labels('ann'), [])
+        self.assertEqual(self.labels('bo'), ['bo_kim (Bo Kim)'])
+        self.assertEqual(self.labels('algo'), ['CM1005 - Algorithms'])
+
+
+class NotificationDigestTests(TestCase):
+    def setUp(self):
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    def upload(self, *names):
+        return [MaterialFactory(course=self.course, uploader=self.teacher, name=name) for name in names]
+
+    def test_uploads_to_one_course_share_a_digest(self):
+        self.upload('Week 1', 'Week 2', 'Week 3')
+        digest = InboxItem.objects.get(kind='material')
+        self.assertEqual(digest.payload['count'], 3)
+        self.assertEqual(digest.payload['materials'], ['Week 3', 'Week 2', 'Week 1'])
+        self.assertEqual(unread_summary(self.student.pk)['material'], 3)
+
+        self.client.force_login(self.student.user)
+        self.assertContains(self.client.get(reverse('profile')),
+                            '3 new materials have been added to')
+
+    def test_digest_is_recounted_as_materials_are_read(self):
+        self.upload('Week 1', 'Week 2', 'Week 3')
+        notification = MaterialNotification.objects.get(material__name='Week 3')
+        notification.read = True
+        notification.save()
+
+        digest = InboxItem.objects.get(kind='material', read=False)
+        self.assertEqual(digest.payload['count'], 2)
+        self.assertEqual(digest.payload['material'], 'Week 2')
+
+        mark_notifications_read(self.student.pk, kinds=['material'], course_id=self.course.pk)
+        self.assertFalse(InboxItem.objects.filter(kind='material', read=False).exists())
+
+    def test_a_read_digest_is_not_reopened(self):
+        self.upload('Week 1')
+        mark_notifications_read(self.student.pk, kinds=['material'])
+        self.upload('Week 2')
+        self.assertEqual(
+            InboxItem.objects.get(kind='material', read=False).payload['materials'], ['Week 2'])
+
+    def test_prune_removes_old_read_notifications_in_batches(self):
+        self.upload('Week 1', 'Week 2', 'Week 3')
+        mark_notifications_read(self.student.pk, kinds=['material'])
+        MaterialNotification.objects.update(timestamp=timezone.now() - timedelta(days=120))
+        InboxItem.objects.update(created=timezone.now() - timedelta(days=120))
+        self.upload('Week 4')
+
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl') as archive:
+            call_command('prune_notifications', batch_size=2, archive=archive.name, stdout=StringIO())
+            archived = [json.loads(line) for line in archive]
+
+        self.assertEqual(sorted(row['kind'] for row in archived), ['material'] * 3)
+        self.assertEqual(list(MaterialNotification.objects.values_list('material__name', flat=True)),
+                         ['Week 4'])
+        self.assertEqual(InboxItem.objects.filter(kind='material').count(), 1)
+        self.assertEqual(unread_summary(self.student.pk)['material'], 1)
+
+
+class UnifiedSearchTests(TestCase):
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher, code='PY101', name='Python')
+        self.course.students.add(self.student)
+        self.other_course = CourseFactory(teacher=self.teacher, code='DB101', name='Databases')
+        self.room = ChatRoomFactory()
+        self.room.members.add(self.student.user)
+
+    def hits(self, query, **kwargs):
+        return [(hit['kind'], hit['label']) for hit in unified_search(self.student.user, query, **kwargs)]
+
+    def test_materials_and_messages_are_limited_to_what_the_user_can_see(self):
+        MaterialFactory(course=self.course, uploader=self.teacher, name='Python basics')
+        MaterialFactory(course=self.other_course, uploader=self.teacher, name='Python drivers')
+        MessageFactory(chat_room=self.room, content='who is learning python?')
+        MessageFactory(content='python in another room')
+
+        self.assertEqual(self.hits('python', kinds={'material', 'message'}), [
+            ('material', 'Python basics (PY101)'),
+            ('message', f'{self.room.chat_name}: who is learning python?'),
+        ])
+
+    def test_hits_of_every_kind_are_merged_by_score(self):
+        UserFactory(username='pythonista', first_name='Py', last_name='Fan')
+        MaterialFactory(course=self.course, uploader=self.teacher, name='Intro', description='Why python')
+        MaterialFactory(course=self.course, uploader=self.teacher, name='Python basics')
+        MessageFactory(chat_room=self.room, content='Python')
+
+        hits = unified_search(self.student.user, 'python')
+        self.assertEqual({hit['kind'] for hit in hits}, {'user', 'course', 'material', 'message'})
+        self.assertEqual(hits[0]['score'], EXACT_SCORE)
+        scores = [hit['score'] for hit in hits]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(hits[-1]['label'], 'Intro (PY101)')
+
+        self.assertEqual(self.hits('python', limit=2), [
+            ('course', 'PY101 - Python'), ('message', f'{self.room.chat_name}: Python')])
+        self.assertEqual(self.hits('  '), [])
+
+    def test_materials_and_messages_are_found_by_word_prefixes(self):
+        material = MaterialFactory(course=self.course, uploader=self.teacher, name='Python basics',
+                                   description='Lists and loops')
+        message = MessageFactory(chat_room=self.room, content='Who is learning Élixir?')
+        self.assertEqual(self.hits('pyth bas', kinds={'material'}), [('material', 'Python basics (PY101)')])
+        self.assertEqual(self.hits('loops', kinds={'material'}), [('material', 'Python basics (PY101)')])
+        self.assertEqual(self.hits('elix learn', kinds={'message'}),
+                         [('message', f'{self.room.chat_name}: Who is learning Élixir?')])
+        # Words are matched from their start only
+        self.assertEqual(self.hits('ython', kinds={'material'}), [])
+
+        material.name = 'Databases intro'
+        update_materials([material], ['name'])
+        self.assertEqual(self.hits('python', kinds={'material'}), [])
+        self.assertEqual(self.hits('databases', kinds={'material'}), [('material', 'Databases intro (PY101)')])
+
+        message.delete()
+        self.assertFalse(MessageSearchToken.objects.exists())
+
+    def test_a_single_kind_is_searched_on_the_calling_thread(self):
+        threads = []
+
+        def search(user, query, limit):
+            threads.append(threading.current_thread())
+            return []
+
+        with mock.patch.dict(SEARCHERS, {'material': search, 'message': search}):
+            unified_search(self.student.user, 'python', kinds={'material'})
+        self.assertEqual(threads, [threading.current_thread()])
+
+
+class StatusUpdatePagingTests(TestCase):
+    def setUp(self):
+        self.author = UserFactory()
+        StatusUpdateFactory.create_batch(23, user=self.author)
+        StatusUpdateFactory(user=UserFactory())
+        # Updates posted in the same instant are still paged without gaps or repeats
+        StatusUpdate.objects.filter(user=self.author).update(timestamp=timezone.now())
+        self.expected = list(StatusUpdate.objects.filter(user=self.author).order_by('-id').values_list('id', flat=True))
+
+    def test_profile_shows_the_first_page_and_the_partial_continues_it(self):
+        response = self.client.get(reverse('view_other_user_profile', args=[self.author.pk]))
+        shown = [status_update.pk for status_update in response.context['status_updates']]
+        self.assertEqual(shown, self.expected[:10])
+        self.assertContains(response, 'Older status updates')
+
+        cursor = response.context['status_updates_next']
+        while cursor:
+            data = self.client.get(
+                reverse('user_status_updates', args=[self.author.pk]), {'cursor': cursor}).json()
+            shown += [int(pk) for pk in re.findall(r'data-status-update-id="(\d+)"', data['html'])]
+            cursor = data['next']
+        self.assertEqual(shown, self.expected)
+
+    def test_out_of_range_cursors_start_from_the_top(self):
+        self.client.force_login(self.author)
+        for cursor in ('1000000000000000000-1', '-1000000000000000000-1'):
+            data = self.client.get(reverse('user_status_updates', args=[self.author.pk]), {'cursor': cursor}).json()
+            self.assertEqual([int(pk) for pk in re.findall(r'data-status-update-id="(\d+)"', data['html'])],
+                             self.expected[:10])
+        response = self.client.get(reverse('profile'), {'inbox': '1000000000000000000-1'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_own_profile_offers_edit_links_on_its_first_page(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.content.decode().count('>Edit</a>'), 10)
+
+        with self.assertNumQueries(1):
+            page, _ = status_update_page(self.author.pk, limit=5)
+        self.assertEqual([status_update.pk for status_update in page], self.expected[:5])
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.archive_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MESSAGE_ARCHIVE_ROOT=self.archive_root)
+        self.settings_override.enable()
+
+        self.room = ChatRoomFactory()
+        self.author = UserFactory()
+        self.cutoff = archive_cutoff(6)
+        # Seven messages from two old months, then three recent ones, all in posting order
+        old = [self.cutoff - timedelta(days=40)] * 3 + [self.cutoff - timedelta(days=5)] * 4
+        for moment in old + [timezone.now()] * 3:
+            message = MessageFactory(chat_room=self.room, user=self.author)
+            Message.objects.filter(pk=message.pk).update(timestamp=moment)
+        MessageFactory(user=self.author)
+        self.contents = dict(Message.objects.filter(chat_room=self.room).values_list('id', 'content'))
+        self.expected = list(Message.objects.filter(chat_room=self.room).order_by('timestamp', 'id').values_list(
+            'id', flat=True))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.archive_root, ignore_errors=True)
+
+    def test_old_messages_move_into_one_segment_per_month(self):
+        self.assertEqual(archive_messages(self.cutoff, batch_size=2), (7, 2))
+        self.assertEqual(Message.objects.filter(chat_room=self.room).count(), 3)
+        segments = MessageArchiveSegment.objects.filter(chat_room=self.room).order_by('month')
+        self.assertEqual([segment.message_count for segment in segments], [3, 4])
+        self.assertEqual([row['id'] for row in read_segment(segments[0].path)], self.expected[:3])
+        self.assertEqual(segments[1].last_message_id, self.expected[6])
+        # Nothing left to archive
+        self.assertEqual(archive_messages(self.cutoff), (0, 0))
+
+    def test_archiving_is_not_a_deletion_for_sync_clients(self):
+        self.room.members.add(self.author, UserFactory())
+        # Two reads of old messages, then per room and month a savepoint around one segment
+        # lookup, one segment write and a DELETE of the search tokens and of the messages,
+        # whatever the number of messages or members
+        with self.assertNumQueries(14):
+            archive_messages(self.cutoff)
+        self.assertFalse(ChangeLogEntry.objects.filter(model='message', action='delete').exists())
+        # No token is left pointing at an archived message
+        self.assertTrue(MessageSearchToken.objects.filter(message_id__in=self.expected[7:]).exists())
+        self.assertFalse(MessageSearchToken.objects.filter(message_id__in=self.expected[:7]).exists())
+
+    def test_history_pages_read_on_into_the_archive(self):
+        archive_messages(self.cutoff)
+        pages, cursor = [], None
+        while True:
+            page, cursor = message_history_page(self.room.pk, cursor=cursor, limit=4)
+            pages.append([message.pk for message in page])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [self.expected[6:], self.expected[2:6], self.expected[:2]])
+        self.assertEqual([(message.content, message.user) for message in page],
+                         [(self.contents[pk], self.author) for pk in self.expected[:2]])
+        self.assertTrue(all(message.archived for message in page))
+
+    def test_archiving_again_appends_to_the_segment(self):
+        archive_messages(self.cutoff)
+        late = MessageFactory(chat_room=self.room, user=self.author)
+        Message.objects.filter(pk=late.pk).update(timestamp=self.cutoff - timedelta(days=1))
+        archive_messages(self.cutoff)
+
+        segment = MessageArchiveSegment.objects.filter(chat_room=self.room).latest('month')
+        self.assertEqual(segment.message_count, 5)
+        self.assertEqual(segment.last_message_id, late.pk)
+        self.assertEqual(read_segment(segment.path)[-1]['id'], late.pk)
+        page, _ = message_history_page(self.room.pk, limit=20)
+        self.assertEqual([message.pk for message in page], self.expected[:7] + [late.pk] + self.expected[7:])
+
+    def test_chat_room_page_and_history_endpoint(self):
+        call_command('archive_messages', months=6, stdout=StringIO())
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('chat_room_detail', args=[self.room.chat_name]))
+        self.assertEqual([message.pk for message in response.context['messages']], self.expected)
+        self.assertNotContains(response, 'Older messages')
+        # Only messages still in the table can be deleted
+        self.assertEqual(response.content.decode().count('Delete Message'), 3)
+
+        _, cursor = message_history_page(self.room.pk, limit=3)
+        data = self.client.get(reverse('chat_room_history', args=[self.room.pk]), {'cursor': cursor}).json()
+        self.assertEqual([int(pk) for pk in re.findall(r'data-message-id="(\d+)"', data['html'])], self.expected[:7])
+        self.assertIsNone(data['next'])
+        self.assertNotIn('Delete Message', data['html'])
+
+    def test_deleting_a_room_deletes_its_segment_files(self):
+        archive_messages(self.cutoff)
+        paths = [os.path.join(self.archive_root, segment.path) for segment in self.room.archive_segments.all()]
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.delete()
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+
+class SQLiteTuningTests(TestCase):
+    def test_pragmas_are_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64 * 1024)
+
+    def test_write_queue_runs_one_write_at_a_time(self):
+        queue = WriteQueue()
+        self.addCleanup(queue.shutdown)
+        running, overlaps, threads = [], [], set()
+
+        def write():
+            running.append(1)
+            overlaps.append(len(running))
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            running.pop()
+
+        async def submit_all():
+            await asyncio.gather(*(queue.run(write) for _ in range(10)))
+
+        asyncio.run(submit_all())
+        self.assertEqual(overlaps, [1] * 10)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads.pop().startswith('db-writer'))
+
+    def test_in_memory_test_database_skips_the_queue(self):
+        self.assertFalse(uses_write_queue())
+
+    def test_benchmark_reports_every_profile(self):
+        out = StringIO()
+        call_command('benchmark_sqlite', writers=2, readers=1, writes=5, stdout=out)
+        rows = {line[:24].strip(): line.split() for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(set(rows), {'default', 'pragmas', 'pragmas + immediate', 'pragmas + write queue'})
+        # Taking the write lock up front, or having a single writer, never loses a write to a busy database
+        self.assertEqual(rows['pragmas + immediate'][-2], '0')
+        self.assertEqual(rows['pragmas + write queue'][-2], '0')
+
+    def test_deferred_transaction_cannot_write_after_a_stale_read(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stale.sqlite3')
+            reader, writer = (sqlite3.connect(path, isolation_level=None) for _ in range(2))
+            apply_pragmas(reader, sqlite_pragmas())
+            apply_pragmas(writer, sqlite_pragmas())
+            reader.execute('CREATE TABLE message (id INTEGER PRIMARY KEY, body TEXT)')
+            reader.execute('BEGIN')
+            reader.execute('SELECT COUNT(*) FROM message').fetchone()
+            writer.execute("INSERT INTO message (body) VALUES ('first')")
+            started = time.perf_counter()
+            # WAL mode fails the lock upgrade at once: busy_timeout cannot help a deferred transaction
+            with self.assertRaises(sqlite3.OperationalError):
+                reader.execute("INSERT INTO message (body) VALUES ('second')")
+            self.assertLess(time.perf_counter() - started, 1)
+            reader.execute('ROLLBACK')
+            reader.close()
+            writer.close()
+
+    def test_immediate_transactions_lose_no_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            deferred = run_profile(os.path.join(directory, 'deferred.sqlite3'), sqlite_pragmas(), False,
+                                   writers=4, readers=1, writes=50)
+            immediate = run_profile(os.path.join(directory, 'immediate.sqlite3'), sqlite_pragmas(), False,
+                                    writers=4, readers=1, writes=50, begin='BEGIN IMMEDIATE')
+        # (seconds, committed, failed, reads)
+        self.assertEqual(immediate[1:3], (200, 0))
+        self.assertLessEqual(immediate[2], deferred[2])
+
+
+class SQLiteTransactionModeTests(TransactionTestCase):
+    """ Outside the test case's transaction, so atomic blocks begin real transactions """
+
+    def test_atomic_blocks_take_the_write_lock_when_they_begin(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            with transaction.atomic():
+                User.objects.exists()
+        self.assertEqual(statements[0], 'BEGIN IMMEDIATE')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_STICKINESS_SECONDS=7)
+class ReplicaRoutingTests(SimpleTestCase):
+    """ Outside a transaction, as in production; replica health is stubbed, no query runs """
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.healthy = {'replica1': True, 'replica2': True}
+        patcher = mock.patch.object(db_router, 'replica_is_healthy', lambda alias: self.healthy[alias])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handle(self, view, request=None):
+        return ReplicaPinningMiddleware(view)(request or RequestFactory().get('/'))
+
+    def request_reads(self, count, before=lambda: None, request=None):
+        """ The databases `count` reads of one request go to, after calling `before` """
+        reads = []
+
+        def view(request):
+            before()
+            reads.extend(self.router.db_for_read(Course) for _ in range(count))
+            return HttpResponse()
+
+        response = self.handle(view, request)
+        return reads, response
+
+    def test_each_request_reads_from_one_healthy_replica(self):
+        chosen = set()
+        for _ in range(30):
+            reads, _ = self.request_reads(5)
+            self.assertEqual(len(set(reads)), 1)
+            chosen.update(reads)
+        self.assertEqual(chosen, {'replica1', 'replica2'})
+
+        self.healthy['replica2'] = False
+        self.assertEqual({self.request_reads(1)[0][0] for _ in range(20)}, {'replica1'})
+
+    def test_reads_fall_back_to_the_primary_without_healthy_replicas(self):
+        self.healthy.update(replica1=False, replica2=False)
+        self.assertEqual(self.request_reads(2)[0], ['default', 'default'])
+
+    def test_reads_outside_a_request_use_the_primary(self):
+        # Commands, consumers and background threads never read a lagging replica back after their writes
+        self.assertEqual(self.router.db_for_read(Course), 'default')
+        self.assertEqual(self.router.db_for_write(Course), 'default')
+        self.assertEqual(self.router.db_for_read(Course), 'default')
+
+    def test_writes_go_to_the_primary_and_pin_the_rest_of_the_request(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Course))
+            self.assertEqual(self.router.db_for_write(Course), 'default')
+            reads.append(self.router.db_for_read(Course))
+            return HttpResponse()
+
+        response = self.handle(view, RequestFactory().post('/'))
+        self.assertIn(reads[0], ('replica1', 'replica2'))
+        self.assertEqual(reads[1], 'default')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 7)
+
+    def test_a_recent_write_pins_the_next_requests(self):
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        reads, response = self.request_reads(1, request=request)
+        self.assertEqual(reads, ['default'])
+        # Only a write renews the pin
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_responses_built_under_version_stamps_read_the_primary(self):
+        reads, response = self.request_reads(2, before=lambda: compute_validators(['course']))
+        self.assertEqual(reads, ['default', 'default'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'eLearning_app'))
+        self.assertTrue(self.router.allow_migrate('default', 'eLearning_app'))
+
+
+class ReplicaHealthTests(TestCase):
+    def setUp(self):
+        db_router.forget_replica_health()
+        self.addCleanup(db_router.forget_replica_health)
+
+    def test_a_migrated_database_is_healthy(self):
+        self.assertTrue(db_router.check_replica('default'))
+
+    def test_health_is_checked_once_per_interval(self):
+        with mock.patch.object(db_router, 'check_replica', return_value=False) as check:
+            self.assertFalse(db_router.replica_is_healthy('replica1'))
+            self.assertFalse(db_router.replica_is_healthy('replica1'))
+            self.assertEqual(check.call_count, 1)
+            with override_settings(REPLICA_HEALTH_CHECK_INTERVAL=0):
+                db_router.replica_is_healthy('replica1')
+            self.assertEqual(check.call_count, 2)
+
+    def test_reads_stay_on_the_primary_inside_a_transaction(self):
+        reads = []
+
+        def view(request):
+            reads.append(ReplicaRouter().db_for_read(Course))
+            return HttpResponse()
+
+        with override_settings(DATABASE_REPLICAS=['replica1']), \
+                mock.patch.object(db_router, 'replica_is_healthy', return_value=True):
+            ReplicaPinningMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(reads, ['default'])
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        get_store().clear()
+        self.addCleanup(get_store().clear)
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.classmate = ElearnUserFactory(user_type='student')
+        self.outsider = ElearnUserFactory(user_type='student')
+        course = CourseFactory(teacher=self.teacher)
+        course.students.add(self.student, self.classmate)
+        CourseFactory().students.add(self.outsider)
+
+    def post(self, user, content):
+        self.client.force_login(user.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post_status_update'), {'content': content})
+        self.assertEqual(response.status_code, 200)
+
+    def contents(self, user, **kwargs):
+        status_updates, _ = read_timeline(user.pk, **kwargs)
+        return [status_update.content for status_update in status_updates]
+
+    def test_updates_are_pushed_to_classmates_and_teachers(self):
+        self.post(self.student, 'Finished the first assignment')
+        self.post(self.teacher, 'Office hours moved to Friday')
+
+        for user in (self.student, self.classmate, self.teacher):
+            self.assertEqual(self.contents(user), ['Office hours moved to Friday', 'Finished the first assignment'])
+        self.assertEqual(self.contents(self.outsider), [])
+
+        # One range read, then one query for the page's updates and their authors
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.contents(self.classmate)), 2)
+
+        self.client.force_login(self.classmate.user)
+        self.assertContains(self.client.get(reverse('timeline')), 'Office hours moved to Friday')
+
+    @override_settings(TIMELINE_LENGTH=3)
+    def test_timelines_are_bounded_and_skip_deleted_updates(self):
+        for number in range(5):
+            self.post(self.student, f'Update {number}')
+        self.assertEqual(self.contents(self.classmate), ['Update 4', 'Update 3', 'Update 2'])
+
+        StatusUpdate.objects.get(content='Update 3').delete()
+        self.assertEqual(self.contents(self.classmate), ['Update 4', 'Update 2'])
+        _, has_more = read_timeline(self.classmate.pk, limit=1)
+        self.assertTrue(has_more)
+
+    def test_missing_timeline_is_rebuilt_on_read(self):
+        self.post(self.student, 'Before the store was lost')
+        get_store().clear()
+        self.assertEqual(self.contents(self.teacher), ['Before the store was lost'])
+        # Built now, even though empty
+        self.assertEqual(self.contents(self.outsider), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contents(self.outsider), [])
+
+    def test_enrollment_changes_refresh_timelines(self):
+        self.post(self.outsider, 'Hello from another course')
+        self.post(self.student, 'Finished the first assignment')
+        self.assertEqual(self.contents(self.outsider), ['Hello from another course'])
+        self.assertEqual(self.contents(self.classmate), ['Finished the first assignment'])
+
+        course = self.student.enrolled_courses.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            course.students.add(self.outsider)
+        self.assertEqual(self.contents(self.outsider), ['Finished the first assignment', 'Hello from another course'])
+        self.assertEqual(self.contents(self.classmate), ['Finished the first assignment', 'Hello from another course'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outsider.enrolled_courses.remove(course)
+        self.assertEqual(self.contents(self.outsider), ['Hello from another course'])
+        self.assertEqual(self.contents(self.teacher), ['Finished the first assignment'])
+
+    def test_rebuild_command_needs_redis(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_timelines', stdout=StringIO())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationConsumerTests(TestCase):
+    def setUp(self):
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(), '/ws/notifications/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    @database_sync_to_async
+    def upload_material(self, name):
+        # Pushes are sent once the upload is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            MaterialFactory(course=self.course, uploader=self.teacher, name=name)
+
+    async def test_connect_sends_catch_up(self):
+        await self.upload_material('Week 1')
+        communicator, connected = await self.connect(self.student.user)
+        self.assertTrue(connected)
+
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['type'], 'catch_up')
+        self.assertEqual([item['payload']['material'] for item in message['items']], ['Week 1'])
+        self.assertEqual(message['unread']['material'], 1)
+        await communicator.disconnect()
+
+    async def test_new_notification_is_pushed(self):
+        communicator, _ = await self.connect(self.student.user)
+        await communicator.receive_json_from()
+
+        await self.upload_material('Week 2')
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['type'], 'notification')
+        self.assertEqual(message['item']['payload']['material'], 'Week 2')
+        await communicator.disconnect()
+
+    async def test_mark_read_pushes_unread_counts(self):
+        await self.upload_material('Week 3')
+        communicator, _ = await self.connect(self.student.user)
+        await communicator.receive_json_from()
+
+        @database_sync_to_async
+        def read_all():
+            with self.captureOnCommitCallbacks(execute=True):
+                mark_notifications_read(self.student.pk)
+        await read_all()
+        message = await communicator.receive_json_from()
+        self.assertEqual(message, {'type': 'unread', 'unread': {
+            'enrollment': 0, 'material': 0, 'block': 0, 'total': 0}})
+        await communicator.disconnect()
+
+    async def test_anonymous_connection_is_refused(self):
+        _, connected = await self.connect(AnonymousUser())
+        self.assertFalse(connected)
+
+    def test_pushes_are_sent_concurrently_in_one_batch(self):
+        channel_layer = get_channel_layer()
+        sending = []
+
+        async def group_send(group, message):
+            sending.append(group)
+            await asyncio.sleep(0.05)
+            if group == notification_group(self.student.pk):
+                raise ConnectionError('channel layer is down')
+            sending.remove(group)
+
+        events = [(user_id, {'type': 'notification.unread'})
+                  for user_id in (self.student.pk, self.teacher.pk, ElearnUserFactory().pk)]
+        with mock.patch.object(channel_layer, 'group_send', group_send), \
+                self.assertLogs('eLearning_app.notifications', 'WARNING') as logs:
+            started = time.perf_counter()
+            _send_to_users(events)
+        # The three sends overlapped; the failed one is reported once, the others still went out
+        self.assertLess(time.perf_counter() - started, 0.15)
+        self.assertEqual(sending, [notification_group(self.student.pk)])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('1 of 3', logs.output[0])
+
+
 class ChatConsumerTestCase(TestCase):
     # Wraps the setUp method to allow database operations
     @database_sync_to_async
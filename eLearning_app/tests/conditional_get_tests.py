@@ -0,0 +1,256 @@
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from eLearning_app.models import EnrollmentNotification
+from eLearning_app.notifications import mark_notifications_read
+from .mixins import TemporaryMediaMixin
+from .factories import (
+    UserFactory,
+    ElearnUserFactory,
+    CourseFactory,
+    MaterialFactory,
+    StatusUpdateFactory,
+    ChatRoomFactory,
+    MessageFactory,
+    EnrollmentNotificationFactory,
+    BlockNotificationFactory,
+)
+
+
+class ConditionalGetTestMixin(TemporaryMediaMixin):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    def assertRevalidates(self, url, change):
+        """The resource answers 304 until `change` runs, then serves a fresh 200."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class APIConditionalGetTests(ConditionalGetTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.authenticate(self.teacher.user)
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_course_list(self):
+        def rename():
+            self.course.name = 'Renamed'
+            self.course.save()
+        self.assertRevalidates(reverse('course-list'), rename)
+
+    def test_course_detail_follows_teacher_name(self):
+        def rename_teacher():
+            self.teacher.user.first_name = 'Changed'
+            self.teacher.user.save()
+        self.assertRevalidates(
+            reverse('course-detail', kwargs={'pk': self.course.pk}), rename_teacher)
+
+    def test_material_list(self):
+        MaterialFactory(course=self.course, uploader=self.teacher)
+        self.assertRevalidates(reverse('material-list'), lambda: MaterialFactory(
+            course=self.course, uploader=self.teacher))
+
+    def test_material_detail(self):
+        material = MaterialFactory(course=self.course, uploader=self.teacher)
+
+        def edit():
+            material.description = 'Updated'
+            material.save()
+        self.assertRevalidates(
+            reverse('material-detail', kwargs={'pk': material.pk}), edit)
+
+    def test_material_list_follows_enrollment(self):
+        self.authenticate(self.student.user)
+        MaterialFactory(course=self.course, uploader=self.teacher)
+        self.assertRevalidates(
+            reverse('material-list'), lambda: self.course.students.remove(self.student))
+
+    def test_user_profile(self):
+        def edit():
+            self.teacher.user.email = 'new@example.com'
+            self.teacher.user.save()
+        self.assertRevalidates(
+            reverse('user-detail', kwargs={'pk': self.teacher.user.pk}), edit)
+
+    def test_status_updates(self):
+        self.assertRevalidates(reverse('statusupdate-list'),
+                               lambda: StatusUpdateFactory(user=self.student.user))
+
+    def test_chat_rooms(self):
+        room = ChatRoomFactory(admin=self.teacher.user)
+        self.assertRevalidates(reverse('chatroom-list'),
+                               lambda: room.members.add(self.student.user))
+
+    def test_enrollment_notifications(self):
+        notification = EnrollmentNotificationFactory(
+            course=self.course, student=self.student, teacher=self.teacher)
+
+        def mark_read():
+            notification.read = True
+            notification.save()
+        self.assertRevalidates(
+            reverse('enrollmentnotification-list'), mark_read)
+
+    def test_notification_detail_follows_bulk_mark_read(self):
+        notification = BlockNotificationFactory(course=self.course, student=self.student)
+        self.authenticate(self.student.user)
+        self.assertRevalidates(reverse('blocknotification-detail', kwargs={'pk': notification.pk}),
+                               lambda: mark_notifications_read(self.student.pk, kinds=['block']))
+
+    def test_validators_vary_by_user(self):
+        url = reverse('course-list')
+        etag = self.client.get(url)['ETag']
+        self.authenticate(self.student.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_skips_queries(self):
+        url = reverse('material-list')
+        MaterialFactory(course=self.course, uploader=self.teacher)
+        etag = self.client.get(url)['ETag']
+        # Authentication and the teacher lookup are all that remain
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class PageConditionalGetTests(ConditionalGetTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.client.force_login(self.student.user)
+
+    def test_profile_page(self):
+        self.assertRevalidates(reverse('profile'), lambda: StatusUpdateFactory(
+            user=self.student.user))
+
+    def test_profile_page_follows_notifications(self):
+        self.client.force_login(self.teacher.user)
+        # The factory mutes post_save, create the notification the way the app does
+        self.assertRevalidates(reverse('profile'), lambda: EnrollmentNotification.objects.create(
+            course=self.course, student=self.student, teacher=self.teacher))
+
+    def test_course_detail_page(self):
+        chat_room = ChatRoomFactory(
+            chat_name=f"Course {self.course.pk} Discussion", admin=self.teacher.user)
+        self.assertRevalidates(
+            reverse('course_detail', kwargs={'course_id': self.course.pk}),
+            lambda: MessageFactory(chat_room=chat_room, user=self.student.user))
+
+    def test_course_detail_follows_materials(self):
+        # The first visit creates the discussion room, which is itself a change
+        self.client.get(reverse('course_detail', kwargs={'course_id': self.course.pk}))
+        self.assertRevalidates(
+            reverse('course_detail', kwargs={'course_id': self.course.pk}),
+            lambda: MaterialFactory(course=self.course, uploader=self.teacher))
+
+    def test_course_list_page(self):
+        self.assertRevalidates(reverse('course_list'), lambda: CourseFactory())
+
+    def test_other_user_profile_page(self):
+        self.assertRevalidates(
+            reverse('view_other_user_profile', kwargs={'user_id': self.teacher.user.pk}),
+            lambda: StatusUpdateFactory(user=self.teacher.user))
+
+
+class APIResponseCacheTests(ConditionalGetTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.authenticate(self.teacher.user)
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def stats(self):
+        admin = UserFactory(is_staff=True)
+        self.authenticate(admin)
+        return self.client.get(reverse('response-cache-stats')).json()
+
+    def test_repeated_list_is_served_from_cache(self):
+        MaterialFactory(course=self.course, uploader=self.teacher)
+        url = reverse('material-list')
+        first = self.client.get(url)
+        # Only authenticating the request and looking up its role are left
+        with self.assertNumQueries(2):
+            second = self.client.get(url)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.stats()['material'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_save_invalidates_cached_list(self):
+        url = reverse('course-list')
+        self.client.get(url)
+        self.course.name = 'Renamed'
+        self.course.save()
+        names = [course['name'] for course in self.client.get(url).json()['results']]
+        self.assertEqual(names, ['Renamed'])
+
+    def test_delete_invalidates_cached_detail(self):
+        material = MaterialFactory(course=self.course, uploader=self.teacher)
+        url = reverse('material-detail', kwargs={'pk': material.pk})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        material.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_relation_change_invalidates_cached_list(self):
+        room = ChatRoomFactory(admin=self.teacher.user)
+        url = reverse('chatroom-list')
+        self.client.get(url)
+        room.members.add(self.student.user)
+        members = self.client.get(url).json()['results'][0]['members']
+        self.assertIn(self.student.user.pk, [member['id'] for member in members])
+
+    def test_per_user_lists_are_not_shared(self):
+        MaterialFactory(course=self.course, uploader=self.teacher)
+        url = reverse('material-list')
+        self.authenticate(self.student.user)
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+
+        self.authenticate(ElearnUserFactory(user_type='student').user)
+        self.assertEqual(self.client.get(url).json()['results'], [])
+
+    def test_course_lists_are_cached_per_teacher_and_shared_by_students(self):
+        other_course = CourseFactory()
+        CourseFactory(enrollment_status='closed')
+        classmate = ElearnUserFactory(user_type='student')
+        url = reverse('course-list')
+
+        def codes(user):
+            self.authenticate(user)
+            return {course['code'] for course in self.client.get(url).json()['results']}
+
+        self.assertEqual(codes(self.teacher.user), {self.course.code})
+        self.assertEqual(codes(other_course.teacher.user), {other_course.code})
+        self.assertEqual(codes(self.student.user), {self.course.code, other_course.code})
+        self.assertEqual(codes(classmate.user), {self.course.code, other_course.code})
+        # Each teacher misses; the second student is served the first student's entry
+        self.assertEqual(self.stats()['course'], {'hits': 1, 'misses': 3, 'hit_rate': 0.25})
+
+    def test_stats_require_admin(self):
+        response = self.client.get(reverse('response-cache-stats'))
+        self.assertEqual(response.status_code, 403)
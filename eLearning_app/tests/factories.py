@@ -1,6 +1,6 @@
 import factory
 from factory.django import DjangoModelFactory
-from ..models import User, elearnUser, Course, Material, Feedback, StatusUpdate, ChatRoom, Message, Enrollment, EnrollmentNotification, MaterialNotification
+from ..models import User, elearnUser, Course, Material, Feedback, StatusUpdate, ChatRoom, Message, Enrollment, EnrollmentNotification, MaterialNotification, BlockNotification
 from django.contrib.auth.models import Group
 from django.db.models.signals import post_save
 
@@ -109,3 +109,12 @@ class MaterialNotificationFactory(DjangoModelFactory):
 
     material = factory.SubFactory(MaterialFactory)
     student = factory.SubFactory(ElearnUserFactory, user_type='student')
+
+
+class BlockNotificationFactory(DjangoModelFactory):
+    class Meta:
+        model = BlockNotification
+
+    course = factory.SubFactory(CourseFactory)
+    student = factory.SubFactory(ElearnUserFactory, user_type='student')
+    message = factory.Faker('sentence')
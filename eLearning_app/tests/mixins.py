@@ -0,0 +1,16 @@
+import shutil
+import tempfile
+from django.test import override_settings
+
+
+class TemporaryMediaMixin:
+    """ Gives each test an empty MEDIA_ROOT of its own and removes it afterwards """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        # Cleanups run last in, first out: the setting is restored before the directory goes
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(settings_override.disable)
@@ -0,0 +1,204 @@
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from ..models import InboxItem, MaterialNotification, NotificationCounter
+from .mixins import TemporaryMediaMixin
+from .factories import (
+    UserFactory,
+    ElearnUserFactory,
+    CourseFactory,
+    MaterialFactory,
+    FeedbackFactory,
+    StatusUpdateFactory,
+    ChatRoomFactory,
+    EnrollmentFactory,
+    EnrollmentNotificationFactory,
+    MaterialNotificationFactory,
+    BlockNotificationFactory,
+)
+
+
+class APIQueryBudgetTests(TemporaryMediaMixin, TestCase):
+    """
+    Every list endpoint must cost the same number of queries for a page of
+    one row as for a full page, i.e. no per-row lazy loading.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url_name, create_row, as_user=None, initial_rows=1, params=None):
+        """Compare the query count for a small page against a full page."""
+        self.authenticate(as_user or self.teacher.user)
+        url = reverse(url_name)
+        for _ in range(initial_rows):
+            create_row()
+        small_page = self.count_queries(url, params)
+        for _ in range(10):
+            create_row()
+        full_page = self.count_queries(url, params)
+        self.assertEqual(small_page, full_page,
+                         f"{url_name} issues extra queries per row")
+
+    def test_users(self):
+        admin = UserFactory(is_staff=True)
+        ElearnUserFactory(user=admin, user_type='teacher')
+        self.assertConstantQueries('user-list', UserFactory, as_user=admin)
+
+    def test_elearnusers(self):
+        self.assertConstantQueries(
+            'elearnuser-list', lambda: ElearnUserFactory(user_type='student'))
+
+    def test_courses(self):
+        self.assertConstantQueries(
+            'course-list', lambda: CourseFactory(teacher=ElearnUserFactory(user_type='teacher')))
+
+    def test_materials(self):
+        self.assertConstantQueries(
+            'material-list', lambda: MaterialFactory(course=self.course, uploader=self.teacher))
+
+    def test_materials_as_student(self):
+        self.assertConstantQueries(
+            'material-list', lambda: MaterialFactory(course=self.course, uploader=self.teacher),
+            as_user=self.student.user)
+
+    def test_feedbacks(self):
+        self.assertConstantQueries(
+            'feedback-list', lambda: FeedbackFactory(course=self.course))
+
+    def test_statusupdates(self):
+        self.assertConstantQueries('statusupdate-list', StatusUpdateFactory)
+
+    def test_chatrooms(self):
+        def create_room():
+            room = ChatRoomFactory()
+            room.members.add(UserFactory(), UserFactory())
+        self.assertConstantQueries('chatroom-list', create_room)
+
+    def test_enrollments(self):
+        # A single enrollment is returned unwrapped, so start from two rows
+        self.assertConstantQueries(
+            'enrollment-list', lambda: EnrollmentFactory(course=self.course), initial_rows=2)
+
+    def test_enrollment_notifications(self):
+        self.assertConstantQueries(
+            'enrollmentnotification-list',
+            lambda: EnrollmentNotificationFactory(course=self.course, teacher=self.teacher))
+
+    def test_material_notifications(self):
+        self.assertConstantQueries(
+            'materialnotification-list', lambda: MaterialNotificationFactory(student=self.student),
+            as_user=self.student.user)
+
+    def test_block_notifications(self):
+        self.assertConstantQueries(
+            'blocknotification-list',
+            lambda: BlockNotificationFactory(course=self.course, student=self.student),
+            as_user=self.student.user)
+
+    def test_expanded_enrollment_notifications(self):
+        self.assertConstantQueries(
+            'enrollmentnotification-list',
+            lambda: EnrollmentNotificationFactory(course=self.course, teacher=self.teacher),
+            params={'expand': 'course,student,teacher'})
+
+    def test_expanded_material_notifications(self):
+        self.assertConstantQueries(
+            'materialnotification-list', lambda: MaterialNotificationFactory(student=self.student),
+            as_user=self.student.user, params={'expand': 'material,student'})
+
+    def test_expanded_block_notifications(self):
+        self.assertConstantQueries(
+            'blocknotification-list',
+            lambda: BlockNotificationFactory(course=self.course, student=self.student),
+            as_user=self.student.user, params={'expand': 'course,student'})
+
+
+@override_settings(PROFILE_CACHE_TIMEOUT=0)
+class ProfileQueryBudgetTests(TemporaryMediaMixin, TestCase):
+    """ The profile page costs the same number of queries however much it lists """
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+
+    def count_queries(self, user):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def add_course(self):
+        course = CourseFactory(teacher=self.teacher)
+        course.students.add(self.student)
+        MaterialFactory.create_batch(2, course=course, uploader=self.teacher)
+        FeedbackFactory(course=course, student=self.student)
+        room = ChatRoomFactory(admin=self.teacher.user)
+        room.members.add(self.teacher.user, self.student.user)
+        StatusUpdateFactory(user=self.teacher.user)
+        StatusUpdateFactory(user=self.student.user)
+
+    def test_teacher_and_student_profiles(self):
+        self.add_course()
+        teacher_queries, student_queries = self.count_queries(self.teacher.user), self.count_queries(self.student.user)
+        for _ in range(5):
+            self.add_course()
+        self.assertEqual(self.count_queries(self.teacher.user), teacher_queries)
+        self.assertEqual(self.count_queries(self.student.user), student_queries)
+
+    def test_cached_profile_is_rebuilt_after_a_change(self):
+        self.add_course()
+        with override_settings(PROFILE_CACHE_TIMEOUT=300):
+            uncached = self.count_queries(self.teacher.user)
+            self.assertLess(self.count_queries(self.teacher.user), uncached)
+
+            course = CourseFactory(teacher=self.teacher, name='Freshly created')
+            MaterialFactory(course=course, uploader=self.teacher, name='Week 1')
+            self.client.force_login(self.teacher.user)
+            response = self.client.get(reverse('profile'))
+            self.assertContains(response, 'Freshly created')
+            self.assertContains(response, course.material_set.get().file.name)
+
+
+class MaterialUploadQueryBudgetTests(TemporaryMediaMixin, TestCase):
+    """ Saving one material notifies its course's students in batches, not one row at a time """
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+
+    def count_upload_queries(self, students):
+        course = CourseFactory(teacher=self.teacher)
+        course.students.add(*ElearnUserFactory.create_batch(students, user_type='student'))
+        # Prepared up front, so only the save and its receivers are counted
+        material = MaterialFactory.build(course=course, uploader=self.teacher)
+        with CaptureQueriesContext(connection) as context:
+            material.save()
+        self.assertEqual(MaterialNotification.objects.filter(material=material).count(), students)
+        return len(context.captured_queries)
+
+    def test_upload_costs_the_same_for_any_class_size(self):
+        self.assertEqual(self.count_upload_queries(20), self.count_upload_queries(2))
+        self.assertEqual(InboxItem.objects.filter(kind='material').count(), 22)
+        self.assertEqual(NotificationCounter.objects.aggregate(total=Sum('material_unread'))['total'], 22)
@@ -0,0 +1,109 @@
+import re
+from unittest import skipUnless
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from ..models import BlockNotification, Course, EnrollmentNotification, Material, MaterialNotification, MaterialSearchToken, Message, MessageArchiveSegment, MessageSearchToken, StatusUpdate
+from ..notifications import mark_notifications_read
+from ..status_updates import status_update_page
+from ..unified_search import unified_search
+from .mixins import TemporaryMediaMixin
+from .factories import (
+    ElearnUserFactory,
+    CourseFactory,
+    MaterialFactory,
+    StatusUpdateFactory,
+    ChatRoomFactory,
+    MessageFactory,
+    EnrollmentNotificationFactory,
+    BlockNotificationFactory,
+)
+
+
+def query_plan(sql):
+    """ Return the detail column of each step SQLite plans for `sql` """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite's")
+class HotQueryPlanTests(TemporaryMediaMixin, TestCase):
+    """
+    The queries behind the busiest pages and endpoints must find their rows through an
+    index. Each test runs the real code path, then asks SQLite how it plans every SELECT
+    that reads one of the given tables and fails on any full table or index scan.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = ElearnUserFactory(user_type='teacher')
+        self.student = ElearnUserFactory(user_type='student')
+        self.course = CourseFactory(teacher=self.teacher)
+        self.course.students.add(self.student)
+        MaterialFactory(course=self.course, uploader=self.teacher, name='Week 1 slides')
+        BlockNotificationFactory(course=CourseFactory(), student=self.student)
+        EnrollmentNotificationFactory(course=self.course, student=self.student, teacher=self.teacher)
+        StatusUpdateFactory.create_batch(3, user=self.student.user)
+        self.room = ChatRoomFactory(chat_name=f'Course {self.course.pk} Discussion', admin=self.teacher.user)
+        self.room.members.add(self.student.user)
+        MessageFactory.create_batch(3, chat_room=self.room, user=self.student.user)
+        MessageFactory(chat_room=self.room, user=self.student.user, content='Are the week 1 slides up?')
+
+    def assertIndexed(self, run, *models):
+        tables = [model._meta.db_table for model in models]
+        with CaptureQueriesContext(connection) as context:
+            run()
+        checked = 0
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(f'"{table}"' in sql for table in tables):
+                continue
+            checked += 1
+            plan = query_plan(sql)
+            scans = [step for step in plan if re.match(r'SCAN (?!CONSTANT ROW)', step)]
+            self.assertEqual(scans, [], f"Full scan in the plan {plan} of:\n{sql}")
+        self.assertTrue(checked, f"No query read {', '.join(tables)}")
+
+    def test_open_course_list(self):
+        self.client.force_login(self.student.user)
+        self.assertIndexed(lambda: self.client.get(reverse('course_list')), Course, BlockNotification)
+
+    def test_course_detail(self):
+        self.client.force_login(self.teacher.user)
+        self.assertIndexed(lambda: self.client.get(reverse('course_detail', args=[self.course.pk])),
+                           Material, Message, BlockNotification)
+
+    def test_chat_room_messages(self):
+        self.client.force_login(self.student.user)
+        self.assertIndexed(lambda: self.client.get(reverse('chat_room_detail', args=[self.room.chat_name])),
+                           Message, MessageArchiveSegment)
+
+    def test_room_messages_come_in_index_order(self):
+        plan = query_plan(str(Message.objects.filter(chat_room=self.room.pk).order_by('timestamp').query))
+        self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], plan)
+
+    def test_unread_notifications(self):
+        for user in (self.student, self.teacher):
+            self.assertIndexed(lambda: mark_notifications_read(user.pk),
+                               EnrollmentNotification, MaterialNotification, BlockNotification)
+
+    def test_status_updates_of_one_user(self):
+        self.assertIndexed(lambda: status_update_page(self.student.pk), StatusUpdate)
+
+    def test_api_lists_of_the_requesting_user(self):
+        client = APIClient()
+        client.force_authenticate(self.student.user)
+
+        def fetch():
+            for name in ('materialnotification-list', 'blocknotification-list', 'enrollmentnotification-list'):
+                self.assertEqual(client.get(reverse(name)).status_code, 200)
+            self.assertEqual(client.get(reverse('statusupdate-list'), {'user': self.student.pk}).status_code, 200)
+
+        self.assertIndexed(fetch, MaterialNotification, BlockNotification, EnrollmentNotification, StatusUpdate)
+
+    def test_material_and_message_search(self):
+        self.assertIndexed(lambda: unified_search(self.student.user, 'week slides', kinds={'material', 'message'}),
+                           Material, Message, MaterialSearchToken, MessageSearchToken)
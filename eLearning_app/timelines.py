@@ -0,0 +1,202 @@
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+# Status update ids kept per timeline; older ones fall off the end
+DEFAULT_TIMELINE_LENGTH = 500
+
+
+def timeline_length():
+    return getattr(settings, 'TIMELINE_LENGTH', DEFAULT_TIMELINE_LENGTH)
+
+
+class RedisTimelineStore:
+    """
+    One Redis list of status update ids per user, newest first. Redis drops empty lists,
+    so a built timeline without entries is marked by a separate key.
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(user_id):
+        return f'timeline:{user_id}'
+
+    @staticmethod
+    def _empty_key(user_id):
+        return f'timeline-empty:{user_id}'
+
+    def push(self, user_ids, entry_id, length):
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            # Only onto built timelines; a missing one is rebuilt from the database when read
+            pipeline.lpushx(self._key(user_id), entry_id)
+            pipeline.ltrim(self._key(user_id), 0, length - 1)
+            pipeline.delete(self._empty_key(user_id))
+        pipeline.execute()
+
+    def replace(self, user_id, entry_ids):
+        pipeline = self.client.pipeline()
+        pipeline.delete(self._key(user_id), self._empty_key(user_id))
+        if entry_ids:
+            pipeline.rpush(self._key(user_id), *entry_ids)
+        else:
+            pipeline.set(self._empty_key(user_id), 1)
+        pipeline.execute()
+
+    def has(self, user_id):
+        return bool(self.client.exists(self._key(user_id), self._empty_key(user_id)))
+
+    def discard(self, user_ids):
+        keys = [key for user_id in user_ids for key in (self._key(user_id), self._empty_key(user_id))]
+        if keys:
+            self.client.delete(*keys)
+
+    def range(self, user_id, start, stop):
+        return [int(entry_id) for entry_id in self.client.lrange(self._key(user_id), start, stop - 1)]
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self._key('*'))) + list(self.client.scan_iter(
+            match=self._empty_key('*')))
+        if keys:
+            self.client.delete(*keys)
+
+
+class LocalTimelineStore:
+    """
+    Process memory stand-in for Redis, for tests and single-process runs. Every process
+    has its own timelines, each built from the database on first read.
+    """
+
+    def __init__(self):
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+    def push(self, user_ids, entry_id, length):
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                timeline.appendleft(entry_id)
+                while len(timeline) > length:
+                    timeline.pop()
+
+    def replace(self, user_id, entry_ids):
+        with self._lock:
+            self._timelines[user_id] = deque(entry_ids)
+
+    def has(self, user_id):
+        return user_id in self._timelines
+
+    def discard(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._timelines.pop(user_id, None)
+
+    def range(self, user_id, start, stop):
+        with self._lock:
+            timeline = self._timelines.get(user_id, ())
+            return [timeline[i] for i in range(start, min(stop, len(timeline)))]
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """ Redis when TIMELINE_REDIS_URL is set, so every worker shares the timelines, process memory otherwise """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                url = getattr(settings, 'TIMELINE_REDIS_URL', None)
+                _store = RedisTimelineStore(url) if url else LocalTimelineStore()
+    return _store
+
+
+def shared_course_ids(user_id):
+    """ Courses the user teaches or is enrolled in (elearnUser shares its user's primary key) """
+    from .models import Course
+
+    return Course.objects.filter(
+        Q(teacher_id=user_id) | Q(pk__in=Course.students.through.objects.filter(
+            elearnuser_id=user_id).values('course_id'))).values('pk')
+
+
+def timeline_followers(user_id):
+    """ Users shown a user's status updates: themselves, their classmates and the teachers of their courses """
+    from .models import Course
+
+    courses = shared_course_ids(user_id)
+    followers = Course.objects.filter(pk__in=courses).values_list('teacher_id', flat=True).union(
+        Course.students.through.objects.filter(course_id__in=courses).values_list('elearnuser_id', flat=True))
+    return {user_id, *followers}
+
+
+def fan_out_status_update(status_update_id, user_id):
+    """ Push a new status update to the head of its author's followers' timelines """
+    get_store().push(timeline_followers(user_id), status_update_id, timeline_length())
+
+
+def schedule_fan_out(status_update):
+    # Followers must not be sent an id that a rollback removes again
+    status_update_id, user_id = status_update.pk, status_update.user_id
+    transaction.on_commit(lambda: fan_out_status_update(status_update_id, user_id))
+
+
+def rebuild_timeline(user_id):
+    """ Refill a user's timeline from the database, e.g. after Redis lost it or their courses changed """
+    from .models import StatusUpdate
+
+    followed = timeline_followers(user_id)
+    entry_ids = StatusUpdate.objects.filter(user_id__in=followed).order_by('-timestamp', '-id').values_list(
+        'id', flat=True)[:timeline_length()]
+    get_store().replace(user_id, list(entry_ids))
+
+
+def read_timeline(user_id, offset=0, limit=20):
+    """
+    Return (status_updates, has_more): one page of a user's timeline, newest first.
+    The ids come from one range read; updates deleted since they were pushed are skipped.
+    A timeline missing from the store is rebuilt first.
+    """
+    from .models import StatusUpdate
+
+    store = get_store()
+    if not store.has(user_id):
+        # Never built in this store, or lost: read through to the database
+        rebuild_timeline(user_id)
+    entry_ids = store.range(user_id, offset, offset + limit + 1)
+    updates = StatusUpdate.objects.select_related('user').in_bulk(entry_ids[:limit])
+    return [updates[entry_id] for entry_id in entry_ids[:limit] if entry_id in updates], len(entry_ids) > limit
+
+
+def refresh_enrollment_timelines(course_ids, student_ids):
+    """
+    Once the transaction commits, rebuild the timelines of students who joined or left
+    courses, and drop those of everyone else in the courses, whose set of classmates
+    changed too, to be rebuilt when next read.
+    """
+    from .models import Course
+
+    def refresh():
+        store = get_store()
+        members = set(Course.objects.filter(pk__in=course_ids).values_list('teacher_id', flat=True).union(
+            Course.students.through.objects.filter(course_id__in=course_ids).values_list(
+                'elearnuser_id', flat=True)))
+        store.discard(members - set(student_ids))
+        for student_id in student_ids:
+            rebuild_timeline(student_id)
+
+    transaction.on_commit(refresh)
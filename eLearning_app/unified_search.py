@@ -0,0 +1,127 @@
+import heapq
+from functools import partial
+from itertools import chain
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .autocomplete import get_index
+from .parallel import run_in_parallel
+from .search_index import EXACT_SCORE, PREFIX_SCORE, find_users, matching_texts, normalize, words
+
+# Scores of matches found inside a text rather than at its start, or only word by word
+CONTAINS_SCORE = 2
+DESCRIPTION_SCORE = 1
+
+DEFAULT_SEARCH_LIMIT = 20
+
+
+def _hit(kind, pk, label, score, **extra):
+    return {'kind': kind, 'id': pk, 'label': label, 'score': score, **extra}
+
+
+def _text_score(field, query):
+    """ Score an exact, leading or inner match of `query` in `field`, case-insensitively """
+    return [
+        When(**{f'{field}__iexact': query}, then=Value(EXACT_SCORE)),
+        When(**{f'{field}__istartswith': query}, then=Value(PREFIX_SCORE)),
+        When(**{f'{field}__icontains': query}, then=Value(CONTAINS_SCORE)),
+    ]
+
+
+def _word_score(query_words, text_words):
+    """ Score words matched in full, matched by prefix or only close (by trigrams) on the scale of _text_score """
+    if all(word in text_words for word in query_words):
+        return EXACT_SCORE
+    if all(any(text.startswith(word) for text in text_words) for word in query_words):
+        return PREFIX_SCORE
+    return CONTAINS_SCORE
+
+
+def search_people(user, query, limit):
+    """ Users from the token index, ranked by it and rescored so they compare with the other kinds """
+    users, _ = find_users(query, limit=limit)
+    query_words = words(query)
+    return [_hit('user', found.pk, f'{found.username} ({found.first_name} {found.last_name})',
+                 _word_score(query_words, {*words(found.username), *words(found.first_name),
+                                           *words(found.last_name)}))
+            for found in users]
+
+
+def search_courses(user, query, limit):
+    """ Course codes and name words from this process's prefix index """
+    index = get_index()
+    prefix = normalize(query).strip()
+    return [_hit('course', entry['id'], entry['label'],
+                 EXACT_SCORE if prefix in index.keys_of('course', entry['id']) else PREFIX_SCORE)
+            for entry in index.search(query, limit, kinds={'course'})]
+
+
+def visible_course_ids(user):
+    """ Courses whose materials the user may see: the ones they teach or are enrolled in """
+    from .models import Course
+
+    return Course.objects.filter(
+        Q(teacher_id=user.pk) | Q(pk__in=Course.students.through.objects.filter(
+            elearnuser_id=user.pk).values('course_id'))).values('pk')
+
+
+def search_materials(user, query, limit):
+    """ Materials with every query word in their name or description, found on the token index """
+    from .models import Material
+
+    # The scores only compare the few rows the index found
+    materials = (matching_texts(Material.objects.filter(course_id__in=visible_course_ids(user)), query)
+                 .annotate(search_score=Case(*_text_score('name', query), default=Value(DESCRIPTION_SCORE),
+                                             output_field=IntegerField()))
+                 .select_related('course')
+                 .order_by('-search_score', '-upload_date')[:limit])
+    return [_hit('material', material.pk, f'{material.name} ({material.course.code})',
+                 material.search_score, course=material.course_id)
+            for material in materials]
+
+
+def search_messages(user, query, limit):
+    """ Messages of the chat rooms the user is a member of with every query word, found on the token index """
+    from .models import ChatRoom, Message
+
+    rooms = ChatRoom.members.through.objects.filter(user_id=user.pk).values('chatroom_id')
+    messages = (matching_texts(Message.objects.filter(chat_room_id__in=rooms), query)
+                .annotate(search_score=Case(*_text_score('content', query), default=Value(CONTAINS_SCORE),
+                                            output_field=IntegerField()))
+                .select_related('chat_room')
+                .order_by('-search_score', '-timestamp')[:limit])
+    return [_hit('message', message.pk, f'{message.chat_room.chat_name}: {message.content[:80]}',
+                 message.search_score, chat_room=message.chat_room_id)
+            for message in messages]
+
+
+SEARCHERS = {
+    'user': search_people,
+    'course': search_courses,
+    'material': search_materials,
+    'message': search_messages,
+}
+
+
+def search_limit():
+    return getattr(settings, 'SEARCH_RESULT_LIMIT', DEFAULT_SEARCH_LIMIT)
+
+
+def unified_search(user, query, kinds=None, limit=None):
+    """
+    Search every entity type the user can see and return the `limit` best hits, best first.
+
+    Several types are searched on threads of their own (see run_in_parallel), so the total
+    time is close to the slowest search; a single type is searched on this thread and its
+    connection. Each is asked for `limit` hits at most and a bounded heap then keeps the
+    best `limit` of them. Equal scores keep the order of SEARCHERS.
+    """
+    limit = limit or search_limit()
+    query = (query or '').strip()
+    if not query:
+        return []
+    searchers = [searcher for kind, searcher in SEARCHERS.items() if not kinds or kind in kinds]
+    results = run_in_parallel([partial(searcher, user, query, limit) for searcher in searchers],
+                              max_workers=len(searchers), thread_name_prefix='search')
+    return heapq.nlargest(limit, chain.from_iterable(results), key=lambda hit: hit['score'])
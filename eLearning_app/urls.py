@@ -39,12 +39,14 @@ urlpatterns = [
          views.submit_feedback, name='submit_feedback'),
     path('post_status_update/', views.post_status_update,
          name='post_status_update'),
+    path('timeline/', views.timeline, name='timeline'),
     path('status_update/<int:status_update_id>/edit/',
          views.edit_status_update, name='edit_status_update'),
     path('status_update/<int:status_update_id>/delete/',
          views.delete_status_update, name='delete_status_update'),
     path('chat-rooms/', views.chat_rooms, name='chat_rooms'),
     path('chat/<str:room_name>/', views.chat_room_detail, name='chat_room_detail'),
+    path('chat/<int:room_id>/history/', views.chat_room_history, name='chat_room_history'),
     path('chatroom/<int:pk>/edit/', views.edit_chatroom, name='edit_chatroom'),
     path('chatroom/<int:pk>/delete/',
          views.delete_chatroom, name='delete_chatroom'),
@@ -52,9 +54,13 @@ urlpatterns = [
          delete_message, name='delete_message'),
     path('notification/<int:notification_id>/mark_as_read/<str:notification_type>/',
          views.mark_notification_as_read, name='mark_notification_as_read'),
+    path('notifications/mark_as_read/',
+         views.mark_notifications_as_read, name='mark_notifications_as_read'),
     path('search/', views.search_users, name='search_users'),
     path('user/<int:user_id>/', views.view_other_user_profile,
          name='view_other_user_profile'),
+    path('user/<int:user_id>/status_updates/', views.user_status_updates,
+         name='user_status_updates'),
     path('profile/<int:user_id>/', views.user_profile_detail,
          name='user_profile_detail'),
     path('course/<int:course_id>/block_student/<int:student_id>/',
@@ -0,0 +1,134 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .db_router import read_from_primary
+
+# Stamps never expire on their own; a lost stamp is recreated as "now", which only costs one revalidation
+VERSION_TIMEOUT = None
+
+
+def _key(scope):
+    return f'version:{scope}'
+
+
+def _now():
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    """ Return {scope: stamp} for each scope, creating missing stamps at the current time """
+    # What is then built under these stamps must not come from a replica lagging behind them
+    read_from_primary()
+    keys = {_key(scope): scope for scope in scopes}
+    stored = cache.get_many(keys)
+    for key in keys.keys() - stored.keys():
+        # add() keeps a stamp another process created in the meantime
+        cache.add(key, _now(), VERSION_TIMEOUT)
+        stored[key] = cache.get(key)
+    return {keys[key]: stamp for key, stamp in stored.items()}
+
+
+def bump_version(*scopes):
+    """ Mark every given scope as changed """
+    stamp = _now()
+    cache.set_many({_key(scope): stamp for scope in scopes}, VERSION_TIMEOUT)
+
+
+def compute_validators(scopes, *extra):
+    """ Return an (etag, last_modified) pair for a response built from `scopes` and any `extra` request details """
+    versions = get_versions(*scopes)
+    parts = [str(part) for part in extra]
+    parts += [f'{scope}={versions[scope]}' for scope in sorted(versions)]
+    etag = '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(
+        max(versions.values()) / 1e9, tz=timezone.utc) if versions else None
+    return etag, last_modified
+
+
+# Bookkeeping tables no page or API response is built from
+UNVERSIONED_MODELS = {'changelogentry', 'usersearchtoken'}
+
+# Extra scopes touched when an object changes, beyond its own collection and object scope.
+# Recipients stored as elearnUser ids can be used directly, elearnUser shares its user's primary key.
+RELATED_SCOPES = {
+    'elearnuser': lambda elearn_user: [f'user:{elearn_user.pk}'],
+    'course': lambda course: [f'user:{course.teacher_id}'],
+    'material': lambda material: [f'course:{material.course_id}'],
+    'feedback': lambda feedback: [f'course:{feedback.course_id}', f'user:{feedback.student_id}'],
+    'statusupdate': lambda status_update: [f'user:{status_update.user_id}'],
+    'enrollment': lambda enrollment: [f'course:{enrollment.course_id}', f'user:{enrollment.student_id}'],
+    'enrollmentnotification': lambda notification: [
+        f'user:{notification.student_id}', f'user:{notification.teacher_id}'],
+    'materialnotification': lambda notification: [f'user:{notification.student_id}'],
+    'blocknotification': lambda notification: [
+        f'user:{notification.student_id}', f'course:{notification.course_id}'],
+    'chatroom': lambda chat_room: [f'user:{chat_room.admin_id}'],
+    'message': lambda message: [f'chatroom:{message.chat_room_id}'],
+    'messagearchivesegment': lambda segment: [f'chatroom:{segment.chat_room_id}'],
+    'coursediscussion': lambda discussion: [f'course:{discussion.course_id}'],
+    'inboxitem': lambda item: [f'user:{item.recipient_id}'],
+}
+
+
+def version_scopes(instance):
+    """ Scopes to bump when `instance` is saved or deleted """
+    label = instance._meta.model_name
+    scopes = [label, f'{label}:{instance.pk}']
+    related = RELATED_SCOPES.get(label)
+    if related is not None:
+        scopes += related(instance)
+    return scopes
+
+
+def bump_instance_versions(instances):
+    """ Bump the scopes of objects written without signals, e.g. by bulk_create or bulk_update """
+    scopes = {scope for instance in instances for scope in version_scopes(instance)}
+    if scopes:
+        bump_version(*scopes)
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Per-user content: browsers may keep it but must revalidate every time
+    patch_cache_control(response, private=True, no_cache=True)
+
+
+def not_modified_response(request, etag, last_modified):
+    """ Return a 304 response if the request's validators still match, otherwise None """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def conditional_page(scopes_func):
+    """
+    View decorator that answers GET requests with 304 Not Modified, before the
+    view runs any query, while the version scopes the page is built from are
+    unchanged. `scopes_func(request, *args, **kwargs)` returns those scopes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Flash messages are rendered once, so a page that has some must be rebuilt
+            if request.method not in ('GET', 'HEAD') or len(messages.get_messages(request)):
+                return view(request, *args, **kwargs)
+
+            etag, last_modified = compute_validators(
+                scopes_func(request, *args, **kwargs), request.user.pk, request.get_full_path())
+            response = not_modified_response(request, etag, last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
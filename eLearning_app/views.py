@@ -3,14 +3,25 @@ from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.views import LoginView
 from django.contrib import messages
 from .models import User, elearnUser, Course, Enrollment, Material, StatusUpdate, ChatRoom, Message, EnrollmentNotification, MaterialNotification, BlockNotification
-from .forms import StudentRegistrationForm, TeacherRegistrationForm, CourseCreationForm, UserProfileUpdateForm, MaterialForm, FeedbackForm, StatusUpdateForm, ChatRoomForm
+from .forms import StudentRegistrationForm, TeacherRegistrationForm, CourseCreationForm, UserProfileUpdateForm, MaterialForm, FeedbackForm, StatusUpdateForm, ChatRoomForm, MarkNotificationsReadForm
 from django.db import transaction
 from django.db.models import Q
 from django.http import JsonResponse
 from django.template.loader import render_to_string
+from .notifications import inbox_kinds, inbox_page, mark_notifications_read, notification_models, recipient_notifications
+from .search_index import find_users
+from .message_archive import message_history_page
+from .status_updates import status_update_page
+from .timelines import read_timeline
+from .profiles import get_profile, profile_version_scopes
+from .versions import conditional_page
 import logging
 logger = logging.getLogger(__name__)
 
+# Users listed per page of search results
+SEARCH_PAGE_SIZE = 20
+TIMELINE_PAGE_SIZE = 20
+
 
 def index(request):
     return render(request, 'eLearning_app/index.html')
@@ -47,38 +58,26 @@ class CustomLoginView(LoginView):
     template_name = 'eLearning_app/login.html'
 
 
+def profile_scopes(request):
+    # Own page: everything about the user, plus the names of courses, materials and rooms it lists
+    return profile_version_scopes(request.user)
+
+
 @login_required
+@conditional_page(profile_scopes)
 def profile(request):
-    context = {'user': request.user}
+    # Courses, materials, feedback and rooms come from one prefetched, cached view-model
+    profile = get_profile(request.user)
+    context = {'user': request.user, 'profile': profile}
 
-    if hasattr(request.user, 'elearnuser'):
-        if request.user.elearnuser.user_type == 'student':
-            enrolled_courses = request.user.elearnuser.enrolled_courses.all()
-            context['enrolled_courses'] = enrolled_courses
+    if profile['user_type'] is not None:
+        kinds = inbox_kinds(profile['user_type'])
 
-            # Fetch unread enrollment and material notifications
-            enrollment_notifications = EnrollmentNotification.objects.filter(
-                student=request.user.elearnuser, read=False)
-            material_notifications = MaterialNotification.objects.filter(
-                student=request.user.elearnuser, read=False)
-            block_notifications = BlockNotification.objects.filter(
-                student=request.user.elearnuser, read=False)
-
-            context['enrollment_notifications'] = enrollment_notifications
-            context['material_notifications'] = material_notifications
-            context['block_notifications'] = block_notifications
-
-        elif request.user.elearnuser.user_type == 'teacher':
-            courses_taught = Course.objects.filter(
-                teacher=request.user.elearnuser)
-            context['courses_taught'] = courses_taught
+        # Unread notifications of every type come from a single indexed inbox query
+        context['inbox'], context['inbox_next'] = inbox_page(
+            request.user.pk, kinds=kinds, cursor=request.GET.get('inbox'))
+        context['inbox_kinds'] = kinds
 
-            # Fetch unread enrollment notifications for the teacher
-            enrollment_notifications = EnrollmentNotification.objects.filter(
-                teacher=request.user.elearnuser, read=False)
-            context['enrollment_notifications'] = enrollment_notifications
-
-    context['chat_rooms'] = ChatRoom.objects.filter(members=request.user)
     context['status_update_form'] = StatusUpdateForm()
     return render(request, 'eLearning_app/profile.html', context)
 
@@ -120,7 +119,12 @@ def create_course(request):
     return render(request, 'eLearning_app/create_course.html', {'form': form})
 
 
+def course_list_scopes(request):
+    return ['course', f'user:{request.user.pk}']
+
+
 @login_required
+@conditional_page(course_list_scopes)
 def course_list(request):
     courses = Course.objects.filter(enrollment_status='open')
     enrolled_courses = []
@@ -141,7 +145,15 @@ def course_list(request):
     return render(request, 'eLearning_app/course_list.html', context)
 
 
+def course_detail_scopes(request, course_id):
+    # The discussion messages live in the course's chat room
+    chat_room_id = ChatRoom.objects.filter(
+        chat_name=f"Course {course_id} Discussion").values_list('pk', flat=True).first()
+    return [f'course:{course_id}', f'chatroom:{chat_room_id}', 'user']
+
+
 @login_required
+@conditional_page(course_detail_scopes)
 def course_detail(request, course_id):
     course = get_object_or_404(Course, id=course_id)
     teacher = course.teacher.user
@@ -176,8 +188,9 @@ def course_detail(request, course_id):
 
     # Fetch enrolled students and block status
     enrolled_students = course.students.all()
-    blocked_students = {student.user.id: student.blocknotification_set.filter(
-        course=course).exists() for student in enrolled_students}
+    # One lookup for the whole class instead of one per student
+    blocked_ids = set(BlockNotification.objects.filter(course=course).values_list('student_id', flat=True))
+    blocked_students = {student.pk: student.pk in blocked_ids for student in enrolled_students}
 
     # Fetch course discussion messages
     chat_room, created = ChatRoom.objects.get_or_create(
@@ -185,11 +198,10 @@ def course_detail(request, course_id):
         # Set the teacher as the admin if creating a new chat room
         defaults={'admin': teacher}
     )
-    messages = Message.objects.filter(
-        chat_room=chat_room).order_by('timestamp')
-
     # Check if user is enrolled in the course
     is_enrolled = user_is_enrolled(request.user, course)
+    # The latest page; the chat room pages through older and archived messages
+    messages, older_messages = message_history_page(chat_room.pk) if is_enrolled else (None, None)
 
     context = {
         'course': course,
@@ -198,7 +210,8 @@ def course_detail(request, course_id):
         'blocked_students': blocked_students,
         'feedback_form': FeedbackForm(),
         'teacher': teacher,
-        'messages': messages if is_enrolled else None,
+        'messages': messages,
+        'older_messages': older_messages is not None,
         'chat_room': chat_room if is_enrolled else None,
         'is_enrolled': is_enrolled,
     }
@@ -342,7 +355,8 @@ def open_enrollment(request, course_id):
 def add_material(request, course_id):
     course = get_object_or_404(Course, id=course_id)
     if request.method == 'POST':
-        form = MaterialForm(request.POST, request.FILES)
+        form = MaterialForm(request.POST, request.FILES,
+                            course=course, uploader=request.user.elearnuser)
         if form.is_valid():
             material = form.save(commit=False)
             material.course = course
@@ -363,8 +377,8 @@ def edit_material(request, course_id, material_id):
     material = get_object_or_404(Material, id=material_id, course_id=course_id)
 
     if request.method == 'POST':
-        form = MaterialForm(request.POST, request.FILES,
-                            instance=material)
+        form = MaterialForm(request.POST, request.FILES, instance=material,
+                            course=material.course, uploader=request.user.elearnuser)
         if form.is_valid():
             material.uploader = request.user.elearnuser
             form.save()
@@ -428,7 +442,8 @@ def post_status_update(request):
 
             rendered_status_update = render_to_string(
                 'eLearning_app/status_update.html',
-                {'status_update': status_update}
+                {'status_update': status_update},
+                request=request
             )
 
             return JsonResponse({'html': rendered_status_update}, status=200)
@@ -441,6 +456,23 @@ def post_status_update(request):
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
+@login_required
+def timeline(request):
+    """ Status updates of the user's classmates and teachers, read from their fan-out timeline """
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    status_updates, has_next = read_timeline(
+        request.user.pk, offset=(page - 1) * TIMELINE_PAGE_SIZE, limit=TIMELINE_PAGE_SIZE)
+
+    return render(request, 'eLearning_app/timeline.html', {
+        'status_updates': status_updates,
+        'page': page,
+        'has_next': has_next,
+    })
+
+
 @login_required
 def edit_status_update(request, status_update_id):
     status_update = get_object_or_404(StatusUpdate, id=status_update_id)
@@ -481,15 +513,29 @@ def delete_status_update(request, status_update_id):
 
 def chat_room_detail(request, room_name):
     chat_room = get_object_or_404(ChatRoom, chat_name=room_name)
-    messages = Message.objects.filter(
-        chat_room=chat_room).order_by('timestamp')
+    # The latest page only; older pages, archived ones included, load on demand
+    messages, next_cursor = message_history_page(chat_room.pk)
     return render(request, 'eLearning_app/chat_room_detail.html', {
         'room_name': room_name,
         'messages': messages,
+        'next_cursor': next_cursor,
         'chat_room': chat_room
     })
 
 
+def chat_room_history_scopes(request, room_id):
+    return [f'chatroom:{room_id}']
+
+
+@conditional_page(chat_room_history_scopes)
+def chat_room_history(request, room_id):
+    """ The page of a room's messages before the cursor, rendered for the chat log to prepend """
+    chat_room = get_object_or_404(ChatRoom, pk=room_id)
+    messages, next_cursor = message_history_page(chat_room.pk, cursor=request.GET.get('cursor'))
+    html = render_to_string('eLearning_app/message_list.html', {'messages': messages}, request=request)
+    return JsonResponse({'html': html, 'next': next_cursor})
+
+
 @login_required
 def edit_chatroom(request, pk):
     chatroom = get_object_or_404(ChatRoom, pk=pk)
@@ -567,60 +613,71 @@ def mark_notification_as_read(request, notification_id, notification_type):
     logger.debug(
         f"Notification ID: {notification_id}, Type: {notification_type}")
 
-    notification_model = {
-        'enrollment': EnrollmentNotification,
-        'material': MaterialNotification,
-        'block': BlockNotification,
-    }.get(notification_type)
+    notification_model = notification_models().get(notification_type)
 
     if not notification_model:
         messages.error(request, 'Invalid notification type.')
         return redirect('profile')
 
-    try:
-        notification = get_object_or_404(
-            notification_model, id=notification_id, student=request.user.elearnuser)
-    except notification_model.DoesNotExist:
-        messages.error(request, 'Notification not found.')
+    get_object_or_404(recipient_notifications(
+        notification_model, request.user.pk), id=notification_id)
+    mark_notifications_read(
+        request.user.pk, kinds=[notification_type], ids=[notification_id])
+    messages.success(request, 'Notification marked as read.')
+    return redirect('profile')
+
+
+@login_required
+def mark_notifications_as_read(request):
+    """ Mark a selection of notifications as read with one UPDATE per type """
+    if request.method != 'POST':
         return redirect('profile')
 
-    notification.read = True
-    notification.save()
-    messages.success(request, 'Notification marked as read.')
+    form = MarkNotificationsReadForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, 'Invalid notification selection.')
+        return redirect('profile')
+
+    data = form.cleaned_data
+    changed = mark_notifications_read(
+        request.user.pk,
+        kinds=[data['type']] if data['type'] else None,
+        ids=data['ids'] or None,
+        course_id=data['course'],
+        before=data['before'],
+    )
+    messages.success(request, f'{changed} notification(s) marked as read.')
     return redirect('profile')
 
 
 @login_required
 def search_users(request):
-    query = request.GET.get('q')
-    if query:
-        users = User.objects.filter(
-            Q(username__icontains=query) |
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query)
-        )
+    """ Ranked user search over the normalized search index, one page of results per query """
+    query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    users, has_next = find_users(query, offset=(page - 1) * SEARCH_PAGE_SIZE, limit=SEARCH_PAGE_SIZE)
+
+    return render(request, 'eLearning_app/search_results.html', {
+        'users': users,
+        'query': query,
+        'page': page,
+        'has_next': has_next,
+    })
 
-        # Also search within elearnUser (case-insensitive)
-        elearn_users = elearnUser.objects.filter(
-            # Case-insensitive search on username
-            Q(user__username__iexact=query) |
-            Q(user__first_name__iexact=query) |
-            Q(user__last_name__iexact=query)
-        )
 
-        # Combines results and remove duplicates
-        users = list(users) + [eu.user for eu in elearn_users]
-        users = list({u.id: u for u in users}.values())
-    else:
-        users = []
-
-    return render(request, 'eLearning_app/search_results.html', {'users': users})
+def other_user_profile_scopes(request, user_id):
+    return [f'user:{user_id}', 'course']
 
 
+@conditional_page(other_user_profile_scopes)
 def view_other_user_profile(request, user_id):
     user = get_object_or_404(User, id=user_id)
 
     context = {'profile_user': user}
+    context['status_updates'], context['status_updates_next'] = status_update_page(user.pk)
 
     if hasattr(user, 'elearnuser'):
         if user.elearnuser.user_type == 'student':
@@ -634,10 +691,24 @@ def view_other_user_profile(request, user_id):
     return render(request, 'eLearning_app/other_user_profile.html', context)
 
 
+def status_updates_scopes(request, user_id):
+    return [f'user:{user_id}']
+
+
+@conditional_page(status_updates_scopes)
+def user_status_updates(request, user_id):
+    """ The next page of a user's status updates, rendered for the profile pages to append """
+    status_updates, next_cursor = status_update_page(user_id, cursor=request.GET.get('cursor'))
+    html = render_to_string('eLearning_app/status_update_list.html',
+                            {'status_updates': status_updates}, request=request)
+    return JsonResponse({'html': html, 'next': next_cursor})
+
+
 @login_required
 def user_profile_detail(request, user_id):
     user = get_object_or_404(User, id=user_id)
     context = {'profile_user': user}
+    context['status_updates'], context['status_updates_next'] = status_update_page(user.pk)
 
     if hasattr(user, 'elearnuser'):
         if user.elearnuser.user_type == 'student':
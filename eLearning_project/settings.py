@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'eLearning_app.db_router.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,7 +64,8 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # High-volume viewsets switch to the cursor classes in api/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.BoundedPageNumberPagination',
     'PAGE_SIZE': 10,
 }
 
@@ -102,17 +104,103 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Version stamps and cached API responses must be shared by every worker, so
+# production points REDIS_URL at Redis; tests and local runs use process memory
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'elearning',
+        },
+    }
+
+# Seconds a cached API response is kept (entries are invalidated by version stamps)
+API_RESPONSE_CACHE_TIMEOUT = 300
+
+# Largest /api/batch/ request, and threads used when it asks to run its reads in parallel
+API_BATCH_MAX_REQUESTS = 20
+API_BATCH_MAX_WORKERS = 4
+
+# Change log behind /api/sync/, pruned by `manage.py prune_change_log`
+SYNC_LOG_RETENTION_DAYS = 30
+SYNC_LOG_MAX_ENTRIES = 1000000
+
+# Seconds before a process rebuilds its autocomplete index in the background, picking up other processes' changes
+AUTOCOMPLETE_MAX_AGE = 300
+
+# Status update timelines live in Redis when this is set, in process memory otherwise
+TIMELINE_REDIS_URL = os.environ.get('REDIS_URL')
+# Status updates kept on each user's timeline
+TIMELINE_LENGTH = 500
+
+# Seconds a built profile view-model is cached, 0 to build it on every request (entries are invalidated by version stamps)
+PROFILE_CACHE_TIMEOUT = 300
+
+# Hits returned by /api/search/ unless the request asks for fewer
+SEARCH_RESULT_LIMIT = 20
+
+# Whole months of chat messages kept in the database; `manage.py archive_messages` moves older
+# ones into compressed per-room, per-month segment files under MESSAGE_ARCHIVE_ROOT
+MESSAGE_ARCHIVE_AFTER_MONTHS = 6
+MESSAGE_ARCHIVE_ROOT = os.path.join(BASE_DIR, 'message_archive')
+
+# Days read notifications are kept before `manage.py prune_notifications` deletes them
+NOTIFICATION_RETENTION_DAYS = 90
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'eLearning_app.sqlite_backend',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Page and API writes take the write lock when their transaction begins, so they
+        # wait up to busy_timeout for it instead of failing, see eLearning_app/sqlite_backend
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
     }
 }
 
+# Read replicas, e.g. DATABASE_REPLICA_PATHS=/srv/replica1.sqlite3,/srv/replica2.sqlite3 for
+# local SQLite stand-ins refreshed with `manage.py sync_replicas`. Tests read the primary.
+for number, path in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_PATHS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['eLearning_app.db_router.ReplicaRouter']
+# Seconds a client reads from the primary after writing, so it sees its own changes
+REPLICA_STICKINESS_SECONDS = 5
+# Seconds a replica's health check result is reused; unhealthy replicas are skipped
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+
+# Applied to every new SQLite connection, see eLearning_app/sqlite.py. WAL lets pages read
+# while a write is in progress. NORMAL sync keeps the database consistent in WAL mode but
+# does not fsync on each commit, so the last commits can be lost on power failure or an OS
+# crash (use 'full' where that matters). busy_timeout (ms) makes a writer wait for the lock
+# instead of failing with "database is locked"; it only helps transactions that take the
+# lock when they begin, hence IMMEDIATE transactions above.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative sizes are in KiB: 64 MiB of page cache per connection
+    'cache_size': -64 * 1024,
+}
+# Serialize writes from async consumers on one thread per process instead of letting them
+# contend for SQLite's write lock
+SQLITE_WRITE_QUEUE = True
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Password validation
@@ -160,3 +248,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Profile pictures are resized to these square edge lengths (in pixels) after upload
+PROFILE_PICTURE_SIZES = {
+    'small': 64,
+    'medium': 160,
+    'large': 320,
+}
+# Resize in a background worker instead of inside the upload request
+PROFILE_PICTURE_ASYNC = True
+
+# Maximum bytes of course materials per course and per uploader (None for unlimited)
+COURSE_STORAGE_QUOTA = None
+UPLOADER_STORAGE_QUOTA = None